@@ -0,0 +1,14 @@
+"""SERVICE ENTRY POINT: python -m app
+
+app.main IS ONLY IMPORTED BY UVICORN, NEVER RUN AS __main__. THE INGESTION PIPELINE'S SPAWNED
+PARSER PROCESSES RE-IMPORT __main__, SO THEY LOAD THIS FILE AND NOT THE SERVICE SETUP.
+"""
+import uvicorn
+
+
+def main():
+    uvicorn.run("app.main:app", host="0.0.0.0", port=8000)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from app.utils.metrics import LatencyTracker
+import logging
+
+if not logging.getLogger().hasHandlers():
+    from app.config import UbuntuConfig
+    UbuntuConfig.init_logging()
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """THE REQUEST WAS NOT ADMITTED; THE CLIENT SHOULD RETRY AFTER retry_after SECONDS"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """ONE ADMITTED REQUEST; release() IS IDEMPOTENT SO EVERY EXIT PATH MAY CALL IT"""
+
+    def __init__(self, controller: "AdmissionController"):
+        self.controller = controller
+        self.admitted_at = time.perf_counter()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(time.perf_counter() - self.admitted_at)
+
+
+class AdmissionController:
+    """BOUND THE REQUESTS WORKING AGAINST THE SINGLE OLLAMA INSTANCE
+
+    AT MOST max_concurrent REQUESTS RUN; UP TO max_queue MORE WAIT, LOWEST PRIORITY VALUE FIRST
+    AND FIFO WITHIN A PRIORITY. A FULL QUEUE OR A WAIT LONGER THAN queue_timeout IS REJECTED AT
+    ONCE WITH A Retry-After ESTIMATE, SO OVERLOAD SHOWS UP AS FAST 429s INSTEAD OF EVERY REQUEST
+    SLOWING DOWN UNTIL IT TIMES OUT. A FREED SLOT IS HANDED STRAIGHT TO THE NEXT WAITER.
+    ONLY USED FROM THE SERVING EVENT LOOP, SO NO LOCKING.
+    """
+
+    INTERACTIVE = 0  # /api/ask_stream, A USER IS WATCHING
+    BATCH = 1        # /api/ask
+    NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+    SMOOTHING = 0.2  # WEIGHT OF THE NEWEST REQUEST IN THE SERVICE TIME AVERAGE
+
+    def __init__(self, config):
+        self.max_concurrent = config.ADMISSION_MAX_CONCURRENT
+        self.max_queue = config.ADMISSION_MAX_QUEUE
+        self.queue_timeout = config.ADMISSION_QUEUE_TIMEOUT
+        self.service_time = config.ADMISSION_SERVICE_TIME  # INITIAL GUESS UNTIL REQUESTS COMPLETE
+        self.active = 0
+        self.waiters = []  # HEAP OF (priority, arrival, future)
+        self.arrivals = itertools.count()
+        self.wait = LatencyTracker(window=config.METRICS_WINDOW)
+        self.counts = {"admitted": 0, "queued": 0, "rejected": 0, "timed_out": 0}
+        self.peak_queue = 0
+
+    def retry_after(self) -> int:
+        """SECONDS UNTIL THE CURRENT BACKLOG HAS LIKELY DRAINED"""
+        backlog = len(self.waiters) + 1
+        return max(1, math.ceil(self.service_time * backlog / self.max_concurrent))
+
+    async def admit(self, priority: int = BATCH) -> AdmissionTicket:
+        start = time.perf_counter()
+        if self.active < self.max_concurrent and not self.waiters:
+            self.active += 1
+        else:
+            if len(self.waiters) >= self.max_queue:
+                self.counts["rejected"] += 1
+                raise AdmissionRejected(f"queue is full ({len(self.waiters)} waiting)", self.retry_after())
+            entry = (priority, next(self.arrivals), asyncio.get_running_loop().create_future())
+            heapq.heappush(self.waiters, entry)
+            self.counts["queued"] += 1
+            self.peak_queue = max(self.peak_queue, len(self.waiters))
+            try:
+                await asyncio.wait_for(asyncio.shield(entry[2]), timeout=self.queue_timeout)
+            except BaseException as e:
+                if entry[2].done() and not entry[2].cancelled():
+                    # THE SLOT WAS HANDED OVER JUST AS THE WAIT ENDED, GIVE IT BACK
+                    self._release(None)
+                else:
+                    entry[2].cancel()
+                    self.waiters.remove(entry)
+                    heapq.heapify(self.waiters)
+                if isinstance(e, asyncio.TimeoutError):
+                    self.counts["timed_out"] += 1
+                    raise AdmissionRejected(f"waited over {self.queue_timeout}s for a slot", self.retry_after())
+                raise
+        self.counts["admitted"] += 1
+        self.wait.record(time.perf_counter() - start)
+        return AdmissionTicket(self)
+
+    def _release(self, held_seconds):
+        if held_seconds is not None:
+            self.service_time += self.SMOOTHING * (held_seconds - self.service_time)
+        if self.waiters:
+            _, _, future = heapq.heappop(self.waiters)
+            future.set_result(None)  # THE SLOT MOVES TO THE WAITER, active IS UNCHANGED
+        else:
+            self.active -= 1
+
+    def stats(self) -> dict:
+        queued = {name: 0 for name in self.NAMES.values()}
+        for priority, _, _ in self.waiters:
+            queued[self.NAMES[priority]] += 1
+        return {
+            "active": self.active,
+            "max_concurrent": self.max_concurrent,
+            "queue_depth": len(self.waiters),
+            "queued_by_priority": queued,
+            "max_queue": self.max_queue,
+            "peak_queue": self.peak_queue,
+            "service_time_s": round(self.service_time, 3),
+            "retry_after_s": self.retry_after(),
+            "wait": self.wait.snapshot(),
+            "counts": dict(self.counts),
+        }
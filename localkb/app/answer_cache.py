@@ -0,0 +1,181 @@
+import re
+import time
+import threading
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional
+import numpy as np
+import logging
+
+if not logging.getLogger().hasHandlers():
+    from app.config import UbuntuConfig
+    UbuntuConfig.init_logging()
+logger = logging.getLogger(__name__)
+
+
+class CacheProbe(NamedTuple):
+    key: str                        # NORMALIZED QUESTION
+    embedding: Optional[np.ndarray]  # UNIT-LENGTH QUESTION EMBEDDING, None IF UNAVAILABLE
+    generation: int                 # VECTOR STORE GENERATION THE LOOKUP RAN AGAINST
+
+
+class CacheHit(NamedTuple):
+    chunks: List[str]   # ANSWER AS IT WAS STREAMED, JOIN FOR THE NON-STREAMING ENDPOINT
+    score: float        # 1.0 FOR EXACT MATCHES, COSINE SIMILARITY OTHERWISE
+    question: str       # CACHED QUESTION THAT MATCHED
+
+
+class AnswerCache:
+    """ANSWER CACHE WITH EXACT AND EMBEDDING-SIMILARITY LOOKUP, LRU/TTL EVICTION AND A MEMORY BOUND"""
+
+    ENTRY_OVERHEAD = 512  # ROUGH PER-ENTRY BOOKKEEPING COST IN BYTES
+
+    def __init__(self, config, embed_fn=None):
+        self.max_entries = config.ANSWER_CACHE_MAX_ENTRIES
+        self.ttl = config.ANSWER_CACHE_TTL
+        self.max_bytes = config.ANSWER_CACHE_MAX_BYTES
+        self.threshold = config.ANSWER_CACHE_SIMILARITY
+        self.embed_fn = embed_fn  # async (text) -> List[float]
+        self.entries = OrderedDict()  # key -> dict(question, chunks, created, size, row)
+        self.matrix = None            # ROW-PER-ENTRY EMBEDDINGS FOR THE SIMILARITY SCAN
+        self.row_keys = []
+        self.bytes = 0
+        self.generation = 0
+        self.hits = {"exact": 0, "semantic": 0}
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(question: str) -> str:
+        text = re.sub(r"\s+", " ", question.strip().lower())
+        return text.rstrip(" ?!.。？！")
+
+    async def lookup(self, question: str):
+        """RETURN (CacheHit OR None, CacheProbe); PASS THE PROBE BACK TO store() ON A MISS"""
+        key = self.normalize(question)
+        with self._lock:
+            generation = self.generation
+            hit = self._get_exact(key)
+        if hit is not None:
+            self.hits["exact"] += 1
+            return hit, CacheProbe(key, None, generation)
+
+        embedding = None
+        if self.embed_fn is not None:
+            try:
+                vector = np.asarray(await self.embed_fn(question), dtype=np.float32)
+                norm = np.linalg.norm(vector)
+                embedding = vector / norm if norm > 0 else None
+            except Exception as e:
+                logger.warning(f"answer cache embedding failed, exact match only: {str(e)}")
+        if embedding is not None:
+            with self._lock:
+                hit = self._get_similar(embedding) if generation == self.generation else None
+            if hit is not None:
+                self.hits["semantic"] += 1
+                logger.info(f"semantic cache hit ({hit.score:.3f}) [{question}] ~ [{hit.question}]")
+                return hit, CacheProbe(key, embedding, generation)
+
+        self.misses += 1
+        return None, CacheProbe(key, embedding, generation)
+
+    def store(self, probe: CacheProbe, question: str, chunks: List[str]):
+        """CACHE A COMPLETED ANSWER UNLESS THE VECTOR STORE CHANGED SINCE THE LOOKUP"""
+        if not chunks or not "".join(chunks).strip():
+            return
+        size = self.ENTRY_OVERHEAD + len(question.encode("utf-8")) + sum(len(c.encode("utf-8")) for c in chunks)
+        if probe.embedding is not None:
+            size += probe.embedding.nbytes
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if probe.generation != self.generation:
+                return  # ANSWER WAS BUILT FROM A STORE THAT HAS SINCE BEEN REPLACED
+            self._remove(probe.key)
+            row = self._add_row(probe.key, probe.embedding) if probe.embedding is not None else None
+            self.entries[probe.key] = {
+                "question": question,
+                "chunks": list(chunks),
+                "created": time.monotonic(),
+                "size": size,
+                "row": row,
+            }
+            self.bytes += size
+            while self.entries and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+                self._remove(next(iter(self.entries)))
+
+    def invalidate(self, *_):
+        """DROP EVERYTHING, CALLED WHEN A NEW VECTOR STORE IS SWAPPED IN"""
+        with self._lock:
+            count = len(self.entries)
+            self.entries.clear()
+            self.matrix = None
+            self.row_keys = []
+            self.bytes = 0
+            self.generation += 1
+        logger.info(f"answer cache invalidated ({count} entries dropped)")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "generation": self.generation,
+                "hits": dict(self.hits),
+                "misses": self.misses,
+            }
+
+    # ---- INTERNALS, CALLED WITH THE LOCK HELD ----
+
+    def _expired(self, entry) -> bool:
+        return self.ttl > 0 and time.monotonic() - entry["created"] > self.ttl
+
+    def _get_exact(self, key: str) -> Optional[CacheHit]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if self._expired(entry):
+            self._remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return CacheHit(entry["chunks"], 1.0, entry["question"])
+
+    def _get_similar(self, embedding: np.ndarray) -> Optional[CacheHit]:
+        if self.matrix is None or not self.row_keys or self.matrix.shape[1] != embedding.shape[0]:
+            return None
+        scores = self.matrix[:len(self.row_keys)] @ embedding
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        key = self.row_keys[best]
+        entry = self.entries[key]
+        if self._expired(entry):
+            self._remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return CacheHit(entry["chunks"], float(scores[best]), entry["question"])
+
+    def _add_row(self, key: str, embedding: np.ndarray) -> Optional[int]:
+        if self.matrix is None:
+            self.matrix = np.zeros((self.max_entries + 1, embedding.shape[0]), dtype=np.float32)
+        elif self.matrix.shape[1] != embedding.shape[0]:
+            return None  # EMBEDDING MODEL CHANGED, KEEP THE ENTRY FOR EXACT MATCHES ONLY
+        row = len(self.row_keys)
+        self.matrix[row] = embedding
+        self.row_keys.append(key)
+        return row
+
+    def _remove(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.bytes -= entry["size"]
+        row = entry["row"]
+        if row is not None:
+            # SWAP THE LAST ROW INTO THE HOLE SO THE MATRIX STAYS DENSE
+            last = len(self.row_keys) - 1
+            if row != last:
+                moved_key = self.row_keys[last]
+                self.matrix[row] = self.matrix[last]
+                self.row_keys[row] = moved_key
+                self.entries[moved_key]["row"] = row
+            self.row_keys.pop()
@@ -0,0 +1,130 @@
+import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+if not logging.getLogger().hasHandlers():
+    from app.config import UbuntuConfig
+    UbuntuConfig.init_logging()
+logger = logging.getLogger(__name__)
+
+
+class ChangeDetector:
+    """DETECT KNOWLEDGE FILE CHANGES BY STAT SIGNATURE FIRST, CONTENT HASH SECOND"""
+
+    STAT_FIELDS = ("size", "mtime_ns", "inode")
+
+    def __init__(self, knowledge_dir, workers: int = 8, block_size: int = 1024 * 1024):
+        self.knowledge_dir = knowledge_dir
+        self.workers = workers
+        self.block_size = block_size
+
+    def file_hash(self, file_path) -> str:
+        """STREAMING BLAKE2 HASH, NEVER HOLDS MORE THAN ONE BLOCK IN MEMORY"""
+        digest = hashlib.blake2b(digest_size=16)
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(self.block_size), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def stat_signature(file_path) -> dict:
+        st = os.stat(file_path)
+        return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "inode": st.st_ino}
+
+    def fingerprint(self, file_path) -> dict:
+        """STAT SIGNATURE PLUS CONTENT HASH, AS STORED IN THE FILE REGISTRY"""
+        signature = self.stat_signature(file_path)
+        signature["hash"] = self.file_hash(file_path)
+        return signature
+
+    def walk(self):
+        for root, _, files in os.walk(self.knowledge_dir):
+            for file in files:
+                file_path = os.path.join(root, file)
+                yield os.path.relpath(file_path, self.knowledge_dir), file_path
+
+    def walk_scope(self, paths):
+        """WALK ONLY THE GIVEN PATHS; RETURNS (files, scopes) WHERE scopes ARE RELATIVE PREFIXES
+        WHOSE REGISTRY ENTRIES SHOULD BE CHECKED FOR DELETION"""
+        root = os.path.abspath(self.knowledge_dir)
+        files, scopes = [], set()
+        for path in paths:
+            path = os.path.abspath(path)
+            if path != root and not path.startswith(root + os.sep):
+                continue  # OUTSIDE THE KNOWLEDGE DIR
+            rel_path = os.path.relpath(path, root)
+            if rel_path == ".":
+                return list(self.walk()), None  # THE WHOLE DIR IS IN SCOPE
+            scopes.add(rel_path)
+            if os.path.isdir(path):
+                for dir_root, _, names in os.walk(path):
+                    for name in names:
+                        file_path = os.path.join(dir_root, name)
+                        files.append((os.path.relpath(file_path, root), file_path))
+            elif os.path.isfile(path):
+                files.append((rel_path, path))
+        return files, scopes
+
+    def detect(self, registry: dict, paths=None):
+        """COMPARE THE KNOWLEDGE DIR (OR ONLY THE GIVEN PATHS) WITH THE REGISTRY
+
+        RETURNS (changes, fingerprints): changes HOLDS added/updated/deleted RELATIVE PATHS,
+        fingerprints HOLDS FRESH {size, mtime_ns, inode, hash} FOR EVERY FILE WHOSE STAT CHANGED,
+        INCLUDING TOUCHED FILES WHOSE CONTENT IS THE SAME.
+        """
+        changes = {"added": [], "updated": [], "deleted": []}
+        seen = set()
+        suspects = {}
+        if paths is None:
+            candidates, scopes = self.walk(), None
+        else:
+            candidates, scopes = self.walk_scope(paths)
+        for rel_path, file_path in candidates:
+            if rel_path in seen:
+                continue
+            seen.add(rel_path)
+            try:
+                signature = self.stat_signature(file_path)
+            except FileNotFoundError:
+                seen.discard(rel_path)  # REMOVED WHILE SCANNING
+                continue
+            entry = registry.get(rel_path)
+            if entry is None or any(entry.get(k) != signature[k] for k in self.STAT_FIELDS):
+                suspects[rel_path] = (file_path, signature)
+
+        # HASH ONLY FILES WHOSE STAT CHANGED, SPREAD OVER A THREAD POOL (hashlib RELEASES THE GIL)
+        fingerprints = {}
+        if suspects:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="hash") as pool:
+                hashes = pool.map(self._safe_hash, [file_path for file_path, _ in suspects.values()])
+                for (rel_path, (file_path, signature)), digest in zip(suspects.items(), hashes):
+                    if digest is None:
+                        if not os.path.exists(file_path):
+                            seen.discard(rel_path)
+                        continue
+                    fingerprints[rel_path] = dict(signature, hash=digest)
+
+        for rel_path, fingerprint in fingerprints.items():
+            entry = registry.get(rel_path)
+            if entry is None:
+                changes["added"].append(rel_path)
+            elif entry.get("hash") != fingerprint["hash"]:
+                changes["updated"].append(rel_path)
+
+        for rel_path in registry:
+            if rel_path in seen:
+                continue
+            if scopes is None or any(rel_path == scope or rel_path.startswith(scope + os.sep) for scope in scopes):
+                changes["deleted"].append(rel_path)
+
+        logger.info(f"scanned {len(seen)} files, {len(suspects)} with changed stat, "
+                    f"{sum(len(v) for v in changes.values())} changed")
+        return changes, fingerprints
+
+    def _safe_hash(self, file_path):
+        try:
+            return self.file_hash(file_path)
+        except (FileNotFoundError, PermissionError) as e:
+            logger.warning(f"cannot hash {file_path}: {str(e)}")
+            return None
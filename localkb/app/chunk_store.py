@@ -0,0 +1,347 @@
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from collections.abc import MutableMapping
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+import numpy as np
+import faiss
+from langchain.schema import Document
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.vectorstores import FAISS
+import logging
+
+if not logging.getLogger().hasHandlers():
+    from app.config import UbuntuConfig
+    UbuntuConfig.init_logging()
+logger = logging.getLogger(__name__)
+
+
+class ChunkStore(Docstore, AddableMixin):
+    """SQLITE CHUNK STORE: TEXT AND METADATA BY CHUNK ID, SHARED BY ALL INDEX GENERATIONS
+
+    CHUNK IDS ARE NEVER REUSED, SO A ROW STAYS VALID FOR EVERY GENERATION THAT REFERENCES IT;
+    ROWS ARE ONLY PURGED ONCE NO GENERATION ON DISK DOES. NOTHING IS CACHED IN PYTHON.
+    """
+
+    FILE = "chunks.sqlite"
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")  # SEARCHES KEEP READING WHILE AN UPDATE WRITES
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, text TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        self.conn.commit()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _document(chunk_id: str, text: str, metadata: str) -> Document:
+        return Document(id=chunk_id, page_content=text, metadata=json.loads(metadata))
+
+    def search(self, search: str) -> Union[str, Document]:
+        with self._lock:
+            row = self.conn.execute("SELECT text, metadata FROM chunks WHERE id = ?", (search,)).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return self._document(search, *row)
+
+    def get_many(self, ids: List[str]) -> Dict[str, Document]:
+        found = {}
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT id, text, metadata FROM chunks WHERE id IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for chunk_id, text, metadata in rows:
+                    found[chunk_id] = self._document(chunk_id, text, metadata)
+        return found
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        # A REBUILD RE-ADDS SURVIVING CHUNKS UNDER THEIR EXISTING IDS
+        rows = [(chunk_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False)) for chunk_id, doc in texts.items()]
+        with self._lock:
+            self.conn.executemany("INSERT OR IGNORE INTO chunks (id, text, metadata) VALUES (?, ?, ?)", rows)
+
+    def delete(self, ids: List) -> None:
+        """DROP ROWS FOR GOOD; ONLY FOR IDS THAT NO GENERATION REFERENCES ANY MORE"""
+        with self._lock:
+            self.conn.executemany("DELETE FROM chunks WHERE id = ?", [(chunk_id,) for chunk_id in ids])
+            self.conn.commit()
+
+    def legacy_order(self) -> Optional[List[str]]:
+        """CHUNK IDS BY FAISS POSITION FROM A SINGLE-DIRECTORY STORE, None IF THERE IS NO position COLUMN"""
+        with self._lock:
+            if "position" not in [row[1] for row in self.conn.execute("PRAGMA table_info(chunks)")]:
+                return None
+            return [row[0] for row in self.conn.execute("SELECT id FROM chunks WHERE position IS NOT NULL ORDER BY position")]
+
+    def commit(self):
+        with self._lock:
+            self.conn.commit()
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class PositionMap(MutableMapping):
+    """FAISS ID (SLOT) -> CHUNK ID FOR ONE GENERATION
+
+    SLOTS ARE NEVER RENUMBERED OR REUSED: A REMOVED CHUNK LEAVES A TOMBSTONE (AN EMPTY ID) UNTIL A
+    REBUILD COMPACTS THE INDEX, SO A REMOVAL NEVER HAS TO RENUMBER THE VECTORS AFTER IT. ONLY LIVE
+    SLOTS ARE KEYS OF THE MAPPING. SAVED AS A FIXED-WIDTH ids.npy AND MEMORY-MAPPED WHEN SERVING;
+    THE REVERSE LOOKUP IS ONLY BUILT WHEN AN UPDATE DELETES BY ID.
+    """
+
+    FILE = "ids.npy"
+    TOMBSTONE = b""
+
+    def __init__(self, ids: Optional[np.ndarray] = None):
+        self.base = ids if ids is not None else np.empty(0, dtype="S32")
+        self.appended: List[str] = []
+        self._reverse: Optional[Dict[str, int]] = None
+        self._dead: Optional[int] = None
+
+    @classmethod
+    def load(cls, directory: Path, mmap: bool = True) -> "PositionMap":
+        return cls(np.load(directory / cls.FILE, mmap_mode="r" if mmap else None))
+
+    def save(self, directory: Path):
+        np.save(directory / self.FILE, self.array())
+
+    def array(self) -> np.ndarray:
+        if not self.appended:
+            return np.asarray(self.base)
+        width = max([self.base.dtype.itemsize] + [len(chunk_id) for chunk_id in self.appended])
+        return np.concatenate([np.asarray(self.base, dtype=f"S{width}"), np.asarray(self.appended, dtype=f"S{width}")])
+
+    def slots(self) -> int:
+        """SLOTS HANDED OUT SO FAR, LIVE OR TOMBSTONED; THE NEXT APPEND GETS THIS ONE"""
+        return len(self.base) + len(self.appended)
+
+    def dead(self) -> int:
+        if self._dead is None:
+            self._dead = int(np.count_nonzero(np.asarray(self.base) == self.TOMBSTONE))
+        return self._dead
+
+    def live_mask(self) -> np.ndarray:
+        mask = np.ones(self.slots(), dtype=bool)
+        mask[:len(self.base)] = np.asarray(self.base) != self.TOMBSTONE
+        return mask
+
+    def __getitem__(self, position: int) -> str:
+        position = int(position)
+        if position < 0 or position >= self.slots():
+            raise KeyError(position)
+        if position >= len(self.base):
+            return self.appended[position - len(self.base)]
+        chunk_id = self.base[position]
+        if chunk_id == self.TOMBSTONE:
+            raise KeyError(position)
+        return chunk_id.decode("ascii")
+
+    def __setitem__(self, position: int, chunk_id: str):
+        self.update({position: chunk_id})
+
+    def __delitem__(self, position: int):
+        self[position]  # KeyError FOR AN UNKNOWN OR ALREADY TOMBSTONED SLOT
+        self.remove([position])
+
+    def update(self, mapping=(), **kwargs):
+        # SLOTS ARE ONLY EVER APPENDED: NEW ONES START AT slots()
+        for position, chunk_id in sorted(dict(mapping, **kwargs).items()):
+            if position != self.slots():
+                raise ValueError(f"position {position} is not the next free slot {self.slots()}")
+            self.appended.append(chunk_id)
+            if self._reverse is not None:
+                self._reverse[chunk_id] = position
+
+    def __len__(self) -> int:
+        return self.slots() - self.dead()
+
+    def __iter__(self):
+        return iter(np.flatnonzero(self.live_mask()).tolist())
+
+    def positions(self, ids: Iterable[str]) -> Dict[str, int]:
+        if self._reverse is None:
+            self._reverse = {self[position]: position for position in self}
+        return {chunk_id: self._reverse[chunk_id] for chunk_id in ids if chunk_id in self._reverse}
+
+    def remove(self, positions: Iterable[int]):
+        """TOMBSTONE positions; EVERY OTHER SLOT KEEPS ITS NUMBER"""
+        positions = [int(position) for position in positions]
+        if not positions:
+            return
+        if self._reverse is not None:
+            for position in positions:
+                self._reverse.pop(self[position], None)
+        self.base = self.array().copy()  # THE LOADED ARRAY MAY BE A READ-ONLY MEMORY MAP
+        self.base[positions] = self.TOMBSTONE
+        self.appended = []
+        self._dead = None
+
+
+class ChunkFAISS(FAISS):
+    """LANGCHAIN FAISS OVER A MEMORY-MAPPABLE index.faiss, AN ids.npy SLOT MAP AND THE SHARED CHUNK STORE
+
+    FAISS IDS ARE SLOTS OF THE PositionMap. A DELETE TOMBSTONES THE SLOT; INVERTED-LIST (IVF) INDEXES
+    ALSO DROP THE VECTOR, WHICH KEEPS THE IDS OF THE REST, WHILE FLAT AND HNSW INDEXES KEEP IT AND
+    SEARCHES SKIP TOMBSTONED SLOTS UNTIL A REBUILD COMPACTS THEM AWAY.
+    """
+
+    INDEX_FILE = "index.faiss"
+    lexical = None  # BM25 INDEX OVER THE SAME SLOTS, SET WHEN THE GENERATION IS SERVED
+    source = None   # index.faiss THIS STORE WAS MEMORY-MAPPED FROM, WHILE ITS VECTORS ARE UNCHANGED
+    _params = None  # (SearchParameters, SELECTOR, BITMAP) SKIPPING TOMBSTONED SLOTS
+
+    @classmethod
+    def create(cls, chunks: ChunkStore, embeddings, index) -> "ChunkFAISS":
+        """EMPTY WRITABLE STORE; CHUNK TEXTS GO STRAIGHT INTO chunks"""
+        return cls(embeddings, index, chunks, PositionMap())
+
+    @classmethod
+    def open(cls, directory: Union[str, Path], chunks: ChunkStore, embeddings, mmap: bool = True) -> "ChunkFAISS":
+        """OPEN A SAVED GENERATION; mmap=True GIVES A READ-ONLY VIEW THAT PAGES THE INDEX IN ON DEMAND"""
+        directory = Path(directory)
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if mmap else 0
+        index = faiss.read_index(str(directory / cls.INDEX_FILE), flags)
+        store = cls(embeddings, index, chunks, PositionMap.load(directory, mmap=mmap))
+        if mmap:
+            store.source = directory / cls.INDEX_FILE
+        return store
+
+    def save_local(self, folder_path: str, index_name: str = "index") -> None:
+        path = Path(folder_path)
+        path.mkdir(parents=True, exist_ok=True)
+        self.docstore.commit()  # ROWS FIRST, A POSITION MAP MUST NEVER POINT AT MISSING CHUNKS
+        target = path / f"{index_name}.faiss"
+        if self.source is not None:
+            # VECTORS UNCHANGED (ONLY TOMBSTONES ADDED): SHARE THE PUBLISHED FILE, IT IS NEVER MODIFIED
+            try:
+                os.link(self.source, target)
+            except OSError:
+                faiss.write_index(self.index, str(target))
+        else:
+            faiss.write_index(self.index, str(target))
+        self.index_to_docstore_id.save(path)
+
+    def ids(self) -> np.ndarray:
+        return self.index_to_docstore_id.array()
+
+    def iter_slots(self, batch_size: int = 500) -> Iterator[Tuple[int, Optional[Document]]]:
+        """(SLOT, CHUNK) FOR EVERY SLOT IN ORDER, CHUNK IS None FOR A TOMBSTONE; batch_size ROWS IN MEMORY AT A TIME"""
+        positions = self.index_to_docstore_id
+        for start in range(0, positions.slots(), batch_size):
+            slots = range(start, min(start + batch_size, positions.slots()))
+            ids = {slot: positions.get(slot) for slot in slots}
+            found = self.docstore.get_many([chunk_id for chunk_id in ids.values() if chunk_id is not None])
+            for slot in slots:
+                yield slot, found[ids[slot]] if ids[slot] is not None else None
+
+    def iter_documents(self, batch_size: int = 500) -> Iterator[Document]:
+        """ALL LIVE CHUNKS IN INDEX ORDER"""
+        return (doc for _, doc in self.iter_slots(batch_size) if doc is not None)
+
+    def stores_vectors(self) -> bool:
+        """TRUE WHEN reconstruct() RETURNS THE ORIGINAL VECTORS, NOT LOSSY CODES (PQ)"""
+        return isinstance(self.index, (faiss.IndexIVFFlat, faiss.IndexFlat, faiss.IndexHNSWFlat))
+
+    def reconstruct(self, slots: List[int]) -> np.ndarray:
+        ivf = faiss.try_extract_index_ivf(self.index)
+        if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+            ivf.set_direct_map_type(faiss.DirectMap.Hashtable)  # IDS HAVE GAPS AFTER REMOVALS
+        return self.index.reconstruct_batch(np.asarray(slots, dtype=np.int64))
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None, **kwargs) -> List[str]:
+        texts = list(texts)
+        return self._append(texts, self._embed_documents(texts), metadatas, ids)
+
+    def add_embeddings(self, text_embeddings, metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None, **kwargs) -> List[str]:
+        texts, vectors = zip(*text_embeddings) if text_embeddings else ((), ())
+        return self._append(list(texts), vectors, metadatas, ids)
+
+    def _append(self, texts: List[str], vectors, metadatas: Optional[List[dict]], ids: Optional[List[str]]) -> List[str]:
+        """ADD CHUNKS UNDER THE NEXT FREE SLOTS"""
+        if not texts:
+            return []
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self._normalize_L2:
+            faiss.normalize_L2(vectors)
+        start = self.index_to_docstore_id.slots()
+        if self.index.ntotal == start:
+            self.index.add(vectors)  # IMPLICIT IDS CONTINUE AT THE NEXT SLOT
+        else:
+            # AN IVF INDEX THAT DROPPED VECTORS COUNTS FEWER THAN THE SLOTS HANDED OUT
+            self.index.add_with_ids(vectors, np.arange(start, start + len(texts), dtype=np.int64))
+        metadatas = metadatas or [{} for _ in texts]
+        self.docstore.add({chunk_id: Document(id=chunk_id, page_content=text, metadata=metadata)
+                           for chunk_id, text, metadata in zip(ids, texts, metadatas)})
+        self.index_to_docstore_id.update({start + offset: chunk_id for offset, chunk_id in enumerate(ids)})
+        self.source = None
+        self._params = None
+        return ids
+
+    def _search_params(self):
+        """None WHILE THE INDEX HOLDS NO TOMBSTONED VECTORS, ELSE PARAMETERS THAT SKIP THEM DURING THE SEARCH"""
+        if self.index.ntotal == len(self.index_to_docstore_id):
+            return None
+        cached = self._params
+        if cached is None:
+            bitmap = np.packbits(self.index_to_docstore_id.live_mask(), bitorder="little")
+            selector = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+            if isinstance(self.index, faiss.IndexHNSW):
+                params = faiss.SearchParametersHNSW(sel=selector, efSearch=self.index.hnsw.efSearch)
+            else:
+                params = faiss.SearchParameters(sel=selector)
+            cached = self._params = (params, selector, bitmap)  # PARAMS ONLY HOLD POINTERS, KEEP THE REST ALIVE
+        return cached[0]
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4, filter=None, fetch_k: int = 20, **kwargs) -> List[Tuple[Document, float]]:
+        params = self._search_params()
+        if params is None:
+            return super().similarity_search_with_score_by_vector(embedding, k, filter=filter, fetch_k=fetch_k, **kwargs)
+        vector = np.array([embedding], dtype=np.float32)
+        if self._normalize_L2:
+            faiss.normalize_L2(vector)
+        scores, indices = self.index.search(vector, k if filter is None else fetch_k, params=params)
+        hits = [(self.index_to_docstore_id[i], score) for i, score in zip(indices[0], scores[0]) if i != -1]
+        found = self.docstore.get_many([chunk_id for chunk_id, _ in hits])
+        docs = [(found[chunk_id], score) for chunk_id, score in hits]
+        if filter is not None:
+            matches = self._create_filter_func(filter)
+            docs = [(doc, score) for doc, score in docs if matches(doc.metadata)]
+        threshold = kwargs.get("score_threshold")
+        if threshold is not None:
+            docs = [(doc, score) for doc, score in docs if score <= threshold]  # L2 DISTANCE, LOWER IS CLOSER
+        return docs[:k]
+
+    def lexical_search(self, query: str, k: int) -> List[Document]:
+        """TOP k CHUNKS BY BM25, EMPTY WITHOUT A LEXICAL INDEX"""
+        if self.lexical is None:
+            return []
+        ids = [self.index_to_docstore_id[position] for position, _ in self.lexical.search(query, k)]
+        found = self.docstore.get_many(ids)
+        return [found[chunk_id] for chunk_id in ids if chunk_id in found]
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs) -> Optional[bool]:
+        """REMOVE CHUNKS FROM THIS GENERATION; THEIR ROWS STAY UNTIL OLDER GENERATIONS ARE COLLECTED"""
+        if ids is None:
+            raise ValueError("No ids provided to delete.")
+        positions = self.index_to_docstore_id.positions(ids)
+        missing = set(ids).difference(positions)
+        if missing:
+            raise ValueError(f"Some specified ids do not exist in the current store. Ids not found: {missing}")
+        slots = np.fromiter(positions.values(), dtype=np.int64)
+        if faiss.try_extract_index_ivf(self.index) is not None:
+            # INVERTED LISTS DROP THE VECTORS AND KEEP THE IDS OF THE REST
+            self.index.remove_ids(slots)
+            self.source = None
+        self.index_to_docstore_id.remove(slots)
+        self._params = None
+        return True
@@ -12,7 +12,17 @@ class UbuntuConfig:
     VECTOR_DIR = DATA_DIR / "vectors"
     VECTOR_STORE_META = "metadata.json"
     FAISS_FILE = "index.faiss"
-    FAISS_NPROBE = 5
+    FAISS_NPROBE = 5                    # IVF CELLS SEARCHED PER QUERY
+    INDEX_TYPE = "flat"                 # flat | ivfflat | ivfpq | hnsw
+    INDEX_NLIST = 0                     # IVF CELLS, 0 = ~4*sqrt(CHUNKS)
+    INDEX_PQ_M = 64                     # PQ SUB-QUANTIZERS, ROUNDED DOWN TO A DIVISOR OF THE DIMENSION
+    INDEX_PQ_BITS = 8                   # BITS PER PQ CODE
+    INDEX_HNSW_M = 32                   # HNSW GRAPH DEGREE
+    INDEX_HNSW_EF_CONSTRUCTION = 200
+    INDEX_HNSW_EF_SEARCH = 64           # HNSW SEARCH WIDTH PER QUERY
+    INDEX_TRAIN_SAMPLE = 50000          # VECTORS BUFFERED TO TRAIN IVF QUANTIZERS
+    INDEX_RETRAIN_GROWTH = 4.0          # RETRAIN ONCE THE CORPUS OUTGROWS THE SIZE THE INDEX WAS TRAINED FOR
+    INDEX_COMPACT_RATIO = 0.2           # REBUILD ONCE REMOVED CHUNKS LEAVE THIS SHARE OF THE INDEX SLOTS TOMBSTONED
 
     # API KEY PATH
     API_KEY_PATH = Path(ROOT_DIR) / "key/api.key"
@@ -29,12 +39,40 @@ class UbuntuConfig:
     # LLM_MODEL = "deepseek-llm:7b"
     LLM_MODEL = "llama3.2:latest"
     CROSS_ENCODER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+    # RERANK CONFIGURATION
+    RERANK_THREADS = 2            # WORKER THREADS SERVING THE RESIDENT CROSS ENCODER
+    RERANK_MAX_LENGTH = 512       # MAX TOKENS PER (QUESTION, CHUNK) PAIR
+    RERANK_LATENCY_WINDOW = 1000  # SAMPLES KEPT FOR p50/p99 REPORTING
+    RERANK_BATCHING = True        # MERGE PAIRS FROM CONCURRENT REQUESTS INTO ONE FORWARD PASS
+    RERANK_BATCH_WINDOW_MS = 5    # MAX WAIT FOR MORE PAIRS AFTER THE FIRST ONE ARRIVES
+    RERANK_MAX_BATCH_SIZE = 32    # MAX PAIRS PER FORWARD PASS
     
     # PERFORMANCE TUNING
     CHUNK_SIZE = 1000  # GOOD FOR BIG LINUX BLOCK
     MAX_MEMORY = psutil.virtual_memory().total * 0.8  # 80% OF MEMORY
     CHUNK_OVERLAP = 200    # CHARACTER NUMBER OVERLAPPED BETWEEN BLOCKS
 
+    # CHANGE DETECTION
+    CHANGE_DETECT_WORKERS = 8          # THREADS HASHING FILES WHOSE STAT CHANGED
+    HASH_BLOCK_SIZE = 1024 * 1024      # STREAMING HASH READ SIZE
+    MONITOR_DEBOUNCE = 2.0             # SECONDS OF QUIET BEFORE QUEUED PATHS ARE INDEXED
+    MONITOR_MAX_DELAY = 30.0           # UPPER BOUND ON HOW LONG A CHANGE CAN WAIT
+    MONITOR_STOP_TIMEOUT = 60.0        # SHUTDOWN WAITS THIS LONG FOR PENDING CHANGES TO BE INDEXED
+
+    # INGESTION PIPELINE (FULL BUILDS)
+    INGEST_PARSE_WORKERS = 0          # PARSER PROCESSES, 0 = ONE PER CPU
+    INGEST_MP_CONTEXT = "spawn"       # SAFE WITH THE SERVICE'S THREADS AND EVENT LOOP
+    INGEST_QUEUE_SIZE = 32            # BOUND ON PARSED FILES WAITING BETWEEN STAGES
+    BUILD_MEMORY_BUDGET = MAX_MEMORY * 0.5  # RSS (SERVICE + PARSERS) ABOVE WHICH THE BUILD STOPS PARSING NEW FILES
+
+    # EMBEDDING ENGINE (BUILDS AND INCREMENTAL UPDATES)
+    EMBED_BATCH_SIZE = 32             # CHUNKS PER /api/embed REQUEST
+    EMBED_CONCURRENCY = 4             # REQUESTS IN FLIGHT, FURTHER CHUNKS WAIT (BACKPRESSURE)
+    EMBED_MAX_RETRIES = 4
+    EMBED_BACKOFF_BASE = 0.5          # SECONDS, DOUBLED ON EVERY RETRY
+    EMBED_BACKOFF_MAX = 10.0
+
     # BLOCK OPTIMIZATION PARAMETERS
     MIN_CHUNK_LENGTH = 200  # MERGE IF SIZE IS LESS THAN THE THRESHOLD
     ENABLE_CHUNK_MERGE = True
@@ -43,9 +81,63 @@ class UbuntuConfig:
     max_tokens = 512
     temperature = 0.1
 
+    # REQUEST PIPELINE
+    RETRIEVAL_THREADS = 4  # EXECUTOR FOR FAISS SEARCH, RERANK AND QA CHAIN, KEEPS THE EVENT LOOP FREE
+    QUERY_CLASSIFIER = "heuristic"  # "heuristic" SKIPS THE LLM FOR OBVIOUS INPUT, "llm" ALWAYS ASKS THE MODEL
+    QUERY_REWRITE_OBVIOUS = False   # STILL CALL THE LLM TO REWRITE QUERIES THE HEURISTIC ALREADY ACCEPTED
+    METRICS_WINDOW = 1000           # SAMPLES KEPT FOR LATENCY PERCENTILES
+    SPECULATIVE_RETRIEVAL = True    # SEARCH WITH THE ORIGINAL QUESTION WHILE THE QUERY IS BEING REWRITTEN
+
+    # HYBRID RETRIEVAL
+    HYBRID_RETRIEVAL = True         # FUSE BM25 HITS WITH VECTOR HITS (RECIPROCAL RANK FUSION) BEFORE RERANKING
+    VECTOR_CANDIDATES = 20          # FIRST-STAGE CANDIDATES FROM FAISS (CHEAP), RAISED TO THE CALLER'S top_k IF THAT IS LARGER
+    LEXICAL_CANDIDATES = 5          # CANDIDATES FROM BM25
+    RRF_K = 60                      # RANK DAMPING, HIGHER FLATTENS THE FUSED RANKING
+    BM25_K1 = 1.2
+    BM25_B = 0.75
+
+    # RERANK POLICY (HOW MANY CANDIDATES THE CROSS ENCODER SEES PER REQUEST)
+    RERANK_ADAPTIVE = True          # FALSE RERANKS EVERY FIRST-STAGE CANDIDATE
+    RERANK_TOP_N = 4                # BEST CHUNKS HANDED TO THE CONTEXT ASSEMBLER, THE TOKEN BUDGET DECIDES HOW MUCH IS SENT
+    RERANK_LATENCY_BUDGET_MS = 150  # CROSS-ENCODER TIME ONE REQUEST MAY SPEND
+    RERANK_MIN_CANDIDATES = 3
+    RERANK_BASE_CANDIDATES = 5      # WHEN THE TOP HITS ARE NEITHER DECISIVE NOR TIED
+    RERANK_MAX_CANDIDATES = 20      # UPPER BOUND WHEN WIDENING
+    RERANK_EARLY_EXIT_MARGIN = 0.35 # BEST VECTOR HIT THIS MUCH CLOSER (RELATIVE L2) THAN THE NEXT: SKIP RERANKING
+    RERANK_WIDEN_MARGIN = 0.02      # TOP TWO HITS THIS CLOSE: RERANK AS MANY AS THE BUDGET ALLOWS
+    RERANK_PAIR_COST_MS = 5.0       # STARTING PER-PAIR ESTIMATE, REPLACED BY MEASURED COST
+
+    # CONTEXT ASSEMBLY
+    CONTEXT_MAX_TOKENS = 1500       # CAP ON PACKED CONTEXT, KEEPS PREFILL TIME PREDICTABLE
+    CONTEXT_CHARS_PER_TOKEN = 4.0   # TOKEN ESTIMATE WITHOUT THE MODEL'S TOKENIZER
+    CONTEXT_MIN_OVERLAP = 20        # SHORTEST SHARED SPAN (CHARACTERS) TREATED AS CHUNK OVERLAP
+
+    # ADMISSION CONTROL (REQUESTS IN FRONT OF THE SINGLE OLLAMA INSTANCE)
+    ADMISSION_MAX_CONCURRENT = 4    # REQUESTS WORKING AT ONCE, MATCH OLLAMA_NUM_PARALLEL
+    ADMISSION_MAX_QUEUE = 32        # WAITING REQUESTS BEYOND THIS ARE REJECTED WITH 429
+    ADMISSION_QUEUE_TIMEOUT = 60    # SECONDS A REQUEST MAY WAIT FOR A SLOT BEFORE 429
+    ADMISSION_SERVICE_TIME = 10.0   # STARTING ESTIMATE (SECONDS) OF ONE REQUEST, FOR Retry-After
+
+    # EMBEDDING CACHE
+    EMBEDDING_CACHE_ENABLED = True
+    EMBEDDING_CACHE_DIR = DATA_DIR / "embedding_cache"
+    EMBEDDING_CACHE_MEMORY_ENTRIES = 20000  # HOT VECTORS KEPT IN THE IN-MEMORY LRU
+
+    # ANSWER CACHE
+    ANSWER_CACHE_ENABLED = True
+    ANSWER_CACHE_MAX_ENTRIES = 1000
+    ANSWER_CACHE_TTL = 24 * 3600                # SECONDS, 0 DISABLES EXPIRY
+    ANSWER_CACHE_MAX_BYTES = 64 * 1024 * 1024   # ANSWERS + QUESTION EMBEDDINGS
+    ANSWER_CACHE_SIMILARITY = 0.95              # MIN COSINE SIMILARITY FOR A SEMANTIC HIT
+
     # OLLAMA CONFIGURATION
     ollama_base_url = "http://localhost:11434"
     ollama_timeout = 1800
+    ollama_num_ctx = 4096        # MODEL CONTEXT WINDOW REQUESTED FROM OLLAMA, BOUNDS PROMPT + ANSWER
+    ollama_pool_limit = 32       # MAX POOLED CONNECTIONS TO OLLAMA
+    ollama_keepalive = 300       # SECONDS AN IDLE CONNECTION STAYS OPEN
+    ollama_model_keep_alive = "30m"  # HOW LONG OLLAMA KEEPS THE MODEL (AND ITS PROMPT CACHE) LOADED, -1 = FOREVER
+    ollama_warm_up = True        # LOAD THE MODEL AND PREFILL THE SYSTEM PROMPT AT STARTUP
 
 
     @classmethod
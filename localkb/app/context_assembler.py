@@ -0,0 +1,143 @@
+import math
+import threading
+from typing import List, Optional
+from langchain.schema import Document
+import logging
+
+if not logging.getLogger().hasHandlers():
+    from app.config import UbuntuConfig
+    UbuntuConfig.init_logging()
+logger = logging.getLogger(__name__)
+
+
+class ContextAssembler:
+    """TURN RANKED CHUNKS INTO A PROMPT CONTEXT THAT FITS THE MODEL'S WINDOW
+
+    1. CHUNKS OF THE SAME SOURCE THAT OVERLAP (CHUNK_OVERLAP) OR CONTAIN ONE ANOTHER ARE MERGED,
+       SO SHARED TEXT IS SENT ONCE AND NEIGHBOURING CHUNKS READ AS ONE PASSAGE.
+    2. MERGED SEGMENTS ARE PACKED BEST-RANKED FIRST UNTIL THE TOKEN BUDGET IS SPENT; THE LAST ONE
+       MAY BE CUT AT A SENTENCE BOUNDARY.
+    THE BUDGET IS THE MODEL WINDOW MINUS THE ANSWER (max_tokens), THE PROMPT TEMPLATE AND THE
+    QUESTION, CAPPED BY CONTEXT_MAX_TOKENS SO PREFILL TIME STAYS PREDICTABLE.
+    """
+
+    SEPARATOR = "\n\n"
+    MIN_TRUNCATED_TOKENS = 64  # A SHORTER TAIL IS NOT WORTH A PARTIAL PASSAGE
+
+    def __init__(self, config, prompt_template: str = ""):
+        self.chars_per_token = config.CONTEXT_CHARS_PER_TOKEN
+        self.min_overlap = config.CONTEXT_MIN_OVERLAP
+        self.max_context = config.CONTEXT_MAX_TOKENS
+        self.window = config.ollama_num_ctx
+        self.reserved = config.max_tokens + self.count_tokens(prompt_template)
+        self.assembled = 0
+        self.merges = 0
+        self.truncated = 0
+        self.tokens_packed = 0
+        self._lock = threading.Lock()  # assemble() RUNS ON THE RETRIEVAL THREADS
+
+    def count_tokens(self, text: str) -> int:
+        """ESTIMATE, THE SERVICE HAS NO ACCESS TO THE OLLAMA MODEL'S TOKENIZER"""
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def budget(self, question: str) -> int:
+        return max(0, min(self.max_context, self.window - self.reserved - self.count_tokens(question)))
+
+    def _overlap(self, first: str, second: str) -> int:
+        """LENGTH OF THE LONGEST SUFFIX OF first THAT STARTS second, 0 BELOW min_overlap"""
+        probe = second[:self.min_overlap]
+        if len(probe) < self.min_overlap:
+            return 0
+        position = first.find(probe, max(0, len(first) - len(second)))
+        while position != -1:
+            if second.startswith(first[position:]):
+                return len(first) - position
+            position = first.find(probe, position + 1)
+        return 0
+
+    def _join(self, first: str, second: str) -> Optional[str]:
+        """first FOLLOWED BY second AS ONE PASSAGE, None WHEN THEY ARE NOT CONTIGUOUS"""
+        if second in first:
+            return first
+        if first in second:
+            return second
+        shared = self._overlap(first, second)
+        return first + second[shared:] if shared else None
+
+    def merge(self, docs: List[Document]) -> List[str]:
+        """DEDUPLICATED PASSAGES, ORDERED BY THE BEST RANK AMONG THEIR CHUNKS"""
+        segments = []  # [rank, source, text]
+        merges = 0
+        for rank, doc in enumerate(docs):
+            text = doc.page_content.strip()
+            if not text:
+                continue
+            source = doc.metadata.get("source")
+            segment = [rank, source, text]
+            # A CHUNK CAN BRIDGE TWO EARLIER SEGMENTS, KEEP ABSORBING UNTIL NOTHING JOINS
+            joined = True
+            while joined:
+                joined = False
+                for other in segments:
+                    if other[1] != source:
+                        continue
+                    merged = self._join(other[2], segment[2]) or self._join(segment[2], other[2])
+                    if merged is not None:
+                        segments.remove(other)
+                        segment = [min(other[0], segment[0]), source, merged]
+                        merges += 1
+                        joined = True
+                        break
+            segments.append(segment)
+        with self._lock:
+            self.merges += merges
+        # THE SAME TEXT UNDER TWO SOURCES (COPIED FILES) IS ONLY SENT ONCE
+        passages, seen = [], set()
+        for _, _, text in sorted(segments, key=lambda s: s[0]):
+            if text not in seen:
+                seen.add(text)
+                passages.append(text)
+        return passages
+
+    def _truncate(self, text: str, tokens: int) -> str:
+        cut = text[:int(tokens * self.chars_per_token)]
+        boundary = max(cut.rfind(". "), cut.rfind("\n"))
+        if boundary < len(cut) * 0.6:
+            boundary = cut.rfind(" ")
+        return cut[:boundary + 1].rstrip() if boundary > 0 else cut
+
+    def assemble(self, docs: List[Document], question: str) -> str:
+        """CONTEXT FOR question FROM docs (BEST FIRST), WITHIN THE TOKEN BUDGET"""
+        budget = self.budget(question)
+        passages = self.merge(docs)
+        parts, used, truncated = [], 0, 0
+        separator = self.count_tokens(self.SEPARATOR)
+        for passage in passages:
+            cost = self.count_tokens(passage) + (separator if parts else 0)
+            if used + cost <= budget:
+                parts.append(passage)
+                used += cost
+                continue
+            remaining = budget - used - (separator if parts else 0)
+            if remaining >= self.MIN_TRUNCATED_TOKENS:
+                parts.append(self._truncate(passage, remaining))
+                used += self.count_tokens(parts[-1]) + (separator if len(parts) > 1 else 0)
+                truncated = 1
+                break
+        with self._lock:
+            self.assembled += 1
+            self.tokens_packed += used
+            self.truncated += truncated
+        raw = sum(self.count_tokens(doc.page_content) for doc in docs)
+        logger.info(f"info: packed {len(parts)} passages from {len(docs)} chunks into ~{used}/{budget} tokens "
+                    f"(chunks alone ~{raw} tokens)")
+        return self.SEPARATOR.join(parts)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "assembled": self.assembled,
+                "avg_tokens": round(self.tokens_packed / self.assembled, 1) if self.assembled else 0.0,
+                "merges": self.merges,
+                "truncated": self.truncated,
+            }
@@ -0,0 +1,230 @@
+import re
+import json
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+import logging
+
+if not logging.getLogger().hasHandlers():
+    from app.config import UbuntuConfig
+    UbuntuConfig.init_logging()
+logger = logging.getLogger(__name__)
+
+
+class DiskEmbeddingStore:
+    """APPEND-ONLY FLOAT32 VECTOR FILE PLUS KEY LOG, READ THROUGH A MEMORY MAP
+
+    NOTHING TOUCHES THE FILES UNTIL open(): A CONSTRUCTED BUT UNOPENED STORE (E.G. IN A PROCESS
+    THAT MERELY RE-IMPORTED THE SERVICE MODULE) MUST NOT REPAIR OR APPEND TO THE SERVICE'S FILES.
+    UNTIL THEN IT MISSES ON EVERY LOOKUP AND DROPS WRITES.
+    """
+
+    VECTORS_FILE = "vectors.f32"
+    KEYS_FILE = "keys.txt"
+    META_FILE = "meta.json"
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.vectors_path = self.directory / self.VECTORS_FILE
+        self.keys_path = self.directory / self.KEYS_FILE
+        self.meta_path = self.directory / self.META_FILE
+        self.dim: Optional[int] = None
+        self.rows: Dict[str, int] = {}
+        self.mmap: Optional[np.memmap] = None
+        self.opened = False
+
+    def open(self):
+        if self.opened:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._load()
+        self.opened = True
+
+    def _load(self):
+        if self.meta_path.exists():
+            self.dim = json.loads(self.meta_path.read_text())["dim"]
+        if self.dim is None or not self.keys_path.exists():
+            return
+        with open(self.keys_path, "r") as f:
+            keys = [line.strip() for line in f if line.strip()]
+        row_bytes = self.dim * 4
+        stored_rows = self.vectors_path.stat().st_size // row_bytes if self.vectors_path.exists() else 0
+        valid = min(len(keys), stored_rows)
+        # A CRASH BETWEEN THE TWO APPENDS LEAVES ONE FILE LONGER, TRIM BOTH BACK TO THE COMMON PREFIX
+        if stored_rows != valid or len(keys) != valid:
+            logger.warning(f"embedding cache {self.directory} truncated to {valid} rows")
+            if self.vectors_path.exists():
+                with open(self.vectors_path, "r+b") as f:
+                    f.truncate(valid * row_bytes)
+            with open(self.keys_path, "w") as f:
+                f.writelines(f"{k}\n" for k in keys[:valid])
+            keys = keys[:valid]
+        self.rows = {key: row for row, key in enumerate(keys)}
+        self._remap()
+
+    def _remap(self):
+        count = len(self.rows)
+        self.mmap = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(count, self.dim)) if count else None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        row = self.rows.get(key)
+        if row is None:
+            return None
+        if self.mmap is None or row >= self.mmap.shape[0]:
+            self._remap()
+        return np.array(self.mmap[row])
+
+    def put_many(self, items: Dict[str, List[float]]):
+        if not self.opened:
+            return
+        fresh = {k: v for k, v in items.items() if k not in self.rows}
+        if not fresh:
+            return
+        if self.dim is None:
+            self.dim = len(next(iter(fresh.values())))
+            self.meta_path.write_text(json.dumps({"dim": self.dim}))
+        keys = [k for k, v in fresh.items() if len(v) == self.dim]
+        if not keys:
+            return
+        block = np.asarray([fresh[k] for k in keys], dtype=np.float32)
+        # VECTORS FIRST, THEN KEYS, SO A KEY NEVER POINTS PAST THE END OF THE VECTOR FILE
+        with open(self.vectors_path, "ab") as f:
+            f.write(block.tobytes())
+        with open(self.keys_path, "a") as f:
+            f.writelines(f"{k}\n" for k in keys)
+        start = len(self.rows)
+        for offset, key in enumerate(keys):
+            self.rows[key] = start + offset
+
+
+class CachedEmbeddings(Embeddings):
+    """CONTENT-ADDRESSED EMBEDDING CACHE: IN-MEMORY LRU IN FRONT OF A MEMORY-MAPPED DISK TIER
+
+    ONLY DOCUMENT (CHUNK) VECTORS ARE PERSISTED. QUERY VECTORS STAY IN THE BOUNDED LRU, OTHERWISE
+    EVERY DISTINCT QUESTION WOULD GROW THE APPEND-ONLY DISK TIER FOREVER.
+    """
+
+    def __init__(self, inner: Embeddings, model_name: str, cache_dir: Path, memory_entries: int = 20000):
+        self.inner = inner
+        self.model_name = model_name
+        self.memory_entries = memory_entries
+        self.memory = OrderedDict()
+        slug = re.sub(r"[^A-Za-z0-9._-]+", "_", model_name)
+        self.disk = DiskEmbeddingStore(Path(cache_dir) / slug)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()       # MEMORY TIER AND COUNTERS
+        self._disk_lock = threading.Lock()  # DISK APPENDS, SO LOOKUPS NEVER WAIT ON FILE I/O
+
+    def open(self):
+        """LOAD (AND IF NEEDED REPAIR) THE DISK TIER; CALLED ONCE AT SERVICE STARTUP"""
+        with self._lock, self._disk_lock:
+            self.disk.open()
+        logger.info(f"embedding cache for [{self.model_name}] opened with {len(self.disk)} vectors on disk")
+
+    def _key(self, text: str) -> str:
+        return hashlib.blake2b(f"{self.model_name}\0{text}".encode("utf-8"), digest_size=20).hexdigest()
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in found:
+                    continue
+                vector = self.memory.get(key)
+                if vector is not None:
+                    self.memory.move_to_end(key)
+                else:
+                    stored = self.disk.get(key)
+                    if stored is None:
+                        continue
+                    vector = stored.tolist()
+                    self._remember(key, vector)
+                found[key] = vector
+        return found
+
+    def _remember(self, key: str, vector: List[float]):
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def _remember_many(self, computed: Dict[str, List[float]]):
+        with self._lock:
+            for key, vector in computed.items():
+                self._remember(key, vector)
+
+    def _persist(self, computed: Dict[str, List[float]]):
+        with self._disk_lock:
+            try:
+                self.disk.put_many(computed)
+            except OSError as e:
+                logger.error(f"embedding cache write failed: {str(e)}")
+
+    def _save(self, computed: Dict[str, List[float]]):
+        self._remember_many(computed)
+        self._persist(computed)
+
+    def _split(self, texts: List[str]):
+        keys = [self._key(text) for text in texts]
+        found = self._lookup(keys)
+        missing = OrderedDict()
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        return keys, found, missing
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, found, missing = self._split(texts)
+        if missing:
+            vectors = self.inner.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self._save(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        keys, found, missing = self._split([text])
+        if missing:
+            vector = self.inner.embed_query(text)
+            self._remember_many({keys[0]: vector})
+            return vector
+        return found[keys[0]]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, found, missing = self._split(texts)
+        if missing:
+            vectors = await self.inner.aembed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self._remember_many(computed)
+            # THE FILE APPEND RUNS OFF THE EVENT LOOP
+            await asyncio.get_running_loop().run_in_executor(None, self._persist, computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        keys, found, missing = self._split([text])
+        if missing:
+            vector = await self.inner.aembed_query(text)
+            self._remember_many({keys[0]: vector})
+            return vector
+        return found[keys[0]]
+
+    def stats(self) -> dict:
+        return {
+            "memory_entries": len(self.memory),
+            "disk_entries": len(self.disk),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
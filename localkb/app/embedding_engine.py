@@ -0,0 +1,94 @@
+import time
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, List, Tuple, TypeVar
+import logging
+
+if not logging.getLogger().hasHandlers():
+    from app.config import UbuntuConfig
+    UbuntuConfig.init_logging()
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class EmbeddingEngine:
+    """BATCHED, CONCURRENT EMBEDDING WITH RETRIES AND BACKPRESSURE"""
+
+    def __init__(self, embeddings, batch_size: int = 32, concurrency: int = 4,
+                 max_retries: int = 4, backoff_base: float = 0.5, backoff_max: float = 10.0):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.requests = 0
+        self.retries = 0
+        self.embedded = 0
+        self._lock = threading.Lock()  # embed_batch RUNS ON self.concurrency POOL THREADS
+
+    @classmethod
+    def from_config(cls, config, embeddings):
+        return cls(
+            embeddings,
+            batch_size=config.EMBED_BATCH_SIZE,
+            concurrency=config.EMBED_CONCURRENCY,
+            max_retries=config.EMBED_MAX_RETRIES,
+            backoff_base=config.EMBED_BACKOFF_BASE,
+            backoff_max=config.EMBED_BACKOFF_MAX
+        )
+
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """ONE EMBEDDING REQUEST, RETRIED WITH EXPONENTIAL BACKOFF AND JITTER"""
+        attempt = 0
+        while True:
+            with self._lock:
+                self.requests += 1
+            try:
+                vectors = self.embeddings.embed_documents(texts)
+                if len(vectors) != len(texts):
+                    raise ValueError(f"expected {len(texts)} embeddings, got {len(vectors)}")
+                with self._lock:
+                    self.embedded += len(vectors)
+                return vectors
+            except Exception as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    logger.error(f"embedding batch of {len(texts)} failed after {self.max_retries} retries: {str(e)}")
+                    raise
+                with self._lock:
+                    self.retries += 1
+                delay = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+                delay *= 0.5 + random.random() / 2
+                logger.warning(f"embedding batch failed ({str(e)}), retry {attempt}/{self.max_retries} in {delay:.2f}s")
+                time.sleep(delay)
+
+    def stream(self, items: Iterable[T], text: Callable[[T], str] = lambda item: item) -> Iterator[Tuple[List[T], List[List[float]]]]:
+        """YIELD (batch_items, vectors) IN SUBMISSION ORDER
+
+        AT MOST self.concurrency BATCHES ARE IN FLIGHT; items IS NOT PULLED FURTHER UNTIL
+        A SLOT FREES UP, SO A SLOW OLLAMA THROTTLES THE PRODUCER INSTEAD OF BUFFERING VECTORS.
+        """
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="embed") as pool:
+            pending = deque()
+            batch = []
+            for item in items:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    pending.append((batch, pool.submit(self.embed_batch, [text(i) for i in batch])))
+                    batch = []
+                    while len(pending) >= self.concurrency:
+                        done_batch, future = pending.popleft()
+                        yield done_batch, future.result()
+            if batch:
+                pending.append((batch, pool.submit(self.embed_batch, [text(i) for i in batch])))
+            while pending:
+                done_batch, future = pending.popleft()
+                yield done_batch, future.result()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"requests": self.requests, "retries": self.retries, "embedded": self.embedded}
@@ -1,54 +1,143 @@
+import os
 import time
+import queue
+import threading
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 import logging
 if not logging.getLogger().hasHandlers():
     from app.config import UbuntuConfig
     UbuntuConfig.init_logging()
-logger = logging.getLogger(__name__)  
+logger = logging.getLogger(__name__)
 
 class KnowledgeHandler(FileSystemEventHandler):
-    def __init__(self, callback, cooldown=30):
-        self.callback = callback
-        self.cooldown = cooldown
-        self.last_trigger = 0
-    
+    """COLLECT CHANGED PATHS AND FLUSH THEM ON A TRAILING-EDGE DEBOUNCE TIMER"""
+
+    def __init__(self, work_queue, debounce=2.0, max_delay=30.0):
+        self.work_queue = work_queue
+        self.debounce = debounce
+        self.max_delay = max_delay  # FLUSH EVEN UNDER A CONTINUOUS EVENT STORM
+        self.pending = set()
+        self.first_event = None
+        self.timer = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _ignored(path):
+        # IGNOE TEMPORAY FILES
+        name = os.path.basename(path)
+        return not name or name.endswith('~') or name.startswith('.')
+
     def on_any_event(self, event):
-        if event.is_directory:
+        if event.event_type in ("opened", "closed_no_write"):
             return
-            
-        # IGNOE TEMPORAY FILES
-        if event.src_path.endswith('~') or event.src_path.startswith('.'):
+        # DIRECTORY MOVES/DELETES MATTER, THE FILES INSIDE MAY NOT GET THEIR OWN EVENTS
+        if event.is_directory and event.event_type not in ("moved", "deleted"):
             return
-            
-        current_time = time.time()
-        if current_time - self.last_trigger > self.cooldown:
-            self.last_trigger = current_time
-            logger.info(f"\nFile change detected: {event.event_type} {event.src_path}")
-            self.callback()
+
+        paths = [event.src_path]
+        if getattr(event, "dest_path", None):
+            paths.append(event.dest_path)
+        paths = [p for p in paths if not self._ignored(p)]
+        if not paths:
+            return
+
+        logger.info(f"File change detected: {event.event_type} {' -> '.join(paths)}")
+        with self._lock:
+            self.pending.update(paths)
+            now = time.monotonic()
+            if self.first_event is None:
+                self.first_event = now
+            if self.timer is not None:
+                self.timer.cancel()
+            delay = min(self.debounce, max(0.0, self.first_event + self.max_delay - now))
+            self.timer = threading.Timer(delay, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        with self._lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            paths, self.pending = self.pending, set()
+            self.first_event = None
+        if paths:
+            self.work_queue.put(paths)
+
 
 class FileMonitor:
-    def __init__(self, path, callback, cooldown=30):
+    RETRY_DELAY = 2.0      # SECONDS BEFORE A FAILED BATCH IS RETRIED, DOUBLED ON EACH FURTHER FAILURE
+    RETRY_MAX_DELAY = 300.0
+
+    def __init__(self, path, callback, debounce=2.0, max_delay=30.0, stop_timeout=60.0):
         self.path = path
-        self.event_handler = KnowledgeHandler(callback, cooldown)
+        self.callback = callback  # CALLED WITH THE SET OF CHANGED PATHS ON THE WORKER THREAD
+        self.stop_timeout = stop_timeout  # HOW LONG stop() WAITS FOR THE LAST CHANGES TO BE INDEXED
+        self.work_queue = queue.Queue()
+        self.event_handler = KnowledgeHandler(self.work_queue, debounce, max_delay)
         self.observer = Observer()
+        self.worker = None
         self.is_running = False
-    
+
+    def _retry_delay(self, failures):
+        return min(self.RETRY_DELAY * 2 ** (failures - 1), self.RETRY_MAX_DELAY)
+
+    def _work(self):
+        """BACKGROUND INDEXING WORKER, KEEPS THE WATCHDOG THREAD FREE"""
+        failed = set()  # PATHS OF THE LAST FAILED CALLBACK, RETRIED TOGETHER WITH ANY NEWER ONES
+        failures = 0
+        stop = False
+        while not stop:
+            delay = self._retry_delay(failures) if failed else None
+            try:
+                batches = [self.work_queue.get(timeout=delay)]
+            except queue.Empty:
+                batches = []  # BACKOFF IS OVER, RETRY THE FAILED BATCH
+            # COALESCE EVERYTHING THAT QUEUED UP WHILE THE PREVIOUS UPDATE WAS RUNNING
+            while True:
+                try:
+                    batches.append(self.work_queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batches
+            paths = failed.union(*(batch for batch in batches if batch is not None))
+            if not paths:
+                continue
+            try:
+                logger.info(f"processing {len(paths)} changed paths")
+                self.callback(paths)
+                failed, failures = set(), 0
+            except Exception as e:
+                failed, failures = paths, failures + 1
+                if stop:
+                    logger.error(f"update callback failed while stopping, {len(paths)} changed paths are not indexed: {str(e)}", exc_info=True)
+                else:
+                    logger.error(f"update callback failed ({failures} in a row), retrying in {self._retry_delay(failures):.0f}s: {str(e)}", exc_info=True)
+
     def start(self):
         if not self.is_running:
             self.observer.schedule(
-            self.event_handler, 
-            self.path, 
-            recursive=True        
+            self.event_handler,
+            self.path,
+            recursive=True
             )
+            self.worker = threading.Thread(target=self._work, name="index-worker", daemon=True)
+            self.worker.start()
             self.observer.start()
             self.is_running = True
             logger.info(f"Monitoring started on {self.path}")
-    
+
     def stop(self):
         if self.is_running:
             self.observer.stop()
             self.observer.join(timeout=5.0)
+            # HAND PENDING CHANGES TO THE WORKER INSTEAD OF DROPPING THEM, IT INDEXES THEM BEFORE EXITING
+            self.event_handler.flush()
+            self.work_queue.put(None)
+            self.worker.join(timeout=self.stop_timeout)
+            if self.worker.is_alive():
+                logger.warning(f"index worker still busy after {self.stop_timeout}s, last changes may not be indexed")
             self.is_running = False
             logger.info(f"Monitoring stopped on {self.path}")
 
@@ -56,11 +145,11 @@ class FileMonitor:
         logger.info("Entering FileMonitor context")
         self.start()
         return self
-    
+
     def __exit__(self, exc_type, exc_val, exc_tb):
         logger.info("Exiting FileMonitor context")
         self.stop()
-    
+
     def __del__(self):
         logger.info("FileMonitor is being deleted")
-        self.stop()  # MAKE SURE TO STOP DURING DECONSTRUCTION
\ No newline at end of file
+        self.stop()  # MAKE SURE TO STOP DURING DECONSTRUCTION
@@ -0,0 +1,221 @@
+import os
+import pickle
+import re
+import shutil
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, List, Optional
+import numpy as np
+from app.chunk_store import ChunkStore, PositionMap
+import logging
+
+if not logging.getLogger().hasHandlers():
+    from app.config import UbuntuConfig
+    UbuntuConfig.init_logging()
+logger = logging.getLogger(__name__)
+
+
+class GenerationStore:
+    """ON-DISK VECTOR STORE GENERATIONS
+
+    vectors/
+        CURRENT             NAME OF THE SERVED GENERATION, REPLACED ATOMICALLY (os.replace)
+        chunks.sqlite       CHUNK TEXTS, SHARED BY ALL GENERATIONS
+        gen-000007/         index.faiss, ids.npy, metadata.json - NEVER MODIFIED ONCE PUBLISHED
+        dropped-000007.npy  CHUNK IDS gen-000006 HAD AND gen-000007 NO LONGER HAS
+
+    A NEW GENERATION IS WRITTEN IN FULL BESIDE THE SERVED ONE AND PUBLISHED BY SWAPPING THE
+    POINTER, SO A CRASH AT ANY POINT LEAVES EITHER THE OLD OR THE NEW GENERATION CURRENT.
+    """
+
+    POINTER = "CURRENT"
+    PREFIX = "gen-"
+    DROPPED = "dropped-"
+    NAME = re.compile(r"gen-(\d+)$")
+
+    def __init__(self, root, index_file: str, meta_file: str):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.index_file = index_file
+        self.meta_file = meta_file
+        self.chunks = ChunkStore(self.root / ChunkStore.FILE)
+        self.in_use = set()  # GENERATIONS BEING BUILT OR SERVED BY THIS PROCESS
+        self._lock = threading.RLock()
+
+    @classmethod
+    def number(cls, name: str) -> int:
+        return int(cls.NAME.match(name).group(1))
+
+    def path(self, name: str) -> Path:
+        return self.root / name
+
+    def current(self) -> Optional[str]:
+        try:
+            name = (self.root / self.POINTER).read_text().strip()
+        except FileNotFoundError:
+            return None
+        return name if (self.path(name) / self.index_file).exists() else None
+
+    def current_path(self) -> Optional[Path]:
+        name = self.current()
+        return self.path(name) if name else None
+
+    def names(self) -> List[str]:
+        return sorted((p.name for p in self.root.iterdir() if p.is_dir() and self.NAME.match(p.name)), key=self.number)
+
+    def create(self) -> str:
+        """RESERVE AN EMPTY DIRECTORY FOR THE NEXT GENERATION"""
+        with self._lock:
+            last = max([self.number(name) for name in self.names()], default=0)
+            name = f"{self.PREFIX}{last + 1:06d}"
+            self.path(name).mkdir()
+            self.in_use.add(name)
+            return name
+
+    def discard(self, name: str):
+        """DROP A GENERATION THAT FAILED BEFORE IT WAS PUBLISHED"""
+        with self._lock:
+            self.in_use.discard(name)
+            shutil.rmtree(self.path(name), ignore_errors=True)
+
+    def publish(self, name: str, ids: np.ndarray):
+        """MAKE name THE CURRENT GENERATION; ids ARE ITS CHUNK IDS IN INDEX ORDER"""
+        with self._lock:
+            previous = self.current_path()
+            if previous is not None:
+                dropped = np.setdiff1d(np.load(previous / PositionMap.FILE, mmap_mode="r"), ids)
+                dropped = dropped[dropped != PositionMap.TOMBSTONE]
+                if len(dropped):
+                    np.save(self.root / f"{self.DROPPED}{self.number(name):06d}.npy", dropped)
+            self._fsync_dir(self.path(name))
+            tmp = self.root / (self.POINTER + ".tmp")
+            with open(tmp, "w") as f:
+                f.write(name)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.root / self.POINTER)
+            self._fsync_dir(self.root)
+            logger.info(f"published vector store generation {name}")
+
+    @staticmethod
+    def _fsync_dir(path: Path):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def acquire(self, name: str):
+        with self._lock:
+            self.in_use.add(name)
+
+    def release(self, name: str):
+        """THE LAST READER OF name IS GONE; COLLECT IT UNLESS IT IS STILL CURRENT"""
+        with self._lock:
+            self.in_use.discard(name)
+        self.collect()
+
+    def collect(self):
+        """DELETE GENERATIONS NOBODY SERVES AND PURGE CHUNKS NO REMAINING GENERATION REFERENCES"""
+        with self._lock:
+            current = self.current()
+            for name in self.names():
+                if name != current and name not in self.in_use:
+                    shutil.rmtree(self.path(name), ignore_errors=True)
+                    logger.info(f"removed vector store generation {name}")
+            oldest = min([self.number(name) for name in self.names()], default=None)
+            for dropped in sorted(self.root.glob(f"{self.DROPPED}*.npy")):
+                # ROWS DROPPED BY gen-N ARE ONLY REFERENCED BY GENERATIONS OLDER THAN N
+                if oldest is not None and int(dropped.stem[len(self.DROPPED):]) > oldest:
+                    continue
+                ids = np.load(dropped)
+                self.chunks.delete([chunk_id.decode("ascii") for chunk_id in ids])
+                dropped.unlink()
+                logger.info(f"purged {len(ids)} chunks dropped by {dropped.stem[len(self.DROPPED):]}")
+
+    def migrate_legacy(self) -> Optional[str]:
+        """MOVE A SINGLE-DIRECTORY STORE (index.faiss DIRECTLY IN vectors/) INTO A FIRST GENERATION"""
+        index_path = self.root / self.index_file
+        if not index_path.exists():
+            return None
+        name = self.create()
+        target = self.path(name)
+        legacy = self.root / "index.pkl"
+        if legacy.exists():
+            with open(legacy, "rb") as f:
+                docstore, index_to_docstore_id = pickle.load(f)  # TRUSTED: WRITTEN BY OUR OWN save_local
+            ordered = [chunk_id for _, chunk_id in sorted(index_to_docstore_id.items())]
+            for start in range(0, len(ordered), 1000):
+                self.chunks.add({chunk_id: docstore.search(chunk_id) for chunk_id in ordered[start:start + 1000]})
+            self.chunks.commit()
+        else:
+            # SINGLE-DIRECTORY CHUNK STORES KEPT THE FAISS POSITION IN A COLUMN
+            ordered = self.chunks.legacy_order()
+            if ordered is None:
+                raise ValueError(f"{index_path} has neither index.pkl nor a chunk position column")
+        ids = np.asarray(ordered, dtype=f"S{max([len(chunk_id) for chunk_id in ordered], default=32)}")
+        PositionMap(ids).save(target)
+        os.replace(index_path, target / self.index_file)
+        if (self.root / self.meta_file).exists():
+            os.replace(self.root / self.meta_file, target / self.meta_file)
+        self.publish(name, ids)
+        if legacy.exists():
+            legacy.unlink()
+        logger.info(f"migrated single-directory vector store into {name}")
+        return name
+
+
+class StoreHandle:
+    """ONE SERVED GENERATION AND THE NUMBER OF READERS HOLDING IT"""
+
+    def __init__(self, store, on_release: Optional[Callable[[], None]] = None):
+        self.store = store
+        self.on_release = on_release
+        self.refs = 1  # THE OWNER'S REFERENCE, DROPPED WHEN A NEWER STORE IS PUBLISHED
+
+
+class VersionedStore:
+    """CURRENT VECTOR STORE WITH REFERENCE-COUNTED READERS
+
+    A READER ACQUIRES THE CURRENT STORE FOR THE WHOLE OF ITS SEARCH; PUBLISHING A NEW STORE
+    ONLY SWAPS THE POINTER, AND THE OLD ONE IS RELEASED ONCE ITS LAST READER IS DONE.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._handle: Optional[StoreHandle] = None
+
+    @property
+    def current(self):
+        handle = self._handle
+        return handle.store if handle else None
+
+    def publish(self, store, on_release: Optional[Callable[[], None]] = None):
+        with self._lock:
+            previous, self._handle = self._handle, StoreHandle(store, on_release)
+        if previous is not None:
+            self._release(previous)
+
+    @contextmanager
+    def acquire(self):
+        """YIELDS THE CURRENT STORE (None BEFORE THE FIRST PUBLISH), PINNED UNTIL THE BLOCK EXITS"""
+        with self._lock:
+            handle = self._handle
+            if handle is not None:
+                handle.refs += 1
+        try:
+            yield handle.store if handle else None
+        finally:
+            if handle is not None:
+                self._release(handle)
+
+    def _release(self, handle: StoreHandle):
+        with self._lock:
+            handle.refs -= 1
+            last = handle.refs == 0
+        if last and handle.on_release is not None:
+            try:
+                handle.on_release()
+            except Exception as e:
+                logger.error(f"releasing vector store failed: {str(e)}")
@@ -0,0 +1,166 @@
+import math
+from typing import List, Optional
+import numpy as np
+import faiss
+from app.chunk_store import ChunkFAISS, ChunkStore
+import logging
+
+if not logging.getLogger().hasHandlers():
+    from app.config import UbuntuConfig
+    UbuntuConfig.init_logging()
+logger = logging.getLogger(__name__)
+
+
+class IndexFactory:
+    """CHOOSE, TRAIN AND TUNE THE FAISS INDEX BEHIND THE VECTOR STORE
+
+    flat    - EXACT BRUTE FORCE, NO TRAINING
+    ivfflat - INVERTED LISTS OVER FULL VECTORS, SEARCHES nprobe CELLS
+    ivfpq   - INVERTED LISTS OVER PRODUCT-QUANTIZED CODES, BOUNDED MEMORY PER VECTOR
+    hnsw    - GRAPH INDEX, NO TRAINING, SEARCH WIDTH efSearch
+    """
+
+    TYPES = ("flat", "ivfflat", "ivfpq", "hnsw")
+    TRAINED = ("ivfflat", "ivfpq")
+    POINTS_PER_CELL = 39  # FAISS WARNS BELOW THIS MANY TRAINING POINTS PER CENTROID
+    MIN_NLIST = 16
+
+    def __init__(self, config):
+        self.kind = config.INDEX_TYPE.lower()
+        if self.kind not in self.TYPES:
+            raise ValueError(f"unknown INDEX_TYPE {config.INDEX_TYPE}, expected one of {self.TYPES}")
+        self.nlist = config.INDEX_NLIST
+        self.nprobe = config.FAISS_NPROBE
+        self.pq_m = config.INDEX_PQ_M
+        self.pq_bits = config.INDEX_PQ_BITS
+        self.hnsw_m = config.INDEX_HNSW_M
+        self.ef_construction = config.INDEX_HNSW_EF_CONSTRUCTION
+        self.ef_search = config.INDEX_HNSW_EF_SEARCH
+        self.train_sample = config.INDEX_TRAIN_SAMPLE
+        self.retrain_growth = config.INDEX_RETRAIN_GROWTH
+        self.compact_ratio = config.INDEX_COMPACT_RATIO
+
+    def min_train_size(self, kind: str) -> int:
+        if kind == "ivfflat":
+            return self.MIN_NLIST * self.POINTS_PER_CELL
+        if kind == "ivfpq":
+            return max(self.MIN_NLIST * self.POINTS_PER_CELL, (2 ** self.pq_bits) * self.POINTS_PER_CELL)
+        return 0
+
+    def _pq_subquantizers(self, dim: int) -> int:
+        # PQ NEEDS m TO DIVIDE THE DIMENSION
+        for m in range(min(self.pq_m, dim), 0, -1):
+            if dim % m == 0:
+                return m
+        return 1
+
+    def factory_string(self, kind: str, dim: int, sample_size: int, expected_total: int) -> Optional[str]:
+        """FAISS index_factory DESCRIPTION, None WHEN THE SAMPLE IS TOO SMALL TO TRAIN kind"""
+        if kind == "flat":
+            return "Flat"
+        if kind == "hnsw":
+            return f"HNSW{self.hnsw_m},Flat"
+        if sample_size < self.min_train_size(kind):
+            return None
+        nlist = self.nlist or int(4 * math.sqrt(max(expected_total, sample_size)))
+        nlist = min(nlist, sample_size // self.POINTS_PER_CELL)
+        if nlist < self.MIN_NLIST:
+            return None
+        if kind == "ivfflat":
+            return f"IVF{nlist},Flat"
+        return f"IVF{nlist},PQ{self._pq_subquantizers(dim)}x{self.pq_bits}"
+
+    def create(self, sample: np.ndarray, expected_total: int):
+        """BUILD AND TRAIN AN EMPTY INDEX FROM A VECTOR SAMPLE; RETURNS (index, info)"""
+        dim = sample.shape[1]
+        kind = self.kind
+        spec = self.factory_string(kind, dim, len(sample), expected_total)
+        if spec is None:
+            logger.info(f"{len(sample)} vectors are too few to train {kind}, falling back to flat")
+            kind, spec = "flat", "Flat"
+        index = faiss.index_factory(dim, spec, faiss.METRIC_L2)
+        if kind == "hnsw":
+            index.hnsw.efConstruction = self.ef_construction
+        if not index.is_trained:
+            index.train(sample)
+            logger.info(f"trained {spec} on {len(sample)} vectors")
+        info = {
+            "type": kind,
+            "requested": self.kind,
+            "factory": spec,
+            "dim": dim,
+            "trained_on": len(sample) if kind in self.TRAINED else 0,
+            "sized_for": max(expected_total, len(sample)) if kind in self.TRAINED else 0,
+        }
+        return index, info
+
+    def tune(self, index):
+        """APPLY QUERY-TIME SEARCH WIDTH, NOT ALL OF IT SURVIVES write_index/read_index"""
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is not None:
+            ivf.nprobe = min(self.nprobe, ivf.nlist)
+        elif isinstance(index, faiss.IndexHNSW):
+            index.hnsw.efSearch = self.ef_search
+
+    def needs_compaction(self, slots: int, live: int) -> bool:
+        """TRUE ONCE TOMBSTONED SLOTS (REMOVED CHUNKS) EXCEED compact_ratio OF THE INDEX"""
+        return slots > 0 and slots - live > self.compact_ratio * slots
+
+    def needs_rebuild(self, info: Optional[dict], ntotal: int) -> bool:
+        """TRUE WHEN THE CURRENT INDEX NO LONGER FITS THE CONFIGURATION OR THE CORPUS SIZE"""
+        if info is None:
+            return self.kind != "flat"  # STORES BUILT BEFORE INDEX TYPES WERE RECORDED ARE FLAT
+        if info.get("requested") != self.kind:
+            return True
+        if info["type"] == "flat" and self.kind in self.TRAINED:
+            return ntotal >= self.min_train_size(self.kind)  # GREW PAST THE FALLBACK
+        if info["type"] in self.TRAINED:
+            return ntotal > info["sized_for"] * self.retrain_growth
+        return False
+
+
+class StoreBuilder:
+    """STREAMING FAISS STORE CONSTRUCTION: BUFFER A TRAINING SAMPLE, TRAIN, THEN APPEND DIRECTLY
+
+    CHUNK TEXTS GO STRAIGHT INTO THE SHARED SQLITE CHUNK STORE, ONLY VECTORS STAY IN MEMORY.
+    """
+
+    def __init__(self, factory: IndexFactory, embeddings, chunks: ChunkStore, expected_total: Optional[int] = None):
+        self.factory = factory
+        self.embeddings = embeddings
+        self.chunks = chunks
+        self.expected_total = expected_total or 0
+        self.store: Optional[ChunkFAISS] = None
+        self.info: Optional[dict] = None
+        self.pending = []  # (texts, float32 vectors, metadatas, ids) UNTIL THE INDEX IS TRAINED
+        self.buffered = 0
+        self.total = 0
+
+    def add(self, texts: List[str], vectors, metadatas: List[dict], ids: List[str]):
+        if not texts:
+            return
+        self.total += len(texts)
+        if self.store is not None:
+            self.store.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=ids)
+            return
+        # FLOAT32 ROWS, A FRACTION OF THE SIZE OF PYTHON FLOAT LISTS
+        self.pending.append((texts, np.asarray(vectors, dtype=np.float32), metadatas, ids))
+        self.buffered += len(texts)
+        if self.factory.kind in IndexFactory.TRAINED and self.buffered < self.factory.train_sample:
+            return
+        self._materialize()
+
+    def _materialize(self):
+        sample = np.concatenate([vectors for _, vectors, _, _ in self.pending])
+        index, self.info = self.factory.create(sample, max(self.expected_total, len(sample)))
+        del sample
+        self.store = ChunkFAISS.create(self.chunks, self.embeddings, index)
+        pending, self.pending = self.pending, []
+        for texts, vectors, metadatas, ids in pending:
+            self.store.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=ids)
+
+    def finish(self) -> Optional[ChunkFAISS]:
+        """THE BUILT STORE, None WHEN NOTHING WAS ADDED"""
+        if self.store is None and self.pending:
+            self._materialize()
+        return self.store
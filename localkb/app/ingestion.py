@@ -0,0 +1,272 @@
+import os
+import time
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+from langchain.schema import Document
+import psutil
+import logging
+
+if not logging.getLogger().hasHandlers():
+    from app.config import UbuntuConfig
+    UbuntuConfig.init_logging()
+logger = logging.getLogger(__name__)
+
+_DONE = object()  # END-OF-STAGE MARKER
+
+
+class IngestedFile(NamedTuple):
+    rel_path: str
+    fingerprint: Optional[dict]    # {size, mtime_ns, inode, hash}, None IF THE FILE VANISHED
+    chunks: List[Document]
+    vectors: List[List[float]]     # ALIGNED WITH chunks
+
+
+def parse_file(file_path: str, loader_spec, detector) -> Tuple[List[Document], Optional[dict]]:
+    """PARSE ONE FILE IN A WORKER PROCESS; RETURNS (docs, fingerprint)"""
+    try:
+        fingerprint = detector.fingerprint(file_path)
+    except FileNotFoundError:
+        return [], None
+    if loader_spec is None:
+        return [], fingerprint  # INGORE UNSUPPORTED FORMAT
+    loader_class, loader_args = loader_spec
+    try:
+        return loader_class(file_path, **loader_args).load(), fingerprint
+    except Exception as e:
+        # SKIP ERROR FILE, SAME AS silent_errors IN THE DirectoryLoader
+        logging.getLogger(__name__).warning(f"document load failure {file_path}: {str(e)}")
+        return [], fingerprint
+
+
+class StageStats:
+    def __init__(self, name: str, unit: str):
+        self.name = name
+        self.unit = unit
+        self.count = 0
+
+    def add(self, count: int):
+        self.count += count
+
+    def summary(self, wall: float) -> dict:
+        return {
+            "count": self.count,
+            f"{self.unit}_per_s": round(self.count / wall, 2) if wall > 0 else 0.0,
+        }
+
+
+class MemoryGovernor:
+    """HOLD BACK NEW PARSE WORK WHILE THE SERVICE (PLUS PARSER PROCESSES) IS OVER ITS MEMORY BUDGET"""
+
+    def __init__(self, budget_bytes: float):
+        self.budget = budget_bytes
+        self.process = psutil.Process()
+        self.peak = 0
+        self.waits = 0
+        self.throttled = False
+
+    def rss(self) -> int:
+        total = self.process.memory_info().rss
+        for child in self.process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass
+        self.peak = max(self.peak, total)
+        return total
+
+    def throttle(self, busy: bool) -> bool:
+        """TRUE WHEN NEW PARSE WORK SHOULD WAIT
+
+        ONLY WHILE OVER BUDGET AND SOMETHING DOWNSTREAM IS STILL DRAINING; WITH NOTHING IN FLIGHT,
+        WAITING CANNOT FREE MEMORY, SO THE BUILD PROCEEDS ONE FILE AT A TIME.
+        """
+        if not busy or self.rss() <= self.budget:
+            self.throttled = False
+            return False
+        if not self.throttled:
+            self.waits += 1
+            logger.debug(f"memory {self.peak / 2**20:.0f}MB over budget {self.budget / 2**20:.0f}MB, pausing parse")
+            self.throttled = True
+        return True
+
+
+class IngestionPipeline:
+    """PARSE (PROCESS POOL) -> SPLIT (THREAD) -> EMBED (EmbeddingEngine) WITH BOUNDED QUEUES"""
+
+    def __init__(self, config, loader_mapping, text_splitter, engine, detector):
+        self.config = config
+        self.loader_mapping = loader_mapping
+        self.text_splitter = text_splitter
+        self.engine = engine
+        self.detector = detector
+        self.parse_workers = config.INGEST_PARSE_WORKERS or os.cpu_count() or 1
+        self.queue_size = config.INGEST_QUEUE_SIZE
+        self.governor = MemoryGovernor(config.BUILD_MEMORY_BUDGET)
+        self.stats = {
+            "parse": StageStats("parse", "docs"),
+            "split": StageStats("split", "chunks"),
+            "embed": StageStats("embed", "embeddings"),
+        }
+        self.wall = 0.0
+
+    def run(self, files: List[Tuple[str, str]]) -> Iterator[IngestedFile]:
+        """YIELD EACH FILE AS SOON AS ALL OF ITS CHUNKS ARE EMBEDDED"""
+        parsed_q = queue.Queue(maxsize=self.queue_size)
+        chunk_q = queue.Queue(maxsize=self.queue_size)
+        out_q = queue.Queue(maxsize=self.queue_size)
+        self.queues = (parsed_q, chunk_q, out_q)
+        abort = threading.Event()
+        self.errors = []
+        start = time.perf_counter()
+
+        threads = [
+            threading.Thread(target=self._stage, args=(self._parse, files, parsed_q, out_q, abort), name="ingest-parse", daemon=True),
+            threading.Thread(target=self._stage, args=(self._split, parsed_q, chunk_q, out_q, abort), name="ingest-split", daemon=True),
+            threading.Thread(target=self._stage, args=(self._embed, chunk_q, out_q, out_q, abort), name="ingest-embed", daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = self._get(out_q, abort)
+                if item is _DONE:
+                    break
+                yield item
+            if self.errors:
+                raise self.errors[0]
+        finally:
+            abort.set()
+            for thread in threads:
+                thread.join(timeout=5.0)
+            self.wall = time.perf_counter() - start
+            logger.info(f"ingestion finished in {self.wall:.1f}s: {self.summary()}")
+
+    def summary(self) -> dict:
+        summary = {name: stage.summary(self.wall) for name, stage in self.stats.items()}
+        summary["memory"] = {
+            "budget_mb": round(self.governor.budget / 2**20),
+            "peak_rss_mb": round(self.governor.peak / 2**20),
+            "throttled": self.governor.waits,
+        }
+        return summary
+
+    # ---- STAGES ----
+
+    def _stage(self, func, source, sink, out_q, abort):
+        try:
+            func(source, sink, out_q, abort)
+        except BaseException as e:
+            self._fail(e, abort)
+
+    def _fail(self, error, abort):
+        logger.error(f"ingestion failed: {str(error)}", exc_info=error)
+        self.errors.append(error)
+        abort.set()
+
+    @staticmethod
+    def _put(q, item, abort):
+        """BLOCKING PUT THAT GIVES UP WHEN THE PIPELINE IS ABORTED (BACKPRESSURE)"""
+        while True:
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                if abort.is_set():
+                    return False
+
+    @staticmethod
+    def _get(q, abort):
+        """BLOCKING GET THAT RETURNS THE END MARKER WHEN THE PIPELINE IS ABORTED"""
+        while True:
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                if abort.is_set():
+                    return _DONE
+
+    def _parse(self, files, parsed_q, out_q, abort):
+        context = multiprocessing.get_context(self.config.INGEST_MP_CONTEXT)
+        max_pending = self.parse_workers * 2
+        with ProcessPoolExecutor(max_workers=self.parse_workers, mp_context=context) as pool:
+            pending = {}
+            files = iter(files)
+            exhausted = False
+            while not abort.is_set():
+                while not exhausted and len(pending) < max_pending:
+                    # BACKPRESSURE ON MEMORY, NOT JUST ON QUEUE LENGTH
+                    if self.governor.throttle(bool(pending) or any(q.qsize() for q in self.queues)):
+                        break
+                    try:
+                        rel_path, file_path = next(files)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    spec = self.loader_mapping.get(os.path.splitext(file_path)[1].lower())
+                    future = pool.submit(parse_file, file_path, spec, self.detector)
+                    pending[future] = rel_path
+                if not pending:
+                    if exhausted:
+                        break
+                    time.sleep(0.2)  # THROTTLED, LET THE SPLIT/EMBED STAGES DRAIN
+                    continue
+                done, _ = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in done:
+                    rel_path = pending.pop(future)
+                    docs, fingerprint = future.result()
+                    self.stats["parse"].add(1)
+                    if not self._put(parsed_q, (rel_path, docs, fingerprint), abort):
+                        break
+            if abort.is_set():
+                for future in pending:
+                    future.cancel()
+        self._put(parsed_q, _DONE, abort)
+
+    def _split(self, parsed_q, chunk_q, out_q, abort):
+        while True:
+            item = self._get(parsed_q, abort)
+            if item is _DONE:
+                break
+            rel_path, docs, fingerprint = item
+            chunks = self.text_splitter.split_documents(docs) if docs else []
+            self.stats["split"].add(len(chunks))
+            if not self._put(chunk_q, (rel_path, fingerprint, chunks), abort):
+                break
+        self._put(chunk_q, _DONE, abort)
+
+    def _embed(self, chunk_q, _, out_q, abort):
+        # PER-FILE SLOTS FILLED AS BATCHES COME BACK; A FILE IS EMITTED WHEN ITS LAST SLOT IS SET
+        files = {}
+
+        def finish(key):
+            rel_path, fingerprint, chunks, vectors, _ = files.pop(key)
+            return self._put(out_q, IngestedFile(rel_path, fingerprint, chunks, vectors), abort)
+
+        def items():
+            key = 0
+            while True:
+                item = self._get(chunk_q, abort)
+                if item is _DONE:
+                    return
+                rel_path, fingerprint, chunks = item
+                key += 1
+                files[key] = [rel_path, fingerprint, chunks, [None] * len(chunks), len(chunks)]
+                if not chunks:
+                    finish(key)
+                    continue
+                for index, doc in enumerate(chunks):
+                    yield key, index, doc
+
+        for batch, vectors in self.engine.stream(items(), text=lambda item: item[2].page_content):
+            self.stats["embed"].add(len(batch))
+            for (key, index, _), vector in zip(batch, vectors):
+                entry = files[key]
+                entry[3][index] = vector
+                entry[4] -= 1
+                if entry[4] == 0:
+                    finish(key)
+            if abort.is_set():
+                return
+        self._put(out_q, _DONE, abort)
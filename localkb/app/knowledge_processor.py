@@ -1,4 +1,5 @@
 import os
+import time
 from pathlib import Path
 import torch 
 from typing import List, Optional
@@ -11,8 +12,11 @@ from langchain.chains import RetrievalQA
 from sentence_transformers import SentenceTransformer
 from sklearn.metrics.pairwise import cosine_similarity
 from langchain.prompts import PromptTemplate
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
-import torch
+from app.reranker import CrossEncoderReranker
+from app.generations import VersionedStore
+from app.retrieval_policy import DISTANCE_KEY, RetrievalPolicy
+from app.context_assembler import ContextAssembler
+from app.prompt_builder import PrompBuilder
 import numpy as np
 import logging
 
@@ -23,72 +27,141 @@ if not logging.getLogger().hasHandlers():
 logger = logging.getLogger(__name__)   
 
 class KnowledgeProcessor:
-    def __init__(self, config):
+    def __init__(self, config, reranker=None):
         self.config = config
-        self.vector_store: Optional[FAISS] = None
+        self.stores = VersionedStore()  # READERS PIN A GENERATION, SWAPS NEVER PULL IT FROM UNDER THEM
         self.embeddings = None
+        self.llm = None
         self.qa_chain = None
+        self.reranker = reranker or CrossEncoderReranker(config)  # INJECTABLE FOR BENCHMARKS
+        self.policy = RetrievalPolicy(config)
+        # BUDGETED AGAINST THE STREAMING PROMPT THE CONTEXT IS INLINED INTO
+        self.assembler = ContextAssembler(config, PrompBuilder().build_prompt_stream("", ""))
+        self.store_listeners = []  # CALLED WITH THE NEW STORE WHENEVER IT IS SWAPPED IN
 
     def retrieve_context_rerank(self, question: str, top_k: int = 5) -> str:
-        logger.info(f"calling context rerank function with similarity search setting [{top_k}]")
         """RETRIEVE CONTEXT FROM VECTOR STORE"""
-        if self.vector_store is None:
-            logger.info("vector store is not loaded, returing empty string")
-            return ""  # NEED TO MAKRE SURE VECTOR STORE IS LOADED
-        
-        # SIMILARITY SEARCH
-        docs = self.vector_store.similarity_search(question, k=top_k)
+        logger.info(f"calling context rerank function with similarity search setting [{self.candidate_count(top_k)}]")
+        docs = self.retrieve_candidates(question, top_k=top_k)
+        return self.rerank_context(question, docs)
+
+    def candidate_count(self, top_k: int) -> int:
+        """FIRST-STAGE SEARCH DEPTH: VECTOR_CANDIDATES, BUT NEVER FEWER THAN THE CALLER ASKED FOR"""
+        return max(top_k, self.config.VECTOR_CANDIDATES)
+
+    def retrieve_candidates(self, question: str, top_k: int = 5) -> List[Document]:
+        """FIRST STAGE: SIMILARITY SEARCH ONLY"""
+        with self.stores.acquire() as vector_store:
+            if vector_store is None:
+                logger.info("vector store is not loaded, returing empty list")
+                return []  # NEED TO MAKRE SURE VECTOR STORE IS LOADED
+
+            # SIMILARITY SEARCH, FUSED WITH BM25 HITS FOR EXACT TOKENS (ERROR CODES, HOSTNAMES, FLAGS)
+            docs = []
+            for doc, distance in vector_store.similarity_search_with_score(question, k=self.candidate_count(top_k)):
+                doc.metadata[DISTANCE_KEY] = float(distance)  # FRESH DOCUMENT PER SEARCH, READ BY THE RERANK POLICY
+                docs.append(doc)
+            if self.config.HYBRID_RETRIEVAL and getattr(vector_store, "lexical", None) is not None:
+                lexical = vector_store.lexical_search(question, self.config.LEXICAL_CANDIDATES)
+                docs = self.fuse_rankings(docs, lexical, k=self.config.RRF_K)
+        logger.info(f"info: find [{len(docs)}] initial docs for [{question}]")
+        return docs
+
+    def rerank_context(self, question: str, docs: List[Document], top_n: Optional[int] = None) -> str:
+        """SECOND STAGE: RERANK CANDIDATES AND PACK THE BEST ONES INTO THE TOKEN BUDGET"""
+        refined_docs = self.select_context(question, docs, top_n)
+        return self.assembler.assemble(refined_docs, question)
+
+    def select_context(self, question: str, docs: List[Document], top_n: Optional[int] = None) -> List[Document]:
+        """KEEP THE top_n BEST CANDIDATES, RERANKING AS MANY AS THE POLICY ALLOWS"""
         if len(docs) < 1:
-            return ""
-        logger.info(f"info: find [{len(docs)}] initial docs and rerank...")
-        # RERANKING
-        tokenizer = AutoTokenizer.from_pretrained(self.config.CROSS_ENCODER_MODEL)
-        model_token = AutoModelForSequenceClassification.from_pretrained(self.config.CROSS_ENCODER_MODEL)
-        pairs = [(question, doc.page_content) for doc in docs]
-        features = tokenizer(pairs, padding=True, truncation=True, return_tensors="pt", max_length=512)
-        device = torch.device("cuda" if torch.cuda.is_available() else "cpu") # utilize GPU
-        model_token = model_token.to(device)
-        features = {k: v.to(device) for k, v in features.items()}
-        with torch.no_grad():
-            scores = model_token(**features).logits
-            rerank_scores = torch.sigmoid(scores).cpu().numpy().flatten()
-        refined_docs = [(docs[i], rerank_scores[i]) for i in range(len(docs))]
-        refined_docs.sort(key=lambda x: x[1], reverse=True)
-        top_N = 2
-        refined_docs = [doc for doc, _ in refined_docs[:top_N]]
-        logger.info(f"info: find [{len(refined_docs)}] filterred docs")
-        context = "\n\n".join([doc.page_content for doc in refined_docs])    
-        return context
-
-    def update_vector_store(self, vector_store):
-        self.vector_store = vector_store
-        logger.info(f"vector store updated with {len(vector_store.index.reconstruct_n(0, vector_store.index.ntotal))} vectors.")
+            return []
+        top_n = top_n or self.config.RERANK_TOP_N
+        plan = self.policy.plan(docs, top_n)
+        start = time.perf_counter()
+        if plan.action == "early_exit":
+            refined_docs = docs[:top_n]
+        else:
+            # RERANKING
+            refined_docs = [doc for doc, _ in self.reranker.rerank(question, docs[:plan.size], top_n=top_n)]
+            self.policy.observe(plan.size, time.perf_counter() - start)
+        margin = f"{plan.margin:.3f}" if plan.margin is not None else "n/a"
+        logger.info(f"info: rerank policy [{plan.action}] scored {plan.size}/{len(docs)} candidates "
+                    f"(margin {margin}, estimated {plan.estimated_ms}ms of {self.policy.budget_ms}ms budget, "
+                    f"took {(time.perf_counter() - start) * 1000:.1f}ms), kept [{len(refined_docs)}] docs")
+        return refined_docs
+
+    @staticmethod
+    def merge_candidates(*doc_lists: List[Document]) -> List[Document]:
+        """UNION OF CANDIDATE LISTS, KEEPING THE FIRST OCCURRENCE OF EACH CHUNK"""
+        merged, seen = [], set()
+        for docs in doc_lists:
+            for doc in docs:
+                key = (doc.metadata.get("source"), doc.page_content)
+                if key not in seen:
+                    seen.add(key)
+                    merged.append(doc)
+        return merged
+
+    @staticmethod
+    def fuse_rankings(*rankings: List[Document], k: int = 60) -> List[Document]:
+        """RECIPROCAL RANK FUSION: SUM OF 1 / (k + rank) OVER THE RANKINGS A CHUNK APPEARS IN"""
+        scores, docs = {}, {}
+        for ranking in rankings:
+            for rank, doc in enumerate(ranking, start=1):
+                key = (doc.metadata.get("source"), doc.page_content)
+                scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+                docs.setdefault(key, doc)
+        return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)]
+
+    def add_store_listener(self, callback):
+        self.store_listeners.append(callback)
+
+    @property
+    def vector_store(self) -> Optional[FAISS]:
+        return self.stores.current
+
+    def update_vector_store(self, vector_store, on_release=None):
+        """PUBLISH vector_store; on_release RUNS ONCE THE PREVIOUS STORE'S LAST READER IS DONE"""
+        self.stores.publish(vector_store, on_release)
+        logger.info(f"vector store updated with {vector_store.index.ntotal} vectors.")
+        for callback in self.store_listeners:
+            try:
+                callback(vector_store)
+            except Exception as e:
+                logger.error(f"vector store listener failed: {str(e)}")
         
     def update_embeddings(self, embeddings):
         self.embeddings = embeddings
         logger.info(f"embeddings is updated")
 
+    def update_llm(self, llm):
+        self.llm = llm
+        self.qa_chain = None
+        logger.info(f"llm is updated")
+
     # NON-STREAMING RETRIEVAL
     def retrieveQA(self, question: str):
-        try:
-            if self.vector_store is None:
+        """ANSWER question WITH THE QA CHAIN; FAILURES RAISE, SO AN ERROR IS NEVER RETURNED AS AN ANSWER"""
+        with self.stores.acquire() as vector_store:
+            if vector_store is None:
                 logger.info("vector store is not loaded, returing empty string")
                 return ""  # NEED TO MAKRE SURE VECTOR STORE IS LOADED
 
-            if not self.qa_chain:
+            # A CHAIN BUILT BEFORE THE LAST SWAP STILL SEARCHES THE OLD STORE
+            qa_chain = self.qa_chain
+            if not qa_chain or qa_chain.retriever.vectorstore is not vector_store:
                 logger.info("initilaize QA chain...")
-                self._init_qa_chain()
-            
-            results = self.qa_chain.invoke({"query" : question})
-            response = results['result']
-            logger.info(f"quesion ({question}) has response ({response})")
-            return response
-        except Exception as e:
-            return f"request fails - {str(e)}"
+                qa_chain = self._init_qa_chain(vector_store)
+
+            results = qa_chain.invoke({"query" : question})
+        response = results['result']
+        logger.info(f"quesion ({question}) has response ({response})")
+        return response
     
-    def _init_qa_chain(self):
-        llm = OllamaLLM(model=self.config.LLM_MODEL)
-        retriever = self.vector_store.as_retriever()
+    def _init_qa_chain(self, vector_store):
+        llm = self.llm or OllamaLLM(model=self.config.LLM_MODEL)
+        retriever = vector_store.as_retriever()
         qa_prompt = PromptTemplate(
             input_variables=["context","question"],
             template="""
@@ -107,4 +180,5 @@ class KnowledgeProcessor:
             Answer: 
             """
         )
-        self.qa_chain = RetrievalQA.from_chain_type(llm=llm, retriever=retriever, chain_type="stuff", chain_type_kwargs={"prompt": qa_prompt}, return_source_documents=False)
\ No newline at end of file
+        self.qa_chain = RetrievalQA.from_chain_type(llm=llm, retriever=retriever, chain_type="stuff", chain_type_kwargs={"prompt": qa_prompt}, return_source_documents=False)
+        return self.qa_chain
\ No newline at end of file
@@ -0,0 +1,191 @@
+import re
+import hashlib
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+import numpy as np
+import logging
+
+if not logging.getLogger().hasHandlers():
+    from app.config import UbuntuConfig
+    UbuntuConfig.init_logging()
+logger = logging.getLogger(__name__)
+
+# CLI FLAGS (--force), DOTTED/DASHED IDENTIFIERS (host-01.example.com, 10.0.0.1, E_ACCESS:0x5) AND PLAIN WORDS
+TOKEN = re.compile(r"-{1,2}\w[\w\-]*|\w+(?:[.\-:/@]\w+)*")
+WORD = re.compile(r"[^\W_]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """LOWER-CASED TERMS; COMPOUND TOKENS ARE KEPT WHOLE AND ALSO SPLIT INTO THEIR PARTS"""
+    tokens = []
+    for match in TOKEN.finditer(text.lower()):
+        token = match.group()
+        tokens.append(token)
+        parts = WORD.findall(token)
+        if parts != [token]:
+            tokens.extend(parts)
+    return tokens
+
+
+@lru_cache(maxsize=200000)
+def term_hash(term: str) -> int:
+    """STABLE 64-BIT TERM ID, THE VOCABULARY STORES HASHES INSTEAD OF STRINGS"""
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class LexicalBuilder:
+    """COLLECT (TERM, DOC, TF) POSTINGS FOR DOCS start, start+1, ... AS NUMPY BATCHES
+
+    A None TEXT IS A TOMBSTONED SLOT: IT TAKES A DOC NUMBER BUT HAS NO POSTINGS.
+    """
+
+    def __init__(self, start: int = 0):
+        self.next_doc = start
+        self.batches = []
+        self.lengths = []
+
+    def add(self, texts: Iterable[Optional[str]]):
+        terms, docs, tfs, lengths = [], [], [], []
+        for text in texts:
+            if text is None:
+                lengths.append(LexicalIndex.TOMBSTONE)
+                self.next_doc += 1
+                continue
+            counts = Counter(tokenize(text))
+            for term, tf in counts.items():
+                terms.append(term_hash(term))
+                docs.append(self.next_doc)
+                tfs.append(min(tf, 65535))
+            lengths.append(sum(counts.values()))
+            self.next_doc += 1
+        self.batches.append((np.asarray(terms, dtype=np.uint64), np.asarray(docs, dtype=np.int32), np.asarray(tfs, dtype=np.uint16)))
+        self.lengths.append(np.asarray(lengths, dtype=np.int32))
+
+    def postings(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        if not self.batches:
+            return np.empty(0, np.uint64), np.empty(0, np.int32), np.empty(0, np.uint16), np.empty(0, np.int32)
+        terms, docs, tfs = (np.concatenate(column) for column in zip(*self.batches))
+        return terms, docs, tfs, np.concatenate(self.lengths)
+
+
+class LexicalIndex:
+    """BM25 INVERTED INDEX OVER ONE GENERATION'S CHUNKS, DOC ID == FAISS POSITION
+
+    POSTINGS ARE CSR ARRAYS: vocab (SORTED 64-BIT TERM HASHES), offsets INTO docs/tfs, AND
+    PER-DOC lengths, TOMBSTONE FOR A REMOVED SLOT. SAVED AS .npy FILES AND MEMORY-MAPPED WHEN
+    SERVING, LIKE THE FAISS INDEX.
+    """
+
+    DIR = "bm25"
+    ARRAYS = ("vocab", "offsets", "docs", "tfs", "lengths")
+    MAX_DF_RATIO = 0.5  # TERMS IN OVER HALF THE CHUNKS BARELY MOVE THE RANKING BUT DOMINATE THE COST
+    MIN_DOCS_FOR_DF_CUTOFF = 100
+    TOMBSTONE = -1
+
+    def __init__(self, vocab, offsets, docs, tfs, lengths, k1: float = 1.2, b: float = 0.75):
+        self.vocab = vocab
+        self.offsets = offsets
+        self.docs = docs
+        self.tfs = tfs
+        self.lengths = lengths
+        self.k1 = k1
+        self.b = b
+        live = np.asarray(lengths)[np.asarray(lengths) != self.TOMBSTONE]
+        self.live = len(live)
+        self.avgdl = float(live.mean()) if len(live) else 0.0
+
+    @classmethod
+    def from_postings(cls, terms, docs, tfs, lengths, **params) -> "LexicalIndex":
+        order = np.lexsort((docs, terms))  # BY TERM, THEN DOC
+        terms, docs, tfs = terms[order], docs[order], tfs[order]
+        vocab, starts = np.unique(terms, return_index=True)
+        offsets = np.append(starts, len(terms)).astype(np.int64)
+        return cls(vocab, offsets, docs, tfs, lengths, **params)
+
+    @classmethod
+    def build(cls, texts: Iterable[Optional[str]], batch_size: int = 1000, **params) -> "LexicalIndex":
+        builder = LexicalBuilder()
+        batch = []
+        for text in texts:
+            batch.append(text)
+            if len(batch) >= batch_size:
+                builder.add(batch)
+                batch = []
+        builder.add(batch)
+        return cls.from_postings(*builder.postings(), **params)
+
+    @classmethod
+    def load(cls, directory, mmap: bool = True, **params) -> Optional["LexicalIndex"]:
+        """None WHEN THE GENERATION HAS NO LEXICAL INDEX"""
+        path = Path(directory) / cls.DIR
+        if not path.exists():
+            return None
+        arrays = [np.load(path / f"{name}.npy", mmap_mode="r" if mmap else None) for name in cls.ARRAYS]
+        return cls(*arrays, **params)
+
+    def save(self, directory):
+        path = Path(directory) / self.DIR
+        path.mkdir(parents=True, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(path / f"{name}.npy", np.asarray(getattr(self, name)))
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def updated(self, removed: Iterable[int], texts: List[str], compact: bool = False) -> "LexicalIndex":
+        """NEW INDEX WITH DOCS removed DROPPED AND texts APPENDED; self IS UNTOUCHED
+
+        BY DEFAULT REMOVED DOCS BECOME TOMBSTONES AND KEEP THEIR NUMBERS, AS FAISS SLOTS DO ON AN
+        INCREMENTAL UPDATE; compact=True DROPS ALL TOMBSTONES AND SHIFTS LATER DOCS DOWN, AS A REBUILD DOES.
+        """
+        lengths = np.array(self.lengths)
+        lengths[np.fromiter(removed, dtype=np.int64)] = self.TOMBSTONE
+        keep = lengths != self.TOMBSTONE
+        if compact:
+            new_position = np.cumsum(keep, dtype=np.int64) - 1
+            lengths = lengths[keep]
+        else:
+            new_position = np.arange(len(lengths), dtype=np.int64)
+        terms = np.repeat(np.asarray(self.vocab), np.diff(self.offsets))
+        live = keep[self.docs]
+        builder = LexicalBuilder(start=len(lengths))
+        builder.add(texts)
+        new_terms, new_docs, new_tfs, new_lengths = builder.postings()
+        return self.from_postings(
+            np.concatenate([terms[live], new_terms]),
+            np.concatenate([new_position[self.docs[live]].astype(np.int32), new_docs]),
+            np.concatenate([np.asarray(self.tfs)[live], new_tfs]),
+            np.concatenate([lengths, new_lengths]),
+            k1=self.k1, b=self.b
+        )
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """TOP k (DOC, BM25 SCORE) PAIRS, BEST FIRST"""
+        total = self.live
+        if total == 0 or k <= 0 or len(self.vocab) == 0:
+            return []
+        hashes = np.unique(np.asarray([term_hash(term) for term in tokenize(query)], dtype=np.uint64))
+        slots = np.searchsorted(self.vocab, hashes)
+        found = slots < len(self.vocab)
+        found[found] = self.vocab[slots[found]] == hashes[found]
+        hit_docs, hit_scores = [], []
+        for slot in slots[found]:
+            start, end = int(self.offsets[slot]), int(self.offsets[slot + 1])
+            df = end - start
+            if total >= self.MIN_DOCS_FOR_DF_CUTOFF and df > total * self.MAX_DF_RATIO:
+                continue
+            docs = np.asarray(self.docs[start:end])
+            tf = np.asarray(self.tfs[start:end], dtype=np.float32)
+            idf = np.log(1.0 + (total - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * self.lengths[docs] / self.avgdl)
+            hit_docs.append(docs)
+            hit_scores.append(idf * tf * (self.k1 + 1.0) / (tf + norm))
+        if not hit_docs:
+            return []
+        docs, inverse = np.unique(np.concatenate(hit_docs), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(hit_scores))
+        top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(docs[i]), float(scores[i])) for i in top]
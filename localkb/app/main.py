@@ -3,20 +3,28 @@ import logging
 from fastapi import FastAPI, Depends, Depends, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from fastapi.security import APIKeyHeader
+from starlette.background import BackgroundTask
 from app.config import UbuntuConfig
 config = UbuntuConfig()
 config.init_logging()
 from app.knowledge_processor import KnowledgeProcessor
-from app.ollama_client import OllamaClient
+from app.ollama_client import OllamaClient, OllamaClientEmbeddings, OllamaClientLLM
 from app.prompt_builder import PrompBuilder
+from app.query_preprocessor import QueryPreprocessor
+from app.answer_cache import AnswerCache
+from app.admission import AdmissionController, AdmissionRejected
 from app.vector_manager import VectorManager
 from app.file_monitor import FileMonitor
 from typing import Annotated
+from app.utils.metrics import LatencyTracker
 from pydantic import BaseModel
 import logging
 import asyncio
+import functools
+import time
 import traceback
 import threading
+from concurrent.futures import ThreadPoolExecutor
 
 
 class QuestionRequest(BaseModel):
@@ -28,21 +36,40 @@ api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
 # INITIALIZE THE WEB SERVICE
 app = FastAPI(title="Knowledge Service")
 
-# INITIALIZE KEY COMPONENTS
-prompt_builder = PrompBuilder()
-processor = KnowledgeProcessor(config)
-vecManager = VectorManager(config, processor)
-monitor = None
-shutdown_event = threading.Event()
-
 # INITIALIZE Ollama CLIENT
 ollama = OllamaClient(
     base_url=config.ollama_base_url,
     model=config.LLM_MODEL,
     timeout=config.ollama_timeout,
     max_tokens=config.max_tokens,
-    temperature=config.temperature
+    temperature=config.temperature,
+    pool_limit=config.ollama_pool_limit,
+    keepalive_timeout=config.ollama_keepalive,
+    num_ctx=config.ollama_num_ctx,
+    keep_alive=config.ollama_model_keep_alive,
+    metrics_window=config.METRICS_WINDOW
+)
+
+# INITIALIZE KEY COMPONENTS
+prompt_builder = PrompBuilder()
+processor = KnowledgeProcessor(config)
+processor.update_llm(OllamaClientLLM(client=ollama))
+vecManager = VectorManager(config, processor, embeddings=OllamaClientEmbeddings(ollama, model=config.LLM_MODEL))
+preprocessor = QueryPreprocessor(config, ollama, prompt_builder)
+ttft_latency = LatencyTracker(window=config.METRICS_WINDOW)
+answer_cache = AnswerCache(config, embed_fn=vecManager.embeddings.aembed_query) if config.ANSWER_CACHE_ENABLED else None
+if answer_cache is not None:
+    processor.add_store_listener(answer_cache.invalidate)  # NEVER SERVE ANSWERS FROM A REPLACED STORE
+admission = AdmissionController(config)
+monitor = None
+shutdown_requested = threading.Event()
+
+# DEDICATED EXECUTOR FOR CPU-BOUND OR BLOCKING WORK ON THE REQUEST PATH
+retrieval_executor = ThreadPoolExecutor(
+    max_workers=config.RETRIEVAL_THREADS,
+    thread_name_prefix="retrieval"
 )
+
 logger = logging.getLogger(__name__)
 
 async def validate_api_key(api_key: str = Depends(api_key_header)):
@@ -53,23 +80,60 @@ async def validate_api_key(api_key: str = Depends(api_key_header)):
         raise HTTPException(status_code=403, detail="Authentication fails")
     return api_key
 
+async def admit(priority: int):
+    """WAIT FOR AN OLLAMA SLOT, OR FAIL FAST WITH 429 AND Retry-After WHEN OVERLOADED"""
+    try:
+        return await admission.admit(priority)
+    except AdmissionRejected as e:
+        logger.warning(f"request rejected: {str(e)}, retry after {e.retry_after}s")
+        raise HTTPException(status_code=429, detail=f"Service is busy ({str(e)})",
+                            headers={"Retry-After": str(e.retry_after)})
+
+async def run_blocking(func, *args, **kwargs):
+    """RUN BLOCKING CODE ON THE RETRIEVAL EXECUTOR WITHOUT STALLING THE EVENT LOOP"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(retrieval_executor, functools.partial(func, *args, **kwargs))
+
+def event_stream(events, background=None) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={
+            "Connection": "keep-alive",
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # DO NOT USE Nginx BUFFER
+        },
+        background=background
+    )
+
+async def replay(events):
+    """STREAM READY-MADE EVENTS, FOR ANSWERS THAT NEED NO OLLAMA CALL"""
+    for event in events:
+        yield event
+
 @app.on_event("startup")
 async def startup_event():
     """STARTUP INITIALIZATION"""
     global monitor
     logger.info("========== Application Startup ==========")
+    await ollama.start()
+    await ollama.health_check()
+    await run_blocking(vecManager.start)
+    if config.ollama_warm_up:
+        await ollama.warm_up(system=prompt_builder.system_prompt_stream())
+    # EMBEDDING CALLS ARE BRIDGED ONTO THIS LOOP, SO BUILDS MUST RUN OFF THE LOOP THREAD
     if not vecManager.vector_store_exists():
         logger.info("vector store does not exists and creating...")
-        vecManager.process_knowledge_base()
+        await run_blocking(vecManager.process_knowledge_base)
     else:
         logger.info("vector store exists, loading...")
-        vecManager.load_vector_store()
-    ollama.health_check()
+        await run_blocking(vecManager.load_vector_store)
+    await run_blocking(processor.reranker.load)  # KEEP CROSS ENCODER RESIDENT FOR ALL REQUESTS
 
-    # FILE MONITORING CALLBACK FUNCTION
-    def update_callback():
-        logger.info("Triggering vector store update...")
-        if not vecManager.incremental_update():
+    # FILE MONITORING CALLBACK FUNCTION, RUNS ON THE MONITOR'S INDEXING WORKER
+    def update_callback(paths):
+        logger.info(f"Triggering vector store update for {len(paths)} paths...")
+        if not vecManager.incremental_update(paths):
             logger.info("Falling back to full rebuild")
             vecManager.process_knowledge_base()
     
@@ -77,7 +141,9 @@ async def startup_event():
     monitor = FileMonitor(
         path=config.KNOWLEDGE_DIR,
         callback=update_callback,
-        cooldown=60  # 60 SECONDS TO AVOID FREQUENT CHANGES
+        debounce=config.MONITOR_DEBOUNCE,
+        max_delay=config.MONITOR_MAX_DELAY,
+        stop_timeout=config.MONITOR_STOP_TIMEOUT
     )
     monitor.start()
 
@@ -88,12 +154,23 @@ async def ask_question(
         ):
     question = request.question
     logger.info(f"received question: [{question}]")
+    # A CACHED ANSWER NEVER REACHES OLLAMA, SO IT DOES NOT WAIT FOR (OR COUNT AGAINST) A SLOT
+    probe = None
+    if answer_cache is not None:
+        hit, probe = await answer_cache.lookup(question)
+        if hit is not None:
+            return {"answer": "".join(hit.chunks)}
+    ticket = await admit(AdmissionController.BATCH)
     try:
-        response = processor.retrieveQA(question)
+        response = await run_blocking(processor.retrieveQA, question)
+        if probe is not None and response:  # FAILURES RAISE, ONLY REAL ANSWERS REACH THE CACHE
+            answer_cache.store(probe, question, [response])
         return {"answer": response}
     except Exception as e:
         logger.error(f"request fails: {str(e)}")
-        return {"answer", f"Service is not available ({str(e)}), Please try again later"}
+        return {"answer": f"Service is not available ({str(e)}), Please try again later"}
+    finally:
+        ticket.release()
 
 
 @app.post("/api/ask_stream")
@@ -102,63 +179,119 @@ async def ask_question_stream(
     api_key: Annotated[str, Depends(validate_api_key)]
     ):
     """STREAM RESPONSE POINT"""
+    request_start = time.perf_counter()
+    question = request.question
+    logger.info(f"received question: [{question}]")
+
+    # ANSWER WHAT NEEDS NO OLLAMA CALL BEFORE ADMISSION, SO IT NEVER WAITS FOR OR HOLDS A SLOT
+    # CHECK IF QUESTION IS EMPTY
+    if not question.strip():
+        return event_stream(replay(["error: [ERROR: Question cannot be empty]\n\n"]))
+
+    # REPLAY A CACHED ANSWER IN THE SAME FRAMING
+    probe = None
+    if answer_cache is not None:
+        hit, probe = await answer_cache.lookup(question)
+        if hit is not None:
+            ttft_latency.record(time.perf_counter() - request_start)
+            return event_stream(replay([f"info: [cached answer ({hit.score:.2f})]\n\n"]
+                                       + [f"data: {chunk}\n\n" for chunk in hit.chunks]
+                                       + ["info: [DONE]\n\n"]))
+
+    # OBVIOUS SMALL TALK IS RECOGNISED LOCALLY
+    preprocessed = preprocessor.local_result(question)
+    if preprocessed is not None and not preprocessed.is_question:
+        ttft_latency.record(time.perf_counter() - request_start)
+        return event_stream(replay([f"info: [Analyzing queires \"{question}\"]\n\n",
+                                    "data: Hello! How can I help you today?"]))
+
+    # ADMIT BEFORE THE RESPONSE STARTS, A 429 CANNOT BE SENT ONCE THE STREAM IS OPEN
+    ticket = await admit(AdmissionController.INTERACTIVE)
+
     async def generate_stream():
+        nonlocal preprocessed
         try:
-            # EXTRACT QUESTION
-            question = request.question
-            logger.info(f"received question: [{question}]")
-            
-            # CHECK IF QUESTION IS EMPTY
-            if not question.strip():
-                yield "error: [ERROR: Question cannot be empty]\n\n"
-                return
+            first_token = True
+            speculative = None
+            streamed = []
 
-            # CHECK IF QUESTION IS A QUERY
+            # CLASSIFY AND RESTRUCTURE THE QUERY IN ONE STAGE
             yield f"info: [Analyzing queires \"{question}\"]\n\n"
-            response = ollama.generate(
-            prompt=prompt_builder.build_prompt_retrieval(question),
-            max_tokens=config.max_tokens,
-            temperature=config.temperature
-            )
-            if response.strip().lower() != "yes":
+            if preprocessed is None:
+                if config.SPECULATIVE_RETRIEVAL:
+                    # HIDE FIRST-STAGE RETRIEVAL BEHIND THE PREPROCESSING CALL
+                    speculative = asyncio.ensure_future(run_blocking(processor.retrieve_candidates, question))
+                preprocessed = await preprocessor.process(question)
+            if not preprocessed.is_question:
+                ttft_latency.record(time.perf_counter() - request_start)
                 yield f"data: Hello! How can I help you today?"
                 return
-            
-            # RESTRUCTE THE QUERY
-            refined_query = ollama.generate(
-            prompt=prompt_builder.build_prompt_stepback(question),
-            max_tokens=config.max_tokens,
-            temperature=config.temperature
-            )
+
+            refined_query = preprocessed.refined_query
             yield f"info: refined queries are [{refined_query}]\n\n"
             logger.info(f"refined query: [{refined_query}]")
 
             # RETRIEVE CONTEXT (NOT STREAMING)
             yield f"info: [searching context...]\n\n"
-            context = processor.retrieve_context_rerank(question=refined_query) # FURTHER FILTERING - RERANK
-            prompt = prompt_builder.build_prompt_stream(refined_query, context)
+            if speculative is not None:
+                candidates = await speculative
+                if refined_query.strip() != question.strip():
+                    refined_candidates = await run_blocking(processor.retrieve_candidates, refined_query)
+                    candidates = processor.merge_candidates(refined_candidates, candidates)
+                context = await run_blocking(processor.rerank_context, refined_query, candidates) # FURTHER FILTERING - RERANK
+            else:
+                context = await run_blocking(processor.retrieve_context_rerank, question=refined_query) # FURTHER FILTERING - RERANK
+            prompt = prompt_builder.build_user_prompt_stream(refined_query, context)
             # GENERATE STREAM RESPONSE
             yield f"info: [generating response...]\n\n"
-            async for chunk in ollama.generate_stream(prompt):
+            async for chunk in ollama.generate_stream(prompt, system=prompt_builder.system_prompt_stream()):
+                if first_token:
+                    first_token = False
+                    ttft = time.perf_counter() - request_start
+                    ttft_latency.record(ttft)
+                    logger.info(f"time to first token {ttft * 1000:.1f}ms "
+                                f"(preprocess {preprocessed.elapsed * 1000:.1f}ms via {preprocessed.source})")
+                streamed.append(chunk)
                 yield f"data: {chunk}\n\n"
                 await asyncio.sleep(0.01)  # CONTROL STREAM PACE
             
             # END OF STREAM
+            if probe is not None:
+                answer_cache.store(probe, question, streamed)
             yield "info: [DONE]\n\n"
         except Exception as e:
             logger.error("stream call error", exc_info=True)
             yield f"error: [ERROR: {str(e)}]\n\n"
+        finally:
+            # DROP SPECULATIVE WORK THAT IS NO LONGER NEEDED (SMALL TALK, ERRORS, CLIENT GONE)
+            if speculative is not None and not speculative.done():
+                speculative.cancel()
+            ticket.release()
 
     
-    return StreamingResponse(
-        generate_stream(),
-        media_type="text/event-stream",
-        headers={
-            "Connection": "keep-alive",
-            "Cache-Control": "no-cache",
-            "X-Accel-Buffering": "no"  # DO NOT USE Nginx BUFFER
-        }
-    )
+    return event_stream(generate_stream(), background=BackgroundTask(ticket.release))  # IN CASE THE STREAM NEVER STARTS
+
+
+@app.get("/api/metrics")
+async def get_metrics(api_key: Annotated[str, Depends(validate_api_key)]):
+    """LATENCY METRICS OF THE SERVING PIPELINE"""
+    return {
+        "rerank": processor.reranker.stats(),
+        "rerank_policy": processor.policy.stats(),
+        "context": processor.assembler.stats(),
+        "preprocess": preprocessor.stats(),
+        "time_to_first_token": ttft_latency.snapshot(),
+        "answer_cache": answer_cache.stats() if answer_cache is not None else None,
+        "llm": ollama.stats(),
+        "admission": admission.stats(),
+        "embedding_cache": vecManager.embeddings.stats() if hasattr(vecManager.embeddings, "stats") else None,
+    }
+
+
+@app.get("/api/stats")
+async def get_stats(api_key: Annotated[str, Depends(validate_api_key)]):
+    """VECTOR STORE STATISTICS: SIZE, DIMENSION, INDEX TYPE, DISK USAGE AND CHUNKS PER SOURCE"""
+    return vecManager.stats()
 
 
 @app.on_event("shutdown")
@@ -167,10 +300,18 @@ async def shutdown_event():
     global monitor
     logger.info("========== Application Shutdown ==========")
     if monitor:
-        monitor.stop()
+        # OFF THE LOOP: THE WORKER STILL INDEXES PENDING CHANGES, AND ITS EMBEDDING CALLS RUN ON THIS LOOP
+        await asyncio.to_thread(monitor.stop)
         monitor = None
-    shutdown_event.set()
+    processor.reranker.close()
+    retrieval_executor.shutdown(wait=False, cancel_futures=True)
+    await ollama.close()
+    shutdown_requested.set()
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # SERVE THROUGH app/__main__.py INSTEAD: SPAWNED PARSER PROCESSES RE-IMPORT __main__, WHICH MUST
+    # NOT BE THIS MODULE, OR EVERY PARSER WOULD REBUILD THE WHOLE SERVICE
+    import sys
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get("PYTHONPATH")])))
+    os.execve(sys.executable, [sys.executable, "-m", "app"] + sys.argv[1:], env)
@@ -1,93 +1,291 @@
-import requests
 import logging
 import aiohttp
+import asyncio
 import json
+from typing import Any, List, Optional, Union
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.llms import LLM
+from app.utils.metrics import LatencyTracker
+
+
+class OllamaError(ConnectionError):
+    """A GENERATION CALL FAILED; RAISED SO AN ERROR IS NEVER MISTAKEN FOR (AND CACHED AS) AN ANSWER"""
+
+
+class GenerationTimings:
+    """PREFILL VS. DECODE TIME OF OLLAMA CALLS, FROM THE DURATIONS IN EACH FINAL RESPONSE
+
+    prompt_eval_count ONLY COUNTS PROMPT TOKENS THAT WERE ACTUALLY EVALUATED, SO A SMALL
+    AVERAGE NEXT TO A LONG SYSTEM PROMPT MEANS THE CACHED PREFIX IS BEING REUSED.
+    """
+
+    def __init__(self, window: int = 1000):
+        self.load = LatencyTracker(window=window)
+        self.prefill = LatencyTracker(window=window)
+        self.decode = LatencyTracker(window=window)
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.decode_tokens = 0
+        self.decode_seconds = 0.0
+
+    def record(self, data: dict) -> str:
+        """FOLD ONE FINAL RESPONSE IN, RETURNS A SUMMARY FOR THE LOG"""
+        load = data.get("load_duration", 0) / 1e9
+        prefill = data.get("prompt_eval_duration", 0) / 1e9
+        decode = data.get("eval_duration", 0) / 1e9
+        prompt_tokens = data.get("prompt_eval_count", 0)
+        decode_tokens = data.get("eval_count", 0)
+        self.load.record(load)
+        self.prefill.record(prefill)
+        self.decode.record(decode)
+        self.calls += 1
+        self.prompt_tokens += prompt_tokens
+        self.decode_tokens += decode_tokens
+        self.decode_seconds += decode
+        return (f"load {load * 1000:.1f}ms, prefill {prompt_tokens} tokens in {prefill * 1000:.1f}ms, "
+                f"decode {decode_tokens} tokens in {decode * 1000:.1f}ms")
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "load": self.load.snapshot(),
+            "prefill": self.prefill.snapshot(),
+            "decode": self.decode.snapshot(),
+            "avg_prompt_tokens": round(self.prompt_tokens / self.calls, 1) if self.calls else 0.0,
+            "decode_tokens_per_s": round(self.decode_tokens / self.decode_seconds, 1) if self.decode_seconds else 0.0,
+        }
+
 
 class OllamaClient:
-    def __init__(self, base_url: str, model: str, timeout: int = 360, max_tokens: int = 512, temperature: float = 0.1):
+    def __init__(self, base_url: str, model: str, timeout: int = 360, max_tokens: int = 512, temperature: float = 0.1,
+                 pool_limit: int = 32, keepalive_timeout: float = 300, num_ctx: Optional[int] = None,
+                 keep_alive: Optional[Union[str, int]] = None, metrics_window: int = 1000):
         self.base_url = base_url
         self.model = model
         self.timeout = timeout
         self.max_tokens = max_tokens
         self.temperature = temperature
-        # INITIALIZE HTTP SESSION
-        self.session = requests.Session()
+        self.num_ctx = num_ctx  # CONTEXT WINDOW THE PROMPT WAS PACKED FOR, None KEEPS THE MODEL DEFAULT
+        self.pool_limit = pool_limit
+        self.keepalive_timeout = keepalive_timeout
+        self.keep_alive = keep_alive  # HOW LONG OLLAMA KEEPS THE MODEL LOADED AFTER A CALL, None KEEPS THE SERVER DEFAULT
+        self.timings = GenerationTimings(window=metrics_window)
+        # LONG-LIVED HTTP SESSION, CREATED IN start() ON THE SERVING EVENT LOOP
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
         self.logger = logging.getLogger(__name__)
-        
-    def health_check(self):
+
+    async def start(self):
+        """OPEN THE POOLED KEEP-ALIVE SESSION SHARED BY ALL OLLAMA CALLS"""
+        if self.session is not None and not self.session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_limit,
+            limit_per_host=self.pool_limit,
+            keepalive_timeout=self.keepalive_timeout
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout, sock_connect=10)  # CONNECTION TIMEOUT
+        )
+        self.loop = asyncio.get_running_loop()
+        self.logger.info(f"Ollama session opened (pool={self.pool_limit}, keepalive={self.keepalive_timeout}s)")
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+            self.logger.info("Ollama session closed")
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            await self.start()
+        return self.session
+
+    def run_sync(self, coro):
+        """RUN A CLIENT COROUTINE FROM A WORKER THREAD ON THE SERVING EVENT LOOP"""
+        if self.loop is None or self.loop.is_closed():
+            coro.close()
+            raise RuntimeError("Ollama client is not started")
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            coro.close()
+            raise RuntimeError("blocking Ollama call issued from the event loop thread")
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def health_check(self):
         """CHECK OLLAMA SERVICE HEALTH"""
         try:
-            resp = self.session.get(
+            session = await self._get_session()
+            async with session.get(
                 f"{self.base_url}/api/tags",
-                timeout=5
-            )
-            if not resp.ok:
-                raise ConnectionError(f"Ollama service exception：{resp.text}")
+                timeout=aiohttp.ClientTimeout(total=5)
+            ) as resp:
+                if resp.status >= 400:
+                    raise ConnectionError(f"Ollama service exception：{await resp.text()}")
         except Exception as e:
             self.logger.error(f"Ollama connection fails：{str(e)}")
             raise
 
-    def generate(self, prompt: str, **kwargs):
-        """GENERATE A RESPONSE FROM OLLAMA"""
+    def _payload(self, prompt: str, stream: bool, system: Optional[str] = None, **kwargs) -> dict:
+        options = {
+            "temperature": kwargs.get("temperature", self.temperature),
+            "num_predict": kwargs.get("max_tokens", self.max_tokens),
+        }
+        if self.num_ctx:
+            # EVERY CALL MUST ASK FOR THE SAME WINDOW, A DIFFERENT num_ctx MAKES OLLAMA RELOAD THE MODEL
+            options["num_ctx"] = self.num_ctx
         payload = {
             "model": self.model,
             "prompt": prompt,
-            "stream": False, # STREAM RESPONSE
-            "temperature": kwargs.get("temperature", self.temperature),  
-            "max_tokens": kwargs.get("max_tokens", self.max_tokens),    
+            "stream": stream,
+            "options": options
         }
-        
+        if system:
+            payload["system"] = system  # RENDERED FIRST BY THE MODEL TEMPLATE, THE SHARED CACHEABLE PREFIX
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        if kwargs.get("format"):
+            payload["format"] = kwargs["format"]  # e.g. "json" FOR STRUCTURED OUTPUT
+        return payload
+
+    async def warm_up(self, system: Optional[str] = None):
+        """LOAD THE MODEL BEFORE THE FIRST REQUEST; WITH system, ALSO PREFILL IT INTO THE KV CACHE"""
+        payload = self._payload("." if system else "", stream=False, system=system, max_tokens=1)
+        try:
+            session = await self._get_session()
+            async with session.post(f"{self.base_url}/api/generate", json=payload) as resp:
+                if resp.status >= 400:
+                    raise ConnectionError(f"Ollama warm-up error {resp.status}：{await resp.text()}")
+                data = await resp.json()
+            self.logger.info(f"model {self.model} warmed up "
+                             f"(load {data.get('load_duration', 0) / 1e6:.1f}ms, "
+                             f"prefill {data.get('prompt_eval_count', 0)} tokens in {data.get('prompt_eval_duration', 0) / 1e6:.1f}ms)")
+        except Exception as e:
+            # NOT FATAL, THE FIRST REQUEST PAYS FOR THE LOAD INSTEAD
+            self.logger.warning(f"model warm-up fails：{str(e)}")
+
+    async def generate(self, prompt: str, system: Optional[str] = None, **kwargs):
+        """GENERATE A RESPONSE FROM OLLAMA, RAISES OllamaError ON ANY FAILURE"""
+        payload = self._payload(prompt, stream=False, system=system, **kwargs)
+
         try:
             self.logger.info(f"current timeout：{self.timeout} second")
-            resp = self.session.post(
+            session = await self._get_session()
+            async with session.post(
                 f"{self.base_url}/api/generate",
-                json=payload,
-                timeout=(10, self.timeout) # CONNECTION TIMEOUT
-                #stream=True # ACTIVATE STREAM RECIPIENCE
-            )
-            resp.raise_for_status()
-            return resp.json().get("response", "cannot find validate response")  # PREVENT KEY ERROR
-        except requests.exceptions.HTTPError as e:
-            # RESPONSE IS AVAILABLE, BUT STATUS HAS EXCEPTION
-            if e.response is not None:
-                logging.error(f"HTTP error | state code：{e.response.status_code} | response content：{e.response.text}")
-                return f"service response error：{e.response.text}"
-            else:
-                logging.error("HTTP error, but did not get response object")
-                return "unknown HTTP error"
-        except requests.exceptions.RequestException as e:
+                json=payload
+            ) as resp:
+                if resp.status >= 400:
+                    # RESPONSE IS AVAILABLE, BUT STATUS HAS EXCEPTION
+                    text = await resp.text()
+                    logging.error(f"HTTP error | state code：{resp.status} | response content：{text}")
+                    raise OllamaError(f"service response error：{text}")
+                data = await resp.json()
+                if "response" not in data:
+                    raise OllamaError(f"cannot find validate response：{data.get('error', data)}")
+                self.logger.info(f"generate timings: {self.timings.record(data)}")
+                return data["response"]
+        except OllamaError:
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             # NETWORK ERROR (e.g., TIMEOUT, CONNECTION REJECTION）
             logging.error(f"network error | cause：{str(e)}")
-            return "network connection fails.，please check service IP and port"
+            raise OllamaError("network connection fails.，please check service IP and port") from e
         except Exception as e:
             # UNKNOWN ERROR (e.g., JSON PARSE FAILURE）
             logging.error(f"unknown error | details：{str(e)}")
-            return "exception when processing response"
+            raise OllamaError("exception when processing response") from e
 
-    async def generate_stream(self, prompt: str):
+    async def generate_stream(self, prompt: str, system: Optional[str] = None):
         """流式生成响应"""
-        async with aiohttp.ClientSession() as session:
-            payload = {
-                "model": self.model,
-                "prompt": prompt,
-                "stream": True,  # ACTIVATE STREAM
-                "options": {"temperature": self.temperature, "max_tokens": self.max_tokens}
-            }
-            
-            async with session.post(
-                f"{self.base_url}/api/generate",
-                json=payload,
-                timeout=self.timeout
-            ) as response:
-                async for line in response.content:
-                    if line:
-                        chunk = line.decode('utf-8').strip()
-                        if chunk:
-                            try:
-                                # EXTRACT CONTENT
-                                data = json.loads(chunk)
-                                yield data.get("response", "")
-                            except json.JSONDecodeError:
-                                yield ""
-
-    
\ No newline at end of file
+        payload = self._payload(prompt, stream=True, system=system)
+
+        session = await self._get_session()
+        async with session.post(
+            f"{self.base_url}/api/generate",
+            json=payload
+        ) as response:
+            if response.status >= 400:
+                raise OllamaError(f"service response error：{await response.text()}")
+            async for line in response.content:
+                if line:
+                    chunk = line.decode('utf-8').strip()
+                    if chunk:
+                        try:
+                            # EXTRACT CONTENT
+                            data = json.loads(chunk)
+                            if "error" in data:
+                                raise OllamaError(f"service response error：{data['error']}")
+                            if data.get("done"):
+                                self.logger.info(f"stream timings: {self.timings.record(data)}")
+                            yield data.get("response", "")
+                        except json.JSONDecodeError:
+                            yield ""
+
+    def stats(self) -> dict:
+        return {
+            "model": self.model,
+            "keep_alive": self.keep_alive,
+            "num_ctx": self.num_ctx,
+            "timings": self.timings.stats(),
+        }
+
+    async def embed(self, texts: List[str], model: Optional[str] = None) -> List[List[float]]:
+        """EMBED A BATCH OF TEXTS WITH /api/embed"""
+        payload = {
+            "model": model or self.model,
+            "input": texts
+        }
+        session = await self._get_session()
+        async with session.post(
+            f"{self.base_url}/api/embed",
+            json=payload
+        ) as resp:
+            if resp.status >= 400:
+                raise ConnectionError(f"Ollama embed error {resp.status}：{await resp.text()}")
+            data = await resp.json()
+            return data["embeddings"]
+
+
+class OllamaClientEmbeddings(Embeddings):
+    """LANGCHAIN EMBEDDINGS BACKED BY THE POOLED OllamaClient SESSION"""
+
+    def __init__(self, client: OllamaClient, model: Optional[str] = None):
+        self.client = client
+        self.model = model or client.model
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self.client.run_sync(self.client.embed(texts, model=self.model))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return await self.client.embed(texts, model=self.model)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+class OllamaClientLLM(LLM):
+    """LANGCHAIN LLM BACKED BY THE POOLED OllamaClient SESSION (USED BY THE QA CHAIN)"""
+
+    client: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "ollama-client"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> str:
+        return self.client.run_sync(self.client.generate(prompt))
+
+    async def _acall(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> str:
+        return await self.client.generate(prompt)
@@ -10,8 +10,10 @@ class PrompBuilder():
         answer：
         """
 
-    def build_prompt_stream(self, question: str, context: str) -> str:
-        return f"""
+    # STATIC INSTRUCTIONS GO IN THE SYSTEM PROMPT AND THE PER-REQUEST PARTS LAST, SO EVERY CALL
+    # SHARES THE SAME TOKEN PREFIX AND OLLAMA CAN REUSE ITS KV CACHE INSTEAD OF RE-PREFILLING IT
+    def system_prompt_stream(self) -> str:
+        return """
         You are a senior IT troubleshooting expert.
 
         Your goal is to answer the QUESTION. You MAY use the CONTEXT **only if it is clearly relevant**. If the context is off-topic, low-relevance, contradictory, or only loosely related, **ignore it and answer from your own knowledge**.
@@ -25,7 +27,10 @@ class PrompBuilder():
         2) If helpful, use only the necessary parts; if not, ignore it.
         3) Provide a clear, step-by-step answer that is concise and actionable.
         4) Do not mention this evaluation process or the word “context” unless needed for clarity.
+        """
 
+    def build_user_prompt_stream(self, question: str, context: str) -> str:
+        return f"""
         CONTEXT:
         {context}
 
@@ -35,6 +40,10 @@ class PrompBuilder():
         Answer in a clear, step-by-step manner:
         """
 
+    def build_prompt_stream(self, question: str, context: str) -> str:
+        """SINGLE-STRING FORM, FOR CALLERS WITHOUT A SYSTEM PROMPT"""
+        return self.system_prompt_stream() + self.build_user_prompt_stream(question, context)
+
     def build_prompt_retrieval(self, question_request: str) -> str:
         return f"""
         You are a classifier. Decide if the input is a real question.  
@@ -60,3 +69,25 @@ class PrompBuilder():
         Reply only the refined query.
         """
 
+    def system_prompt_preprocess(self) -> str:
+        return """
+        You are a query preprocessor for an IT troubleshooting knowledge base. Do two things with the input.
+
+        1) Decide if the input is a real question.
+        - A real question asks for information, help, clarification, or advice, with or without a question mark.
+        - Greetings, small talk and statements that do not seek an answer are not real questions.
+
+        2) If it is a real question, break it down into a simpler or more general form to improve retrieval.
+
+        Reply strictly with a JSON object and nothing else:
+        {"is_question": true or false, "refined_query": "the refined query, or an empty string"}
+        """
+
+    def build_user_prompt_preprocess(self, question_request: str) -> str:
+        return f"""
+        Input: {question_request}
+        """
+
+    def build_prompt_preprocess(self, question_request: str) -> str:
+        """SINGLE-STRING FORM, FOR CALLERS WITHOUT A SYSTEM PROMPT"""
+        return self.system_prompt_preprocess() + self.build_user_prompt_preprocess(question_request)
@@ -0,0 +1,116 @@
+import re
+import json
+import time
+from typing import NamedTuple, Optional
+from app.utils.metrics import LatencyTracker
+import logging
+
+if not logging.getLogger().hasHandlers():
+    from app.config import UbuntuConfig
+    UbuntuConfig.init_logging()
+logger = logging.getLogger(__name__)
+
+
+class PreprocessResult(NamedTuple):
+    is_question: bool
+    refined_query: str
+    source: str        # "heuristic", "llm" OR "fallback"
+    elapsed: float     # SECONDS SPENT IN THE STAGE
+
+
+class QueryPreprocessor:
+    """CLASSIFY AND REWRITE A QUERY IN ONE STAGE BEFORE RETRIEVAL"""
+
+    GREETINGS = {
+        "hi", "hello", "hey", "hiya", "yo", "greetings", "morning", "evening", "afternoon",
+        "good", "there", "thanks", "thank", "you", "thx", "bye", "goodbye", "ok", "okay",
+        "cheers", "how", "are", "is", "it", "going", "what's", "up", "sup", "all", "everyone",
+    }
+    QUESTION_WORDS = {
+        "how", "what", "why", "when", "where", "which", "who", "whom", "whose",
+        "can", "could", "should", "would", "will", "is", "are", "does", "do", "did",
+    }
+    HELP_TERMS = (
+        "error", "fail", "exception", "issue", "problem", "cannot", "can't", "unable",
+        "crash", "timeout", "timed out", "not working", "denied", "refused", "broken",
+    )
+
+    def __init__(self, config, ollama, prompt_builder):
+        self.config = config
+        self.ollama = ollama
+        self.prompt_builder = prompt_builder
+        self.mode = config.QUERY_CLASSIFIER
+        self.latency = LatencyTracker(window=config.METRICS_WINDOW)
+        self.counts = {"heuristic": 0, "llm": 0, "fallback": 0}
+
+    def classify_local(self, question: str) -> Optional[bool]:
+        """CHEAP VERDICT: False FOR OBVIOUS SMALL TALK, True FOR OBVIOUS QUESTIONS, None IF UNSURE"""
+        text = question.strip().lower()
+        words = re.findall(r"[\w'’\-\.:/]+", text)
+        if not words:
+            return False
+        plain = [w.strip(".") for w in words]
+        if len(plain) <= 4 and all(w in self.GREETINGS for w in plain):
+            return False
+        if len(plain) >= 3:
+            if text.endswith("?") or plain[0] in self.QUESTION_WORDS:
+                return True
+            if any(term in text for term in self.HELP_TERMS):
+                return True
+        return None
+
+    def _parse(self, raw: str):
+        data = json.loads(raw)
+        is_question = data.get("is_question")
+        if isinstance(is_question, str):
+            is_question = is_question.strip().lower() in ("yes", "true")
+        refined = str(data.get("refined_query") or "").strip()
+        return bool(is_question), refined
+
+    def local_result(self, question: str) -> Optional[PreprocessResult]:
+        """THE HEURISTIC RESULT WHEN IT NEEDS NO OLLAMA CALL, ELSE None"""
+        start = time.perf_counter()
+        verdict = self.classify_local(question) if self.mode == "heuristic" else None
+        if verdict is False or (verdict is True and not self.config.QUERY_REWRITE_OBVIOUS):
+            return self._record(PreprocessResult(verdict, question, "heuristic", time.perf_counter() - start))
+        return None
+
+    async def process(self, question: str) -> PreprocessResult:
+        result = self.local_result(question)
+        if result is not None:
+            return result
+        start = time.perf_counter()
+        verdict = self.classify_local(question) if self.mode == "heuristic" else None
+        # ONE STRUCTURED CALL DOES BOTH THE CLASSIFICATION AND THE STEP-BACK REWRITE
+        raw = None
+        try:
+            raw = await self.ollama.generate(
+                prompt=self.prompt_builder.build_user_prompt_preprocess(question),
+                system=self.prompt_builder.system_prompt_preprocess(),
+                format="json",
+                max_tokens=self.config.max_tokens,
+                temperature=self.config.temperature
+            )
+            is_question, refined = self._parse(raw)
+            source = "llm"
+        except (ConnectionError, ValueError, AttributeError) as e:
+            logger.warning(f"preprocess call failed or is not valid JSON ({str(e)}): [{raw}]")
+            is_question, refined, source = True, question, "fallback"
+        if verdict is True:
+            is_question = True
+        result = PreprocessResult(is_question, refined or question, source, time.perf_counter() - start)
+        return self._record(result)
+
+    def _record(self, result: PreprocessResult) -> PreprocessResult:
+        self.counts[result.source] += 1
+        self.latency.record(result.elapsed)
+        logger.info(f"preprocess [{result.source}] in {result.elapsed * 1000:.1f}ms: "
+                    f"is_question={result.is_question} refined=[{result.refined_query}]")
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "counts": dict(self.counts),
+            "latency": self.latency.snapshot(),
+        }
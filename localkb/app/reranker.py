@@ -0,0 +1,207 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Tuple
+import torch
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+from langchain.schema import Document
+from app.utils.metrics import LatencyTracker
+import logging
+
+if not logging.getLogger().hasHandlers():
+    from app.config import UbuntuConfig
+    UbuntuConfig.init_logging()
+logger = logging.getLogger(__name__)
+
+
+class RerankBatcher:
+    """COLLECT PAIRS FROM CONCURRENT CALLERS AND SCORE THEM AS ONE PADDED BATCH"""
+
+    def __init__(self, forward, executor, workers: int, window_ms: float, max_batch_size: int):
+        self.forward = forward
+        self.executor = executor
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.pending = queue.Queue()
+        # ONE PERMIT PER WORKER, WHILE ALL WORKERS ARE BUSY NEW PAIRS KEEP JOINING THE NEXT BATCH
+        self.free_workers = threading.BoundedSemaphore(workers)
+        self.batches = 0
+        self.batched_pairs = 0
+        self._stats_lock = threading.Lock()  # _run() COMPLETES ON SEVERAL EXECUTOR THREADS AT ONCE
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._schedule, name="rerank-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, pairs: List[Tuple[str, str]]) -> Future:
+        future = Future()
+        if self._stopped.is_set():
+            future.set_exception(RuntimeError("rerank batcher is stopped"))
+            return future
+        self.pending.put((pairs, future))
+        return future
+
+    def _collect(self, first):
+        batch = [first]
+        size = len(first[0])
+        deadline = time.monotonic() + self.window
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.pending.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self.pending.put(None)  # LET THE SCHEDULER LOOP SEE THE STOP MARKER
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    def _schedule(self):
+        while True:
+            first = self.pending.get()
+            if first is None:
+                break
+            batch = self._collect(first)
+            self.free_workers.acquire()
+            try:
+                self.executor.submit(self._run, batch)
+            except Exception as e:
+                self.free_workers.release()
+                for _, future in batch:
+                    future.set_exception(e)
+        # FAIL ANYTHING LEFT BEHIND AFTER STOP
+        while not self.pending.empty():
+            item = self.pending.get_nowait()
+            if item is not None:
+                item[1].set_exception(RuntimeError("rerank batcher is stopped"))
+
+    def _run(self, batch):
+        try:
+            pairs = [pair for item_pairs, _ in batch for pair in item_pairs]
+            scores = []
+            # A SINGLE OVERSIZED REQUEST IS STILL SPLIT TO KEEP THE PADDED TENSOR BOUNDED
+            for start in range(0, len(pairs), self.max_batch_size):
+                scores.extend(self.forward(pairs[start:start + self.max_batch_size]))
+            with self._stats_lock:
+                self.batches += 1
+                self.batched_pairs += len(pairs)
+            offset = 0
+            for item_pairs, future in batch:
+                future.set_result(scores[offset:offset + len(item_pairs)])
+                offset += len(item_pairs)
+        except Exception as e:
+            logger.error(f"rerank batch of {len(batch)} requests failed: {str(e)}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.free_workers.release()
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            batches, batched_pairs = self.batches, self.batched_pairs
+        return {
+            "batches": batches,
+            "avg_batch_size": round(batched_pairs / batches, 2) if batches else 0.0,
+            "queued_requests": self.pending.qsize(),
+        }
+
+    def stop(self):
+        self._stopped.set()
+        self.pending.put(None)
+        self._thread.join(timeout=5.0)
+
+
+class CrossEncoderReranker:
+    """RESIDENT CROSS-ENCODER, LOADED ONCE AND SERVED BY A BOUNDED WORKER POOL"""
+
+    def __init__(self, config):
+        self.config = config
+        self.model_name = config.CROSS_ENCODER_MODEL
+        self.max_length = config.RERANK_MAX_LENGTH
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")  # utilize GPU
+        self.tokenizer = None
+        self.model = None
+        self.executor = None
+        self.batcher = None
+        self.latency = LatencyTracker(window=config.RERANK_LATENCY_WINDOW)
+        self._load_lock = threading.Lock()
+
+    def load(self):
+        """LOAD TOKENIZER AND MODEL ONCE AND WARM THEM UP"""
+        with self._load_lock:
+            if self.model is not None:
+                return
+            start = time.perf_counter()
+            self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            model = AutoModelForSequenceClassification.from_pretrained(self.model_name)
+            model.to(self.device)
+            model.eval()
+            self.model = model
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.config.RERANK_THREADS,
+                thread_name_prefix="rerank"
+            )
+            if self.config.RERANK_BATCHING:
+                self.batcher = RerankBatcher(
+                    forward=self._forward,
+                    executor=self.executor,
+                    workers=self.config.RERANK_THREADS,
+                    window_ms=self.config.RERANK_BATCH_WINDOW_MS,
+                    max_batch_size=self.config.RERANK_MAX_BATCH_SIZE
+                )
+            # FIRST FORWARD PASS ALLOCATES THE KERNELS, KEEP IT OFF THE REQUEST PATH
+            self._forward([("warm up", "warm up")])
+            logger.info(f"cross encoder [{self.model_name}] loaded on {self.device} "
+                        f"in {time.perf_counter() - start:.2f}s with {self.config.RERANK_THREADS} workers")
+
+    def _forward(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        features = self.tokenizer(pairs, padding=True, truncation=True, return_tensors="pt", max_length=self.max_length)
+        features = {k: v.to(self.device) for k, v in features.items()}
+        with torch.inference_mode():
+            logits = self.model(**features).logits
+            scores = torch.sigmoid(logits).cpu().numpy().flatten()
+        return scores.tolist()
+
+    def score(self, question: str, passages: List[str]) -> List[float]:
+        """SCORE (question, passage) PAIRS ON THE WORKER POOL"""
+        if not passages:
+            return []
+        if self.model is None:
+            self.load()
+        start = time.perf_counter()
+        pairs = [(question, passage) for passage in passages]
+        if self.batcher is not None:
+            scores = self.batcher.submit(pairs).result()
+        else:
+            scores = self.executor.submit(self._forward, pairs).result()
+        self.latency.record(time.perf_counter() - start)
+        return scores
+
+    def rerank(self, question: str, docs: List[Document], top_n: int) -> List[Tuple[Document, float]]:
+        """RETURN THE top_n DOCUMENTS ORDERED BY CROSS-ENCODER SCORE"""
+        scores = self.score(question, [doc.page_content for doc in docs])
+        ranked = sorted(zip(docs, scores), key=lambda x: x[1], reverse=True)
+        return ranked[:top_n]
+
+    def stats(self) -> dict:
+        return {
+            "model": self.model_name,
+            "loaded": self.model is not None,
+            "device": str(self.device),
+            "workers": self.config.RERANK_THREADS,
+            "latency": self.latency.snapshot(),
+            "batching": self.batcher.stats() if self.batcher is not None else None,
+        }
+
+    def close(self):
+        if self.batcher is not None:
+            self.batcher.stop()
+            self.batcher = None
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
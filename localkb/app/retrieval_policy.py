@@ -0,0 +1,93 @@
+import threading
+from typing import List, NamedTuple, Optional
+from langchain.schema import Document
+import logging
+
+if not logging.getLogger().hasHandlers():
+    from app.config import UbuntuConfig
+    UbuntuConfig.init_logging()
+logger = logging.getLogger(__name__)
+
+DISTANCE_KEY = "vector_distance"  # SET ON CANDIDATES THAT CAME FROM FAISS
+
+
+class RerankPlan(NamedTuple):
+    action: str                 # early_exit | base | widened | all
+    size: int                   # CANDIDATES SENT TO THE CROSS ENCODER
+    margin: Optional[float]     # RELATIVE L2 GAP BETWEEN THE TWO BEST VECTOR HITS
+    estimated_ms: float         # PREDICTED CROSS-ENCODER TIME FOR size PAIRS
+
+
+class RetrievalPolicy:
+    """SIZE THE RERANK STAGE PER REQUEST
+
+    THE FIRST STAGE PULLS A WIDE, CHEAP CANDIDATE SET; THIS POLICY DECIDES HOW MUCH OF IT THE
+    CROSS ENCODER SEES:
+      early_exit - THE BEST VECTOR HIT IS DECISIVELY CLOSER THAN THE NEXT, SKIP RERANKING
+      widened    - THE BEST HITS ARE ALMOST TIED, RERANK AS MANY AS THE LATENCY BUDGET ALLOWS
+      base       - OTHERWISE RERANK RERANK_BASE_CANDIDATES, ALSO CAPPED BY THE BUDGET
+    THE PER-PAIR COST IS A MOVING AVERAGE OF OBSERVED RERANK CALLS, SO THE SET SHRINKS WHEN
+    THE CROSS ENCODER IS BUSY.
+    """
+
+    SMOOTHING = 0.2  # WEIGHT OF THE NEWEST OBSERVATION IN THE PER-PAIR COST AVERAGE
+
+    def __init__(self, config):
+        self.adaptive = config.RERANK_ADAPTIVE
+        self.budget_ms = config.RERANK_LATENCY_BUDGET_MS
+        self.min_candidates = config.RERANK_MIN_CANDIDATES
+        self.base_candidates = config.RERANK_BASE_CANDIDATES
+        self.max_candidates = config.RERANK_MAX_CANDIDATES
+        self.early_exit_margin = config.RERANK_EARLY_EXIT_MARGIN
+        self.widen_margin = config.RERANK_WIDEN_MARGIN
+        self.per_pair_ms = config.RERANK_PAIR_COST_MS  # INITIAL GUESS UNTIL CALLS ARE OBSERVED
+        self.decisions = {"early_exit": 0, "base": 0, "widened": 0, "all": 0}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def margin(docs: List[Document]) -> Optional[float]:
+        """RELATIVE GAP BETWEEN THE TWO CLOSEST VECTOR HITS, None WITHOUT TWO OF THEM
+
+        ONLY MEANINGFUL WHEN THE CLOSEST VECTOR HIT IS ALSO THE FIRST FUSED CANDIDATE.
+        """
+        distances = [doc.metadata[DISTANCE_KEY] for doc in docs if DISTANCE_KEY in doc.metadata]
+        if len(distances) < 2 or docs[0].metadata.get(DISTANCE_KEY) != min(distances):
+            return None
+        best, second = sorted(distances)[:2]
+        return (second - best) / second if second > 0 else 0.0
+
+    def budget_size(self) -> int:
+        return max(self.min_candidates, int(self.budget_ms / max(self.per_pair_ms, 1e-3)))
+
+    def plan(self, docs: List[Document], top_n: int) -> RerankPlan:
+        margin = self.margin(docs)
+        if not self.adaptive:
+            action, size = "all", len(docs)
+        elif margin is not None and margin >= self.early_exit_margin:
+            action, size = "early_exit", 0
+        elif margin is not None and margin < self.widen_margin:
+            action, size = "widened", min(self.max_candidates, self.budget_size())
+        else:
+            action, size = "base", min(self.base_candidates, self.budget_size())
+        if action != "early_exit":
+            size = min(len(docs), max(size, top_n, self.min_candidates))
+        with self._lock:
+            self.decisions[action] += 1
+        return RerankPlan(action, size, margin, round(size * self.per_pair_ms, 2))
+
+    def observe(self, pairs: int, seconds: float):
+        """FOLD A MEASURED RERANK CALL INTO THE PER-PAIR COST"""
+        if pairs <= 0:
+            return
+        with self._lock:
+            self.per_pair_ms += self.SMOOTHING * (seconds * 1000.0 / pairs - self.per_pair_ms)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "adaptive": self.adaptive,
+                "budget_ms": self.budget_ms,
+                "per_pair_ms": round(self.per_pair_ms, 3),
+                "budget_candidates": self.budget_size(),
+                "decisions": dict(self.decisions),
+            }
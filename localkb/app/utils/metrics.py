@@ -0,0 +1,44 @@
+import math
+import threading
+from collections import deque
+
+
+def _nearest_rank(ordered: list, pct: float) -> float:
+    """NEAREST-RANK PERCENTILE OF A SORTED LIST"""
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class LatencyTracker:
+    """ROLLING WINDOW OF LATENCY SAMPLES WITH PERCENTILE SNAPSHOTS"""
+
+    def __init__(self, window: int = 1000):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.samples.append(seconds)
+            self.count += 1
+
+    def percentile(self, pct: float) -> float:
+        """RETURN THE pct-TH PERCENTILE (SECONDS) OF THE CURRENT WINDOW"""
+        with self._lock:
+            ordered = sorted(self.samples)
+        return _nearest_rank(ordered, pct)
+
+    def snapshot(self) -> dict:
+        """SUMMARY IN MILLISECONDS FOR LOGGING AND THE METRICS ENDPOINT"""
+        with self._lock:
+            ordered = sorted(self.samples)
+            count = self.count
+        return {
+            "count": count,
+            "p50_ms": round(_nearest_rank(ordered, 50) * 1000, 2),
+            "p95_ms": round(_nearest_rank(ordered, 95) * 1000, 2),
+            "p99_ms": round(_nearest_rank(ordered, 99) * 1000, 2),
+            "max_ms": round((ordered[-1] if ordered else 0.0) * 1000, 2),
+        }
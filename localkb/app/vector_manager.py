@@ -4,7 +4,9 @@ from pathlib import Path
 import torch
 import json
 import hashlib
-import shutil
+import uuid
+import itertools
+import threading
 import faiss
 from langchain_ollama import OllamaEmbeddings
 from langchain_ollama import OllamaLLM
@@ -13,12 +15,19 @@ from langchain_community.vectorstores import FAISS
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_community.document_loaders import UnstructuredWordDocumentLoader
 from langchain.document_loaders import (
-    DirectoryLoader,
     UnstructuredFileLoader,
     UnstructuredPDFLoader#,
     #UnstructuredWordDocumentLoader
 )
 from app.custom_json import JSONLoader
+from app.embedding_cache import CachedEmbeddings
+from app.change_detector import ChangeDetector
+from app.ingestion import IngestionPipeline
+from app.embedding_engine import EmbeddingEngine
+from app.index_factory import IndexFactory, StoreBuilder
+from app.chunk_store import ChunkFAISS
+from app.generations import GenerationStore
+from app.lexical_index import LexicalBuilder, LexicalIndex
 import logging
 
 if not logging.getLogger().hasHandlers():
@@ -27,15 +36,32 @@ if not logging.getLogger().hasHandlers():
 logger = logging.getLogger(__name__)  
 
 class VectorManager:
-    def __init__(self, config, processor):
+    # {"version": 2, "files": {rel_path: {"hash", "size", "mtime_ns", "inode", "ids": [...], "chunk_hashes": [...]}},
+    #  "index": {"type", "requested", "factory", "dim", "trained_on", "sized_for"}}
+    META_VERSION = 2
+    REBUILD_BATCH = 1000  # SURVIVING VECTORS READ BACK FROM THE INDEX PER BATCH ON A REBUILD
+
+    def __init__(self, config, processor, embeddings=None):
         self.config = config
         self.processor = processor
         self.knowledge_dir = Path(config.KNOWLEDGE_DIR)
         self.vector_dir = Path(config.VECTOR_DIR)
         self.vector_store: Optional[FAISS] = None
-        self.meta_file = os.path.join(self.vector_dir, self.config.VECTOR_STORE_META)
-        self.embeddings = OllamaEmbeddings(model=self.config.LLM_MODEL)
+        self.generation: Optional[str] = None  # NAME OF THE GENERATION BEING SERVED
+        self.index_factory = IndexFactory(config)
+        self.index_info: Optional[dict] = None
+        self.source_counts: Optional[dict] = None  # CHUNKS PER SOURCE FILE OF THE SERVED GENERATION
+        self.embeddings = embeddings or OllamaEmbeddings(model=self.config.LLM_MODEL)
+        if self.config.EMBEDDING_CACHE_ENABLED:
+            # UNCHANGED CHUNKS AND REPEATED QUERIES SKIP THE ROUND-TRIP TO OLLAMA
+            self.embeddings = CachedEmbeddings(
+                self.embeddings,
+                model_name=self.config.LLM_MODEL,
+                cache_dir=self.config.EMBEDDING_CACHE_DIR,
+                memory_entries=self.config.EMBEDDING_CACHE_MEMORY_ENTRIES
+            )
         self.processor.update_embeddings(self.embeddings)
+        self.embedding_engine = EmbeddingEngine.from_config(self.config, self.embeddings)
         self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=self.config.CHUNK_SIZE, chunk_overlap=self.config.CHUNK_OVERLAP)
         self.LOADER_MAPPING = {
             ".txt": (UnstructuredFileLoader, {"encoding": "utf-8"}),
@@ -43,224 +69,388 @@ class VectorManager:
             ".docx": (UnstructuredWordDocumentLoader, {"mode":"single"}),
             ".json": (JSONLoader, {})  # JSON LOADER
         }
+        self.change_detector = ChangeDetector(
+            self.knowledge_dir,
+            workers=self.config.CHANGE_DETECT_WORKERS,
+            block_size=self.config.HASH_BLOCK_SIZE
+        )
         os.makedirs(self.knowledge_dir, exist_ok=True)
         os.makedirs(self.vector_dir, exist_ok=True)
+        self.generations = GenerationStore(self.vector_dir, self.config.FAISS_FILE, self.config.VECTOR_STORE_META)
+
+    def start(self):
+        """STARTUP SIDE EFFECTS, KEPT OUT OF __init__ SO MERELY CONSTRUCTING A MANAGER (E.G. IN A SPAWNED
+        PARSER PROCESS RE-IMPORTING THE SERVICE MODULE) NEVER DELETES OR REWRITES THE SERVICE'S FILES"""
+        self.generations.collect()  # GENERATIONS LEFT BEHIND BY AN INTERRUPTED BUILD OR A PREVIOUS RUN
+        if isinstance(self.embeddings, CachedEmbeddings):
+            self.embeddings.open()
+
+    @property
+    def meta_file(self):
+        """METADATA OF THE CURRENT GENERATION, None BEFORE THE FIRST BUILD"""
+        current = self.generations.current_path()
+        return os.path.join(current, self.config.VECTOR_STORE_META) if current else None
         
     def _doc_hash(self, file_path):
         """CALCULATE DOCUMENT HASH"""
-        with open(file_path, "rb") as f:
-            return hashlib.md5(f.read()).hexdigest()
+        return self.change_detector.file_hash(file_path)
     
     def _load_metadata(self):
         """LOAD MEDA"""
-        if os.path.exists(self.meta_file):
+        if self.meta_file and os.path.exists(self.meta_file):
             with open(self.meta_file, 'r') as f:
                 return json.load(f)
         return {}
     
-    def _save_metadata(self, metadata):
-        """SAVE META"""
-        with open(self.meta_file, 'w') as f:
+    def _save_metadata(self, metadata, directory=None):
+        """SAVE META, INTO directory WHEN A NEW GENERATION IS STAGED THERE"""
+        meta_file = os.path.join(directory, self.config.VECTOR_STORE_META) if directory else self.meta_file
+        tmp_file = meta_file + ".tmp"
+        with open(tmp_file, 'w') as f:
             json.dump(metadata, f, indent=2)
-    
+        os.replace(tmp_file, meta_file)
+
+    def _file_registry(self, metadata):
+        """PER-FILE CHUNK-ID REGISTRY, None FOR THE LEGACY {path: hash} FORMAT"""
+        if metadata.get("version") != self.META_VERSION:
+            return None
+        return metadata.get("files", {})
+
+    def _registry_metadata(self, files, index_info=None):
+        return {"version": self.META_VERSION, "files": files, "index": index_info or self.index_info}
+
+    def _new_ids(self, count):
+        return [uuid.uuid4().hex for _ in range(count)]
+
+    def _load_file(self, rel_path):
+        """LOAD ONE KNOWLEDGE FILE WITH ITS MAPPED LOADER"""
+        file_path = os.path.join(self.knowledge_dir, rel_path)
+        ext = os.path.splitext(file_path)[1].lower()
+        if ext not in self.LOADER_MAPPING:
+            return []  # INGORE UNSUPPORTED FORMAT, SAME AS THE FULL BUILD
+        loader_class, loader_args = self.LOADER_MAPPING[ext]
+        return loader_class(file_path, **loader_args).load()
+
+    def _chunk_hash(self, doc):
+        return hashlib.blake2b(doc.page_content.encode("utf-8"), digest_size=16).hexdigest()
+
+    def _diff_chunks(self, entry, splits):
+        """MATCH NEW CHUNKS AGAINST A FILE'S PREVIOUS CHUNKS BY CONTENT HASH
+
+        RETURNS (ids, chunk_hashes, stale_ids, fresh_docs, fresh_ids): UNCHANGED CHUNKS KEEP
+        THEIR VECTOR IDS, ONLY fresh_docs NEED EMBEDDING AND stale_ids NEED REMOVAL.
+        """
+        old_ids = entry.get("ids", []) if entry else []
+        old_hashes = entry.get("chunk_hashes") if entry else None
+        pool = {}
+        # WITHOUT RECORDED CHUNK HASHES EVERY OLD CHUNK IS TREATED AS STALE
+        if old_hashes and len(old_hashes) == len(old_ids):
+            for chunk_hash, chunk_id in zip(old_hashes, old_ids):
+                pool.setdefault(chunk_hash, []).append(chunk_id)
+        ids, chunk_hashes, fresh_docs, fresh_ids = [], [], [], []
+        kept = set()
+        for doc in splits:
+            chunk_hash = self._chunk_hash(doc)
+            reusable = pool.get(chunk_hash)
+            if reusable:
+                chunk_id = reusable.pop(0)
+                kept.add(chunk_id)
+            else:
+                chunk_id = uuid.uuid4().hex
+                fresh_docs.append(doc)
+                fresh_ids.append(chunk_id)
+            ids.append(chunk_id)
+            chunk_hashes.append(chunk_hash)
+        stale_ids = [i for i in old_ids if i not in kept]
+        return ids, chunk_hashes, stale_ids, fresh_docs, fresh_ids
+
+    def _group_by_source(self, splits):
+        """GROUP SPLIT CHUNKS BY THEIR SOURCE FILE (RELATIVE PATH)"""
+        grouped = {}
+        for doc in splits:
+            rel_path = os.path.relpath(doc.metadata['source'], self.knowledge_dir)
+            grouped.setdefault(rel_path, []).append(doc)
+        return grouped
+
     def build_vector_store(self):
-        from langchain_community.document_loaders import DirectoryLoader
-        from langchain_text_splitters import RecursiveCharacterTextSplitter
-        
+        """FULL BUILD, KEPT FOR OLDER CALLERS"""
         logger.info("Building full vector store...")
-        loader = DirectoryLoader(self.knowledge_dir, show_progress=True)
-        docs = loader.load()
-        
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000, chunk_overlap=200
-        )
-        splits = text_splitter.split_documents(docs)
-        
-        vector_store = FAISS.from_documents(splits, self.embeddings, ids=[f"doc_{i}" for i in range(len(splits))])
-        vector_store.save_local(self.vector_dir)
-        
-        # GENERATE META
-        metadata = {}
-        for doc in docs:
-            rel_path = os.path.relpath(doc.metadata['source'], self.knowledge_dir)
-            metadata[rel_path] = self._doc_hash(doc.metadata['source'])
-        self._save_metadata(metadata)
-        
-        logger.info(f"Vector store built with {len(splits)} chunks")
-        return vector_store
+        return self.process_knowledge_base()
     
-    def incremental_update(self):
-        """INCREMENTAL UPDATES TO VECTOR STORE"""
+    def incremental_update(self, paths=None):
+        """INCREMENTAL UPDATES TO VECTOR STORE, LIMITED TO paths WHEN THE MONITOR PROVIDES THEM"""
         current_meta = self._load_metadata()
-        new_meta = {}
-        changes = {"added": [], "updated": [], "deleted": []}
-        
-        # DETECT CHANGE
-        for root, _, files in os.walk(self.knowledge_dir):
-            for file in files:
-                file_path = os.path.join(root, file)
-                rel_path = os.path.relpath(file_path, self.knowledge_dir)
-                
-                current_hash = current_meta.get(rel_path)
-                new_hash = self._doc_hash(file_path)
-                new_meta[rel_path] = new_hash
-                
-                if current_hash is None:
-                    changes["added"].append(rel_path)
-                elif current_hash != new_hash:
-                    changes["updated"].append(rel_path)
-        
-        # DETECT DELETION
-        for rel_path in current_meta:
-            if rel_path not in new_meta:
-                changes["deleted"].append(rel_path)
+        registry = self._file_registry(current_meta)
+        if registry is None:
+            logger.info("metadata has no chunk registry, full rebuild required")
+            return False
+
+        # STAT FIRST, HASH ONLY FILES WHOSE (size, mtime_ns, inode) CHANGED
+        changes, fingerprints = self.change_detector.detect(registry, paths=paths)
         
         if not any(changes.values()):
+            if fingerprints:
+                # TOUCHED BUT UNCHANGED FILES: REMEMBER THE NEW STAT SO THEY ARE NOT HASHED AGAIN
+                for rel_path, fingerprint in fingerprints.items():
+                    registry[rel_path].update(fingerprint)
+                self._save_metadata(self._registry_metadata(registry))
             logger.info("No changes detected")
             return True
         
         logger.info(f"Changes detected: {changes}")
-        return self._apply_changes(changes, current_meta)
+        return self._apply_changes(changes, registry, fingerprints)
     
-    def _apply_changes(self, changes, old_meta):
-        """APPLY CHANGES TO VECTOR STORE"""
-        temp_dir = os.path.join(self.config.DATA_DIR, "temp_update")
-        backup_dir = os.path.join(self.config.DATA_DIR, "backup")
+    def _apply_changes(self, changes, registry, fingerprints):
+        """APPLY CHANGES TO VECTOR STORE, TOUCHING ONLY THE CHUNKS OF CHANGED FILES"""
+        generation = None
         try:
-            # HANDLE DELETION
-            if changes["deleted"] or changes["updated"]:
-                # FAISS DOES NOT SUPPORT DELETION AND NEED REBUILD VECTOR STORE
-                logger.info("Deletes require full rebuild")
-                return False
-
-            # CREATE TEMP DIRECTORY
-            os.makedirs(temp_dir, exist_ok=True)
-            
-            # DUPLICATE EXISTING INDICE
-            for f in os.listdir(self.vector_dir):
-                src = os.path.join(self.vector_dir, f)
-                dst = os.path.join(temp_dir, f)
-                if os.path.isfile(src):
-                    shutil.copy(src, dst)
-            
-            # LOAD EXISTING VECTOR STORE
-            vector_store = FAISS.load_local(
-                self.vector_dir, 
-                self.embeddings, 
-                allow_dangerous_deserialization=True
-            )
-            
+            files = dict(registry)
+
+            # SPLIT ADDED OR UPDATED FILES AND DIFF THEIR CHUNKS AGAINST THE REGISTRY
             new_docs = []
-            for change_type, files in changes.items():
-                if change_type == "deleted" or change_type == "updated":
-                    continue
-                    
-                for rel_path in files:
-                    file_path = os.path.join(self.knowledge_dir, rel_path)
-                    ext = os.path.splitext(file_path)[1].lower()
-                    
-                    loader_class = self.LOADER_MAPPING.get(ext, UnstructuredFileLoader)
-                    loader = loader_class(file_path)
-                    docs = loader.load()
-                    new_docs.extend(docs)
-            
-            if new_docs:
-                splits = self.text_splitter.split_documents(new_docs)
-                vector_store.add_documents(splits)
-                logger.info(f"Added {len(splits)} new chunks")
-            
-            # SAVE TO TEMP DIRECTORY
-            vector_store.save_local(temp_dir)
-            
-            # EXCHANGE DIRECTORIES
-            shutil.rmtree(backup_dir, ignore_errors=True)
-            shutil.move(self.vector_dir, backup_dir)
-            shutil.move(temp_dir, self.vector_dir)
-            
-            # UPDATE META
-            new_meta = self._load_metadata()
             for rel_path in changes["added"] + changes["updated"]:
-                file_path = os.path.join(self.knowledge_dir, rel_path)
-                new_meta[rel_path] = self._doc_hash(file_path)
+                new_docs.extend(self._load_file(rel_path))
+            grouped = self._group_by_source(self.text_splitter.split_documents(new_docs)) if new_docs else {}
+            stale_ids, fresh_docs, fresh_ids = [], [], []
             for rel_path in changes["deleted"]:
-                new_meta.pop(rel_path, None)
-            self._save_metadata(new_meta)
-            
-            # CLEARN UP
-            shutil.rmtree(temp_dir, ignore_errors=True)
-            shutil.rmtree(backup_dir, ignore_errors=True)
-            
+                stale_ids.extend(files.pop(rel_path)["ids"])
+            for rel_path in changes["added"] + changes["updated"]:
+                ids, chunk_hashes, stale, fresh, fresh_chunk_ids = self._diff_chunks(files.get(rel_path), grouped.get(rel_path, []))
+                stale_ids.extend(stale)
+                fresh_docs.extend(fresh)
+                fresh_ids.extend(fresh_chunk_ids)
+                files[rel_path] = dict(fingerprints[rel_path], ids=ids, chunk_hashes=chunk_hashes)
+            for rel_path, fingerprint in fingerprints.items():
+                if rel_path in files and rel_path not in changes["added"] + changes["updated"]:
+                    files[rel_path] = dict(files[rel_path], **fingerprint)
+
+            # READERS KEEP SEARCHING THE SERVED GENERATION, CHANGES GO INTO A NEW ONE
+            if self.vector_store is None:
+                self.load_vector_store()
+            current = self.vector_store
+            positions = current.index_to_docstore_id
+            stale_ids = list(positions.positions(stale_ids))
+            index_info = self.index_info
+            ntotal = len(positions) - len(stale_ids) + len(fresh_docs)
+            compact = self.index_factory.needs_rebuild(index_info, ntotal) \
+                or self.index_factory.needs_compaction(positions.slots() + len(fresh_docs), ntotal)
+            generation = self.generations.create()
+            if compact:
+                vector_store, index_info = self._rebuild_index(current, stale_ids, fresh_docs, fresh_ids)
+                if vector_store is None:
+                    self.generations.discard(generation)
+                    return False
+            else:
+                # ONLY ADDING VECTORS OR DROPPING THEM FROM IVF LISTS NEEDS A WRITABLE IN-MEMORY COPY; A DELETE FROM
+                # A FLAT OR HNSW INDEX ONLY TOMBSTONES SLOTS AND KEEPS THE MEMORY-MAPPED FILE, WHICH IS THEN SHARED
+                writable = bool(fresh_docs) or (bool(stale_ids) and faiss.try_extract_index_ivf(current.index) is not None)
+                vector_store = ChunkFAISS.open(self.generations.path(self.generation), self.generations.chunks, self.embeddings, mmap=not writable)
+                # HANDLE DELETION: REMOVE ONLY THE CHUNKS THAT DISAPPEARED
+                if stale_ids:
+                    vector_store.delete(stale_ids)
+                # EMBED ONLY NEW OR CHANGED CHUNK TEXTS, APPENDING BATCH BY BATCH
+                for batch, vectors in self.embedding_engine.stream(zip(fresh_docs, fresh_ids), text=lambda item: item[0].page_content):
+                    vector_store.add_embeddings(
+                        [(doc.page_content, vector) for (doc, _), vector in zip(batch, vectors)],
+                        metadatas=[doc.metadata for doc, _ in batch],
+                        ids=[chunk_id for _, chunk_id in batch]
+                    )
+            logger.info(f"Removed {len(stale_ids)} stale chunks, added {len(fresh_docs)} new chunks")
+
+            lexical = self._update_lexical(current, vector_store, stale_ids, fresh_docs, fresh_ids, compact)
+            self._publish(generation, vector_store, files, index_info, lexical)
             logger.info("Vector store updated successfully")
-            self.vector_store = vector_store
-            self.processor.update_vector_store(vector_store)
             return True
         except Exception as e:
             logger.info(f"Update failed: {str(e)}")
-            # RESTORE BACKUP
-            if os.path.exists(backup_dir):
-                shutil.move(backup_dir, self.vector_dir)
+            if generation is not None:
+                self.generations.discard(generation)
             return False
-    
+
+    def _publish(self, generation, vector_store, files, index_info, lexical=None):
+        """WRITE vector_store, ITS BM25 INDEX AND META INTO generation, FLIP THE CURRENT POINTER AND SERVE IT"""
+        directory = self.generations.path(generation)
+        vector_store.save_local(directory)
+        if lexical is not None:
+            lexical.save(directory)
+        self._save_metadata(self._registry_metadata(files, index_info), directory)
+        self.generations.publish(generation, vector_store.ids())
+        self.index_info = index_info
+        self.source_counts = self._source_counts(files)
+        self._install(generation)
+
+    def _install(self, generation):
+        """SERVE generation: READ-ONLY, INDEX MEMORY-MAPPED, CHUNKS LOADED ON SEARCH HITS"""
+        directory = self.generations.path(generation)
+        vector_store = ChunkFAISS.open(directory, self.generations.chunks, self.embeddings)
+        self.index_factory.tune(vector_store.index)
+        if self.config.HYBRID_RETRIEVAL:
+            vector_store.lexical = LexicalIndex.load(directory, **self._bm25_params())
+            if vector_store.lexical is None:
+                # GENERATIONS PUBLISHED BEFORE LEXICAL INDEXES: BUILT ONCE, ADDED BESIDE THE UNCHANGED FILES
+                logger.info(f"building missing BM25 index for {generation}")
+                LexicalIndex.build(self._slot_texts(vector_store)).save(directory)
+                vector_store.lexical = LexicalIndex.load(directory, **self._bm25_params())
+        self.generations.acquire(generation)
+        self.vector_store = vector_store
+        self.generation = generation
+        # THE OLD GENERATION IS DELETED ONCE ITS LAST IN-FLIGHT SEARCH RETURNS
+        self.processor.update_vector_store(vector_store, on_release=lambda: self._retire(generation))
+
+    def _retire(self, generation):
+        # OFF THE RELEASING REQUEST THREAD: COLLECTION DELETES FILES AND PURGES CHUNK ROWS
+        threading.Thread(target=self.generations.release, args=(generation,), name="generation-gc", daemon=True).start()
+
+    def _bm25_params(self):
+        return {"k1": self.config.BM25_K1, "b": self.config.BM25_B}
+
+    @staticmethod
+    def _slot_texts(vector_store):
+        """TEXT PER SLOT, None FOR TOMBSTONES, SO BM25 DOC NUMBERS MATCH FAISS IDS"""
+        return (doc.page_content if doc is not None else None for _, doc in vector_store.iter_slots())
+
+    def _update_lexical(self, current, vector_store, stale_ids, fresh_docs, fresh_ids, compact=False):
+        """BM25 INDEX FOR vector_store, DERIVED FROM THE SERVED ONE
+
+        AN INCREMENTAL UPDATE KEEPS EVERY SLOT AND APPENDS FRESH CHUNKS AFTER THE LAST ONE; A REBUILD
+        (compact) KEEPS THE SURVIVORS IN ORDER AND APPENDS FRESH CHUNKS AFTER THEM. EITHER WAY THE TAIL
+        OF vector_store PAST THE CARRIED-OVER DOCS IS WHAT WAS ADDED.
+        """
+        if not self.config.HYBRID_RETRIEVAL:
+            return None
+        if current.lexical is None:
+            return LexicalIndex.build(self._slot_texts(vector_store), **self._bm25_params())
+        positions = current.index_to_docstore_id
+        removed = positions.positions(stale_ids).values()
+        carried = len(positions) - len(removed) if compact else positions.slots()
+        texts = {chunk_id: doc.page_content for doc, chunk_id in zip(fresh_docs, fresh_ids)}
+        appended = vector_store.ids()[carried:]
+        return current.lexical.updated(removed, [texts[chunk_id.decode("ascii")] for chunk_id in appended], compact=compact)
+
+    @staticmethod
+    def _source_counts(files):
+        return {rel_path: len(entry.get("ids", [])) for rel_path, entry in files.items()} if files is not None else None
+
+    def stats(self) -> dict:
+        """STORE STATISTICS FROM METADATA AND FILE SIZES, NEVER FROM THE VECTORS THEMSELVES"""
+        if self.vector_store is None:
+            return {"loaded": False}
+        directory = self.generations.path(self.generation)
+        index_bytes = sum(f.stat().st_size for f in directory.rglob("*") if f.is_file())
+        chunk_bytes = sum(f.stat().st_size for f in self.vector_dir.glob(self.generations.chunks.path.name + "*"))
+        info = self.index_info or {}
+        lexical = self.vector_store.lexical
+        return {
+            "loaded": True,
+            "generation": self.generation,
+            "ntotal": len(self.vector_store.index_to_docstore_id),
+            "tombstones": self.vector_store.index_to_docstore_id.dead(),
+            "dim": self.vector_store.index.d,
+            "index_type": info.get("type", "flat"),
+            "index_factory": info.get("factory"),
+            "bytes_on_disk": {"index": index_bytes, "chunks": chunk_bytes, "total": index_bytes + chunk_bytes},
+            "lexical": {"terms": len(lexical.vocab), "postings": len(lexical.docs)} if lexical is not None else None,
+            "files": len(self.source_counts) if self.source_counts is not None else None,
+            "chunks_per_source": self.source_counts,
+        }
+
+    def _rebuild_index(self, vector_store, stale_ids, fresh_docs, fresh_ids):
+        """REBUILD (AND RETRAIN) THE INDEX WITHOUT RE-PARSING THE KNOWLEDGE DIR, DROPPING ALL TOMBSTONES
+
+        SURVIVING CHUNKS ARE STREAMED FROM THE CHUNK STORE. THEIR VECTORS ARE READ BACK FROM THE
+        SERVED INDEX WHEN IT STORES THEM UNCOMPRESSED (FLAT, HNSW, IVF-FLAT), ELSE THEY COME FROM THE
+        EMBEDDING CACHE; ONLY fresh_docs ARE SURE TO COST AN OLLAMA ROUND-TRIP. RETURNS
+        (store, index_info), store IS None WHEN NO CHUNKS ARE LEFT.
+        """
+        stale = set(stale_ids)
+        total = len(vector_store.index_to_docstore_id) - len(stale) + len(fresh_docs)
+        logger.info(f"rebuilding {self.index_factory.kind} index over {total} chunks")
+        builder = StoreBuilder(self.index_factory, self.embeddings, self.generations.chunks, expected_total=total)
+        fresh = zip(fresh_docs, fresh_ids)
+        # A PRIVATE MEMORY-MAPPED VIEW: READING IVF VECTORS BACK ATTACHES A DIRECT MAP TO THE INDEX OBJECT
+        source = ChunkFAISS.open(self.generations.path(self.generation), self.generations.chunks, self.embeddings)
+        if source.stores_vectors():
+            batch = []
+            for slot, doc in itertools.chain(source.iter_slots(), [(None, None)]):
+                if doc is not None and doc.id not in stale:
+                    batch.append((slot, doc))
+                if batch and (slot is None or len(batch) >= self.REBUILD_BATCH):
+                    builder.add(
+                        [doc.page_content for _, doc in batch],
+                        source.reconstruct([slot for slot, _ in batch]),
+                        [doc.metadata for _, doc in batch],
+                        [doc.id for _, doc in batch]
+                    )
+                    batch = []
+            items = fresh
+        else:
+            items = itertools.chain(((doc, doc.id) for doc in source.iter_documents() if doc.id not in stale), fresh)
+        for batch, vectors in self.embedding_engine.stream(items, text=lambda item: item[0].page_content):
+            builder.add(
+                [doc.page_content for doc, _ in batch],
+                vectors,
+                [doc.metadata for doc, _ in batch],
+                [chunk_id for _, chunk_id in batch]
+            )
+        return builder.finish(), builder.info
+
     # THE FOLLOWING FUNCTIONS ARE MIGRATED FROM app/knowledge_manager.py ====================================
     def vector_store_exists(self) -> bool:
-        return (self.vector_dir / self.config.FAISS_FILE).exists()
+        # A SINGLE-DIRECTORY STORE FROM BEFORE GENERATIONS IS MIGRATED ON LOAD
+        return self.generations.current() is not None or (self.vector_dir / self.config.FAISS_FILE).exists()
 
     def process_knowledge_base(self):
+        generation = None
         try:
-            docs = self._load_documents()
-            documents = self.text_splitter.split_documents(docs)
-            self.vector_store = FAISS.from_documents(documents, self.embeddings, ids=[f"doc_{i}" for i in range(len(documents))])
+            # PARSE, SPLIT AND EMBED IN OVERLAPPING STAGES; FILES ARRIVE AS THEIR LAST CHUNK IS EMBEDDED
+            # AND ARE APPENDED TO THE INDEX RIGHT AWAY, SO ONLY IN-FLIGHT FILES ARE HELD IN MEMORY
+            pipeline = IngestionPipeline(self.config, self.LOADER_MAPPING, self.text_splitter, self.embedding_engine, self.change_detector)
+            # SIZE IVF CELLS FOR THE PREVIOUS CORPUS WHEN THERE IS ONE, ELSE FOR THE TRAINING SAMPLE
+            previous = self._file_registry(self._load_metadata()) or {}
+            generation = self.generations.create()
+            builder = StoreBuilder(self.index_factory, self.embeddings, self.generations.chunks, expected_total=sum(len(e.get("ids", [])) for e in previous.values()))
+            lexical = LexicalBuilder() if self.config.HYBRID_RETRIEVAL else None
+            files, total = {}, 0
+            for item in pipeline.run(list(self.change_detector.walk())):
+                if item.fingerprint is None:
+                    continue  # REMOVED DURING THE BUILD
+                # ASSIGN PER-FILE CHUNK IDS SO LATER UPDATES CAN REMOVE EXACTLY ONE FILE'S VECTORS
+                file_ids = self._new_ids(len(item.chunks))
+                files[item.rel_path] = dict(
+                    item.fingerprint,
+                    ids=file_ids,
+                    chunk_hashes=[self._chunk_hash(doc) for doc in item.chunks]
+                )
+                if not item.chunks:
+                    continue
+                builder.add([doc.page_content for doc in item.chunks], item.vectors, [doc.metadata for doc in item.chunks], file_ids)
+                if lexical is not None:
+                    lexical.add(doc.page_content for doc in item.chunks)  # SAME ORDER AS THE FAISS POSITIONS
+                total += len(file_ids)
+            vector_store = builder.finish()
+            if vector_store is None:
+                logger.error("load returns empty document list, possible reasons are:")
+                logger.error("1. file format is not supported")
+                logger.error("2. file has empty content")
+                logger.error("3. file encoding error文件编码错误")
+                raise ValueError("no chunks could be built from the knowledge directory")
+            # CREATE META NEXT TO THE NEW INDEX AND PUBLISH BOTH TOGETHER
+            if lexical is not None:
+                lexical = LexicalIndex.from_postings(*lexical.postings(), **self._bm25_params())
+            self._publish(generation, vector_store, files, builder.info, lexical)
             subprocess.run([
                 "chown", "-R", 
                 f"{self.config.SERVICE_USER}:{self.config.SERVICE_USER}",
                 self.config.VECTOR_DIR
             ])
-            self.vector_store.save_local(str(self.vector_dir))
-            self.processor.update_vector_store(self.vector_store)
-            # CREATE META
-            metadata = {}
-            for doc in docs:
-                rel_path = os.path.relpath(doc.metadata['source'], self.knowledge_dir)
-                metadata[rel_path] = self._doc_hash(doc.metadata['source'])
-            self._save_metadata(metadata)
-            
-            logger.info(f"Vector store built with {len(documents)} chunks")
+            logger.info(f"Vector store built with {total} chunks ({self.index_info['factory']})")
             return self.vector_store
         except Exception as e:
+            if generation is not None and generation != self.generation:
+                self.generations.discard(generation)
             self._generate_coredump()
             raise
     
-    def _load_documents(self):
-        # CREATE LOAD DYNAMICALLY
-        def dispatch_loader(file_path: str):
-            ext = Path(file_path).suffix.lower()
-            logger.info(F"file ({file_path}) with extension {ext}")
-            if ext in self.LOADER_MAPPING:
-                loader_class, loader_args = self.LOADER_MAPPING[ext]
-                return loader_class(file_path, **loader_args)
-            return None  # INGORE UNSUPPORTED FORMAT
-
-        # INITIALIZE DirectoryLoader (new API)
-        try:
-            loader = DirectoryLoader(
-                    self.config.KNOWLEDGE_DIR,
-                    loader_cls=dispatch_loader,
-                    use_multithreading=True,
-                    show_progress=True,
-                    silent_errors=True  # SKIP ERROR FILE SLIENTLY
-                    )
-            docs = loader.load()            
-            logger.info(f"successfully load {len(docs)} documents")
-            if len(docs) == 0:
-                logger.error("load returns empty document list, possible reasons are:")
-                logger.error("1. file format is not supported")
-                logger.error("2. file has empty content")
-                logger.error("3. file encoding error文件编码错误")
-            return docs if docs else []
-        except Exception as e:
-            logger.error(f"document load failure:{str(e)}")
-            return []
-
     def _generate_coredump(self):
         """CREATE CORE DUMP FILE (Linux ONLY)"""
         dump_dir = Path("/var/crash/knowledge_service")
@@ -287,11 +477,14 @@ class VectorManager:
 
     def load_vector_store(self):
         try:
-            self.vector_store = FAISS.load_local(
-                str(self.vector_dir),
-                self.embeddings,
-                allow_dangerous_deserialization=True  # OLD FORMAT IS ALLOWED
-            )
-            self.processor.update_vector_store(self.vector_store)
+            # MEMORY-MAPPED INDEX AND SQLITE CHUNK STORE, A SINGLE-DIRECTORY STORE IS MIGRATED ONCE
+            self.generations.migrate_legacy()
+            generation = self.generations.current()
+            if generation is None:
+                raise FileNotFoundError(f"no published vector store generation in {self.vector_dir}")
+            metadata = self._load_metadata()
+            self.index_info = metadata.get("index")
+            self.source_counts = self._source_counts(self._file_registry(metadata))
+            self._install(generation)
         except Exception as e:
             raise
\ No newline at end of file
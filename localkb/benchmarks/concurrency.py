@@ -0,0 +1,71 @@
+"""
+CONCURRENCY BENCHMARK FOR THE KNOWLEDGE SERVICE
+
+FIRES N PARALLEL CLIENTS AT /api/ask OR /api/ask_stream AND COMPARES THE
+WALL-CLOCK TIME AGAINST THE SUM OF THE PER-REQUEST LATENCIES. WHEN REQUESTS
+SERIALIZE ON THE EVENT LOOP THE EFFECTIVE CONCURRENCY STAYS CLOSE TO 1.
+
+USAGE (FROM localkb/):
+    python -m benchmarks.concurrency --clients 8 --endpoint ask_stream
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from pathlib import Path
+import aiohttp
+
+
+async def _one_request(session, url, api_key, question, stream):
+    start = time.perf_counter()
+    first_chunk = None
+    async with session.post(url, json={"question": question}, headers={"X-API-Key": api_key}) as resp:
+        resp.raise_for_status()
+        if stream:
+            async for line in resp.content:
+                if first_chunk is None and line.startswith(b"data:"):
+                    first_chunk = time.perf_counter() - start
+        else:
+            await resp.json()
+    return time.perf_counter() - start, first_chunk
+
+
+async def run(base_url, api_key, endpoint, clients, rounds, question):
+    url = f"{base_url}/api/{endpoint}"
+    stream = endpoint == "ask_stream"
+    timeout = aiohttp.ClientTimeout(total=None)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        # WARM UP MODELS SO THE FIRST ROUND DOES NOT MEASURE LOADING
+        await _one_request(session, url, api_key, question, stream)
+
+        for n in range(1, rounds + 1):
+            wall_start = time.perf_counter()
+            results = await asyncio.gather(*[
+                _one_request(session, url, api_key, question, stream) for _ in range(clients)
+            ])
+            wall = time.perf_counter() - wall_start
+            latencies = [latency for latency, _ in results]
+            ttfts = [ttft for _, ttft in results if ttft is not None]
+            concurrency = sum(latencies) / wall if wall > 0 else 0.0
+            print(f"round {n}: clients={clients} wall={wall:.2f}s "
+                  f"mean={statistics.mean(latencies):.2f}s max={max(latencies):.2f}s "
+                  f"effective_concurrency={concurrency:.2f}"
+                  + (f" ttft_mean={statistics.mean(ttfts):.2f}s" if ttfts else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="parallel client benchmark for the knowledge service")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--key-file", default=str(Path(__file__).resolve().parents[1] / "key" / "api.key"))
+    parser.add_argument("--endpoint", choices=["ask", "ask_stream"], default="ask_stream")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--question", default="How do I restart the service after a failed update?")
+    args = parser.parse_args()
+
+    api_key = Path(args.key_file).read_text().strip()
+    asyncio.run(run(args.url, api_key, args.endpoint, args.clients, args.rounds, args.question))
+
+
+if __name__ == "__main__":
+    main()
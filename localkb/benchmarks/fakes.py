@@ -0,0 +1,114 @@
+"""
+OFFLINE STAND-INS FOR OLLAMA AND THE CROSS ENCODER
+
+FakeOllama KEEPS THE OllamaClient INTERFACE (INCLUDING run_sync) BUT ANSWERS
+LOCALLY, SO OllamaClientEmbeddings AND OllamaClientLLM ARE EXERCISED UNCHANGED.
+EMBEDDINGS ARE FEATURE-HASHED BAGS OF WORDS: DETERMINISTIC ACROSS RUNS AND
+MACHINES, AND TEXTS SHARING WORDS LAND CLOSE TOGETHER, SO RECALL IS MEANINGFUL.
+"""
+import re
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+import numpy as np
+from app.ollama_client import OllamaClient
+from app.reranker import CrossEncoderReranker, RerankBatcher
+
+TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN.findall(text.lower())
+
+
+def hashed_embedding(text: str, dim: int) -> List[float]:
+    vector = np.zeros(dim, dtype=np.float32)
+    for token in tokenize(text):
+        digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], "little") % dim
+        vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+    return vector.tolist()
+
+
+class FakeOllama(OllamaClient):
+    """OllamaClient WITHOUT THE HTTP SERVER"""
+
+    def __init__(self, model: str = "fake", dim: int = 256, embed_delay: float = 0.0):
+        super().__init__(base_url="http://fake-ollama", model=model)
+        self.dim = dim
+        self.embed_delay = embed_delay  # SIMULATED PER-REQUEST LATENCY
+        self.embed_calls = 0
+        self._thread = None
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+
+    async def close(self):
+        pass
+
+    async def health_check(self):
+        pass
+
+    def start_background(self):
+        """RUN THE CLIENT LOOP ON A DAEMON THREAD, AS THE SERVICE DOES FOR ITS WORKER THREADS"""
+        loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=loop.run_forever, name="fake-ollama", daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self.start(), loop).result()
+        return self
+
+    def stop_background(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout=5.0)
+
+    async def generate(self, prompt: str, **kwargs):
+        if kwargs.get("format") == "json":
+            return '{"is_question": true, "refined_query": ""}'
+        return "fake answer"
+
+    async def generate_stream(self, prompt: str, system: Optional[str] = None):
+        for token in ("fake", " ", "answer"):
+            yield token
+
+    async def embed(self, texts: List[str], model: Optional[str] = None) -> List[List[float]]:
+        self.embed_calls += 1
+        if self.embed_delay:
+            await asyncio.sleep(self.embed_delay)
+        return [hashed_embedding(text, self.dim) for text in texts]
+
+
+class FakeReranker(CrossEncoderReranker):
+    """CrossEncoderReranker WITH A LEXICAL-OVERLAP SCORER IN PLACE OF THE MODEL
+
+    THE WORKER POOL AND MICRO-BATCHER ARE THE REAL ONES, ONLY _forward IS REPLACED.
+    """
+
+    def load(self):
+        with self._load_lock:
+            if self.model is not None:
+                return
+            self.model = "lexical"
+            self.executor = ThreadPoolExecutor(max_workers=self.config.RERANK_THREADS, thread_name_prefix="rerank")
+            if self.config.RERANK_BATCHING:
+                self.batcher = RerankBatcher(
+                    forward=self._forward,
+                    executor=self.executor,
+                    workers=self.config.RERANK_THREADS,
+                    window_ms=self.config.RERANK_BATCH_WINDOW_MS,
+                    max_batch_size=self.config.RERANK_MAX_BATCH_SIZE
+                )
+
+    def _forward(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        scores = []
+        for question, passage in pairs:
+            terms = set(tokenize(question))
+            words = tokenize(passage)
+            hits = sum(1 for word in words if word in terms)
+            scores.append(hits / (len(words) ** 0.5) if words else 0.0)
+        return scores
@@ -0,0 +1,266 @@
+"""
+RECALL / LATENCY BENCHMARK FOR THE RETRIEVAL STACK
+
+BUILDS THE VECTOR STORE THROUGH VectorManager ONCE PER INDEX TYPE, THEN RUNS A
+LABELLED QUESTION SET THROUGH RAW similarity_search AND THROUGH THE
+KnowledgeProcessor.retrieve_context_rerank PIPELINE: retrieve_candidates (HYBRID WHEN
+BM25 IS ENABLED), select_context (RERANK SET SIZED BY THE RERANK POLICY) AND CONTEXT
+PACKING. THE PIPELINE IS UNROLLED BECAUSE retrieve_context_rerank ONLY RETURNS THE
+PACKED TEXT, AND RECALL IS SCORED ON THE SELECTED DOCUMENTS. REPORTS recall@k, MRR, p50/p95/p99
+LATENCY, QPS AND RSS, PLUS OVERLAP WITH THE FLAT (EXACT) RESULTS FOR ANN INDEXES.
+
+RUNS OFFLINE: EMBEDDINGS COME FROM benchmarks.fakes.FakeOllama AND THE CROSS
+ENCODER IS REPLACED BY A LEXICAL SCORER BEHIND THE REAL BATCHING PATH.
+
+THE CORPUS IS EITHER SYNTHETIC (--docs/--words, ONE TOPIC PER FILE) OR A FIXTURE
+DIRECTORY WITH A JSONL QUESTION FILE OF {"question": ..., "source": <relative path>}.
+
+USAGE (FROM localkb/):
+    python -m benchmarks.retrieval --docs 3000 --index flat ivfflat hnsw
+    python -m benchmarks.retrieval --corpus fixtures/kb --questions-file fixtures/kb.jsonl
+"""
+import argparse
+import gc
+import getpass
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+logging.basicConfig(level=logging.WARNING, format="%(name)s %(levelname)s %(message)s")
+
+import psutil
+from langchain_community.document_loaders import TextLoader
+from app.config import UbuntuConfig
+from app.index_factory import IndexFactory
+from app.knowledge_processor import KnowledgeProcessor
+from app.ollama_client import OllamaClientEmbeddings
+from app.utils.metrics import LatencyTracker
+from app.vector_manager import VectorManager
+from benchmarks.fakes import FakeOllama, FakeReranker
+
+SYLLABLES = ["ka", "lo", "mi", "ra", "tu", "ne", "si", "po", "da", "ve", "zo", "hu", "fi", "ga", "be", "xo"]
+
+
+def build_corpus(directory: Path, docs: int, words: int, questions: int, seed: int):
+    """ONE TOPIC PER FILE: TOPIC KEYWORDS MIXED INTO SHARED FILLER; QUESTIONS USE A FEW KEYWORDS"""
+    rng = random.Random(seed)
+
+    def word(syllables):
+        return "".join(rng.choice(SYLLABLES) for _ in range(syllables))
+
+    filler = [word(3) for _ in range(3000)]
+    topics = []
+    directory.mkdir(parents=True, exist_ok=True)
+    for i in range(docs):
+        keywords = [word(4) for _ in range(12)]
+        sentences = []
+        for _ in range(max(1, words // 12)):
+            sentence = [rng.choice(keywords) if rng.random() < 0.3 else rng.choice(filler) for _ in range(12)]
+            sentences.append(" ".join(sentence).capitalize() + ".")
+        paragraphs = [" ".join(sentences[p:p + 5]) for p in range(0, len(sentences), 5)]
+        rel_path = f"doc_{i:05d}.txt"
+        (directory / rel_path).write_text("\n\n".join(paragraphs), encoding="utf-8")
+        topics.append((rel_path, keywords))
+
+    labelled = []
+    for rel_path, keywords in rng.sample(topics, min(questions, len(topics))):
+        terms = rng.sample(keywords, 4) + rng.sample(filler, 2)
+        rng.shuffle(terms)
+        labelled.append({"question": "how does " + " ".join(terms) + " work?", "source": rel_path})
+    return labelled
+
+
+def load_questions(path: Path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def make_config(work_dir: Path, corpus_dir: Path, index_type: str, args):
+    class BenchConfig(UbuntuConfig):
+        DATA_DIR = work_dir / index_type
+        KNOWLEDGE_DIR = corpus_dir
+        VECTOR_DIR = DATA_DIR / "vectors"
+        SERVICE_USER = getpass.getuser()
+        INDEX_TYPE = index_type
+        EMBEDDING_CACHE_ENABLED = False  # EVERY INDEX PAYS THE SAME EMBEDDING COST
+        ANSWER_CACHE_ENABLED = False
+        RETRIEVAL_THREADS = args.threads
+    if args.nlist:
+        BenchConfig.INDEX_NLIST = args.nlist
+    if args.nprobe:
+        BenchConfig.FAISS_NPROBE = args.nprobe
+    if args.ef_search:
+        BenchConfig.INDEX_HNSW_EF_SEARCH = args.ef_search
+    if args.rerank_budget_ms:
+        BenchConfig.RERANK_LATENCY_BUDGET_MS = args.rerank_budget_ms
+    BenchConfig.RERANK_ADAPTIVE = not args.rerank_all
+    if args.lexical is not None:
+        BenchConfig.HYBRID_RETRIEVAL = args.lexical > 0
+        BenchConfig.LEXICAL_CANDIDATES = args.lexical
+    return BenchConfig
+
+
+def measure(fn, questions, threads):
+    """RUN fn OVER ALL QUESTIONS ON threads WORKERS; RETURNS (results, latency snapshot, qps)"""
+    latency = LatencyTracker(window=len(questions))
+
+    def timed(question):
+        start = time.perf_counter()
+        result = fn(question)
+        latency.record(time.perf_counter() - start)
+        return result
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(timed, questions))
+    wall = time.perf_counter() - start
+    return results, latency.snapshot(), round(len(questions) / wall, 1) if wall > 0 else 0.0
+
+
+def ranking_metrics(ranked_sources, gold_sources, k):
+    hits, reciprocal = 0, 0.0
+    for ranked, gold in zip(ranked_sources, gold_sources):
+        ranked = ranked[:k]
+        if gold in ranked:
+            hits += 1
+            reciprocal += 1.0 / (ranked.index(gold) + 1)
+    total = len(gold_sources) or 1
+    return {f"recall@{k}": round(hits / total, 4), "mrr": round(reciprocal / total, 4)}
+
+
+def rss_mb():
+    return round(psutil.Process().memory_info().rss / 2**20, 1)
+
+
+def bench_index(index_type, corpus_dir, work_dir, labelled, embeddings, args, exact=None):
+    config = make_config(work_dir, corpus_dir, index_type, args)
+    reranker = FakeReranker(config)
+    processor = KnowledgeProcessor(config, reranker=reranker)
+    manager = VectorManager(config, processor, embeddings=embeddings)
+    manager.start()
+    # PLAIN TEXT FIXTURES DO NOT NEED unstructured, WHICH MAY FETCH NLTK DATA ON FIRST USE
+    manager.LOADER_MAPPING[".txt"] = (TextLoader, {"encoding": "utf-8"})
+    reranker.load()
+
+    start = time.perf_counter()
+    store = manager.process_knowledge_base()
+    build_s = time.perf_counter() - start
+    rss_built = rss_mb()
+
+    questions = [item["question"] for item in labelled]
+    gold = [item["source"] for item in labelled]
+
+    def sources(docs):
+        return [os.path.relpath(doc.metadata["source"], corpus_dir) for doc in docs]
+
+    raw, raw_latency, raw_qps = measure(lambda q: store.similarity_search(q, k=args.k), questions, args.threads)
+    report = {
+        "requested": index_type,
+        "index": manager.index_info["factory"],
+        "chunks": store.index.ntotal,
+        "build_s": round(build_s, 2),
+        "rss_mb_after_build": rss_built,
+        "search": dict(ranking_metrics([sources(docs) for docs in raw], gold, args.k), latency=raw_latency, qps=raw_qps),
+    }
+    if exact is not None:
+        overlap = [
+            len({(d.metadata["source"], d.page_content) for d in got} & {(d.metadata["source"], d.page_content) for d in want}) / max(1, len(want))
+            for got, want in zip(raw, exact)
+        ]
+        report["search"][f"overlap@{args.k}_with_flat"] = round(sum(overlap) / max(1, len(overlap)), 4)
+
+    def rerank_path(question):
+        # retrieve_context_rerank, KEEPING THE SELECTED DOCUMENTS TO SCORE
+        docs = processor.select_context(question, processor.retrieve_candidates(question, top_k=args.k))
+        processor.assembler.assemble(docs, question)
+        return sources(docs)
+
+    kept, rerank_latency, rerank_qps = measure(rerank_path, questions, args.threads)
+    top_n = max((len(k) for k in kept), default=0) or 1
+    report["rerank"] = dict(ranking_metrics(kept, gold, top_n), latency=rerank_latency, qps=rerank_qps)
+    report["rerank_policy"] = processor.policy.stats()
+    report["rss_mb_after_queries"] = rss_mb()
+
+    reranker.close()
+    return report, raw
+
+
+def print_report(reports):
+    header = f"{'index':<24}{'chunks':>8}{'build_s':>9}{'path':>10}{'recall':>8}{'mrr':>7}{'p50_ms':>9}{'p95_ms':>9}{'p99_ms':>9}{'qps':>9}{'rss_mb':>9}"
+    print(header)
+    print("-" * len(header))
+    for report in reports:
+        for path in ("search", "rerank"):
+            stats = report[path]
+            metric, recall = next((k, v) for k, v in stats.items() if k.startswith("recall@"))
+            latency = stats["latency"]
+            label = f"{report['requested']} ({report['index']})"
+            print(f"{label:<24}{report['chunks']:>8}{report['build_s']:>9}{path + metric[6:]:>10}{recall:>8}{stats['mrr']:>7}"
+                  f"{latency['p50_ms']:>9}{latency['p95_ms']:>9}{latency['p99_ms']:>9}{stats['qps']:>9}{report['rss_mb_after_queries']:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="offline recall/latency benchmark for the retrieval stack")
+    parser.add_argument("--corpus", help="fixture knowledge directory (default: synthetic corpus)")
+    parser.add_argument("--questions-file", help="JSONL of {question, source} for --corpus")
+    parser.add_argument("--docs", type=int, default=2000, help="synthetic corpus size in files")
+    parser.add_argument("--words", type=int, default=400, help="words per synthetic file")
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--index", nargs="+", choices=IndexFactory.TYPES, default=list(IndexFactory.TYPES))
+    parser.add_argument("--k", type=int, default=5, help="candidates per similarity search")
+    parser.add_argument("--threads", type=int, default=4, help="concurrent querying threads")
+    parser.add_argument("--dim", type=int, default=256, help="fake embedding dimension")
+    parser.add_argument("--nlist", type=int, default=0)
+    parser.add_argument("--nprobe", type=int, default=0)
+    parser.add_argument("--ef-search", type=int, default=0)
+    parser.add_argument("--rerank-budget-ms", type=float, default=0, help="per-request cross-encoder budget")
+    parser.add_argument("--rerank-all", action="store_true", help="disable the adaptive policy, rerank every candidate")
+    parser.add_argument("--lexical", type=int, help="BM25 candidates fused before reranking, 0 = vector only")
+    parser.add_argument("--json", help="write the full report to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the work directory")
+    args = parser.parse_args()
+
+    work_dir = Path(tempfile.mkdtemp(prefix="kb-bench-"))
+    if args.corpus:
+        if not args.questions_file:
+            parser.error("--corpus needs --questions-file")
+        corpus_dir = Path(args.corpus).resolve()
+        labelled = load_questions(Path(args.questions_file))
+    else:
+        corpus_dir = work_dir / "knowledge"
+        labelled = build_corpus(corpus_dir, args.docs, args.words, args.questions, args.seed)
+    print(f"corpus {corpus_dir}: {sum(1 for _ in corpus_dir.rglob('*') if _.is_file())} files, {len(labelled)} questions")
+
+    ollama = FakeOllama(dim=args.dim).start_background()
+    embeddings = OllamaClientEmbeddings(ollama)
+    reports, exact = [], None
+    try:
+        # FLAT FIRST SO ANN INDEXES CAN BE COMPARED WITH EXACT RESULTS
+        for index_type in sorted(args.index, key=lambda t: t != "flat"):
+            report, raw = bench_index(index_type, corpus_dir, work_dir, labelled, embeddings, args, exact)
+            if index_type == "flat":
+                exact = raw
+            reports.append(report)
+            gc.collect()
+    finally:
+        ollama.stop_background()
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_report(reports)
+    for report in reports:
+        print(f"{report['requested']} rerank policy: {report['rerank_policy']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+import asyncio
+import time
+from app import main
+from app.file_monitor import FileMonitor
+
+
+def test_shutdown_indexes_pending_changes(tmp_path):
+    """A CHANGE STILL INSIDE THE DEBOUNCE WINDOW IS INDEXED ON SHUTDOWN, THROUGH A CALLBACK THAT
+    NEEDS THE SERVING LOOP, JUST AS EMBEDDING DOES, WITHOUT WAITING OUT THE STOP TIMEOUT"""
+    indexed = []
+
+    def update_callback(paths):
+        # OllamaClientEmbeddings BRIDGES EVERY EMBEDDING CALL ONTO THE SERVING LOOP LIKE THIS
+        indexed.extend(main.ollama.run_sync(asyncio.sleep(0, result=sorted(paths))))
+
+    async def serve_and_shut_down():
+        await main.ollama.start()
+        main.monitor = FileMonitor(tmp_path, update_callback, debounce=30.0, stop_timeout=30.0)
+        main.monitor.start()
+        await asyncio.sleep(0.3)
+        (tmp_path / "pending.txt").write_text("changed just before shutdown")
+        deadline = time.monotonic() + 5.0
+        while not main.monitor.event_handler.pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        assert main.monitor.event_handler.pending
+        start = time.monotonic()
+        await main.shutdown_event()
+        return time.monotonic() - start
+
+    elapsed = asyncio.run(serve_and_shut_down())
+    assert indexed == [str(tmp_path / "pending.txt")]
+    assert elapsed < 10.0
+    assert main.monitor is None
+    assert main.shutdown_requested.is_set()